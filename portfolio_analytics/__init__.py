@@ -0,0 +1,7 @@
+"""
+Shared building blocks for the portfolio analysis scripts.
+
+The scripts in the repository root ("ESG Analysis.py", "Performance Calculations.py", ...)
+import from the modules in this package so that loading and the heavier calculations are
+written once and reused.
+"""
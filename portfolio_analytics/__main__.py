@@ -0,0 +1,3 @@
+from portfolio_analytics.cli import main
+
+raise SystemExit(main())
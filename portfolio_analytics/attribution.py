@@ -0,0 +1,203 @@
+"""
+Contribution attribution by any set of dimensions and periods.
+
+Every (dimension, period) table used to be a separate groupby over the full holdings frame.
+Here the frame is reduced once: each dimension is turned into integer group codes, all of them
+are stacked into one key together with the date code, and a single bincount per value column
+produces group x date matrices. Any period is then just a slice of date columns of those
+matrices, so adding a dimension or a period no longer costs a rescan of the holdings.
+
+Summing daily contributions does not add up to the compounded return of a period. With a linking
+method (Carino, Menchero or GRAP) every daily contribution is scaled by a factor of its date and
+period so that the contributions of a period add up exactly to its compounded return. The
+factors of all periods are one (periods x dates) matrix built from cumulative sums and products
+of the daily portfolio returns, and the contributions of every group and period are a single
+matrix product with it.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.grouping import DateGroupSums
+from portfolio_analytics.instrumentation import instrumented
+
+# Holdings columns reported as of the last day of each period, and their names in the tables
+EXPOSURE_COLUMNS = {'Weight (%)': 'Exposure', 'Active Weight (%)': 'Active Exposure'}
+
+# Periods that are resolved relative to the last date of the data
+STANDARD_PERIODS = ('ITD', 'YTD', 'QTD', 'MTD')
+
+# Multi-period linking methods, None sums the daily contributions
+LINKING_METHODS = ('carino', 'menchero', 'grap')
+
+
+def resolve_period(period, dates):
+    """
+    Translates a period into a [start, end] range of positions in the sorted unique dates.
+
+    :param period: str ('ITD', 'YTD', 'QTD', 'MTD') or tuple (label, start, end), start/end may be None
+    :param dates: pandas DatetimeIndex, sorted unique refdates
+    :return: tuple, (label, start position, end position); end < start when the period is empty
+    """
+    last_date = dates[-1]
+    if isinstance(period, str):
+        label, end = period, None
+        if period == 'ITD':
+            start = None
+        elif period == 'YTD':
+            start = pd.Timestamp(year=last_date.year, month=1, day=1)
+        elif period == 'QTD':
+            start = pd.Timestamp(year=last_date.year, month=3 * ((last_date.month - 1) // 3) + 1, day=1)
+        elif period == 'MTD':
+            start = pd.Timestamp(year=last_date.year, month=last_date.month, day=1)
+        else:
+            raise ValueError(f'Unknown period {period!r}, expected one of {STANDARD_PERIODS} or a (label, start, end) tuple')
+    else:
+        label, start, end = period
+
+    start_position = 0 if start is None else int(dates.searchsorted(pd.Timestamp(start), side='left'))
+    end_position = len(dates) - 1 if end is None else int(dates.searchsorted(pd.Timestamp(end), side='right')) - 1
+    return label, start_position, end_position
+
+
+@instrumented()
+def attribution_tables(df, dimensions, periods, contribution_column='Contribution', linking=None):
+    """
+    Computes contribution, exposure and active exposure per group for every dimension and period.
+
+    Contribution is the sum of the daily contribution over the period, linked when a linking method
+    is given; the exposures are those of the last day of the period. Values are left numeric,
+    formatting is done by the caller when the tables are printed or exported.
+
+    :param df: pandas DataFrame, holdings with refdate, the dimension columns and contribution_column
+    :param dimensions: list of str, columns to group by (e.g. ['GICS_sector', 'Country'])
+    :param periods: list of periods, see resolve_period
+    :param contribution_column: str, column holding the daily contribution
+    :param linking: str, one of LINKING_METHODS so that the contributions add up to the compounded return
+    :return: dict, {(period label, dimension): pandas DataFrame} with a 'Total' row at the bottom
+    """
+    reduced = DateGroupSums.build(df, dimensions, [contribution_column] + list(EXPOSURE_COLUMNS))
+
+    resolved = [resolve_period(period, reduced.dates) for period in periods]
+    starts = np.array([start for _, start, _ in resolved], dtype=np.int64)
+    ends = np.array([end for _, _, end in resolved], dtype=np.int64)
+    if linking is None:
+        factors = _period_mask(starts, ends, len(reduced.dates)).astype(np.float64)
+    else:
+        factors = linking_factors(_daily_returns(df, reduced.dates, contribution_column), starts, ends, linking)
+
+    # Contribution of every group (all dimensions) in every period
+    period_contributions = reduced.sums[contribution_column] @ factors.T
+
+    tables = {}
+    for p, (label, start, end) in enumerate(resolved):
+        for dimension in dimensions:
+            rows = reduced.rows(dimension)
+            tables[(label, dimension)] = _period_table(
+                dimension, reduced.labels[dimension], reduced.counts[rows], period_contributions[rows, p],
+                {name: reduced.sums[column][rows] for column, name in EXPOSURE_COLUMNS.items()}, start, end)
+    return tables
+
+
+def linking_factors(returns, starts, ends, method='carino'):
+    """
+    Returns the factor applied to the contributions of every date in every period.
+
+    With r the daily portfolio returns of a period and R = prod(1 + r) - 1 its compounded return:
+    carino scales date t by ln(1 + r_t) / r_t divided by ln(1 + R) / R; menchero by
+    M + (R - M * sum(r)) / sum(r^2) * r_t with M = (R / T) / ((1 + R)^(1 / T) - 1) over T dates;
+    grap by the growth of the portfolio from the start of the period to the day before t. In all
+    three, the factors times the daily returns add up to R.
+
+    :param returns: numpy array of float, daily portfolio return of every date
+    :param starts: numpy array of int, first date position of every period
+    :param ends: numpy array of int, last date position of every period
+    :param method: str, one of LINKING_METHODS
+    :return: numpy array of float, (periods x dates), 0 outside each period
+    """
+    if method not in LINKING_METHODS:
+        raise ValueError(f'Unknown linking method {method!r}, expected one of {LINKING_METHODS}')
+    returns = np.asarray(returns, dtype=np.float64)
+    inside = _period_mask(starts, ends, len(returns))
+    starts = np.clip(starts, 0, max(len(returns) - 1, 0))
+    ends = np.clip(ends, 0, max(len(returns) - 1, 0))
+
+    # Growth before every date (log scale), and the compounded return of every period
+    log_growth = np.concatenate([[0.0], np.cumsum(np.log1p(returns))])
+    period_return = np.expm1(log_growth[ends + 1] - log_growth[starts])
+
+    if method == 'grap':
+        factors = np.exp(log_growth[None, :-1] - log_growth[starts][:, None])
+    elif method == 'carino':
+        daily = carino_ratio(returns)
+        factors = daily[None, :] / carino_ratio(period_return)[:, None]
+    else:
+        n_dates = np.maximum(ends - starts + 1, 1)
+        sums = np.concatenate([[0.0], np.cumsum(returns)])
+        squares = np.concatenate([[0.0], np.cumsum(returns ** 2)])
+        period_sum = sums[ends + 1] - sums[starts]
+        period_squares = squares[ends + 1] - squares[starts]
+        growth_rate = np.power(1 + period_return, 1 / n_dates) - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(period_return == 0, 1.0, (period_return / n_dates) / growth_rate)
+            alpha = np.where(period_squares == 0, 0.0, (period_return - scale * period_sum) / period_squares)
+        factors = scale[:, None] + alpha[:, None] * returns[None, :]
+
+    return np.where(inside, factors, 0.0)
+
+
+def carino_ratio(returns):
+    """
+    :param returns: numpy array of float, returns
+    :return: numpy array of float, ln(1 + r) / r, 1 where r = 0 (its limit)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(returns == 0, 1.0, np.log1p(returns) / returns)
+
+
+def _period_mask(starts, ends, n_dates):
+    positions = np.arange(n_dates)
+    return (positions[None, :] >= starts[:, None]) & (positions[None, :] <= ends[:, None])
+
+
+def _daily_returns(df, dates, contribution_column):
+    # Portfolio return of every date: the sum of the contributions of its holdings
+    date_codes = dates.searchsorted(df['refdate'].to_numpy())
+    contributions = np.nan_to_num(df[contribution_column].to_numpy(dtype=np.float64))
+    return np.bincount(date_codes, weights=contributions, minlength=len(dates))
+
+
+def _period_table(dimension, labels, counts, contributions, exposures, start, end):
+    columns = [dimension] + list(exposures) + ['Contribution']
+    if end < start:
+        return pd.DataFrame(columns=columns)
+
+    # Groups with at least one holding in the period, exposures only for groups held on its last day
+    held = counts[:, start:end + 1].sum(axis=1) > 0
+    held_last_day = counts[:, end] > 0
+
+    table = pd.DataFrame({dimension: np.asarray(labels, dtype=object)})
+    for name, matrix in exposures.items():
+        table[name] = np.where(held_last_day, matrix[:, end], np.nan)
+    table['Contribution'] = contributions
+    table = table[held].reset_index(drop=True)
+
+    # Add total row
+    total = pd.DataFrame([['Total'] + [table[column].sum() for column in columns[1:]]], columns=columns)
+    return pd.concat([table, total], ignore_index=True)
+
+
+@instrumented()
+def format_percentages(table):
+    """
+    Formats the numeric columns of a table as percentage strings, missing values become ''.
+
+    :param table: pandas DataFrame, table from attribution_tables
+    :return: pandas DataFrame, copy of the table with formatted values
+    """
+    formatted = table.copy()
+    for column in formatted.columns[1:]:
+        values = formatted[column].to_numpy(dtype=np.float64)
+        text = np.char.mod('%.2f%%', np.nan_to_num(values) * 100).astype(object)
+        text[np.isnan(values)] = ''
+        formatted[column] = text
+    return formatted
@@ -0,0 +1,257 @@
+"""
+Benchmark of the analytics stages on synthetic holdings.
+
+generate_holdings builds a holdings history with the same columns as the assessment workbook
+for any number of securities and days, so the stages can be timed without the private file and
+at sizes well beyond it. run_benchmark writes the history to a workbook, then times every stage
+(load, ESG rating bucketing, attribution, ESG aggregation, migration detection, rendering) and reports its
+throughput and the peak memory it allocated. Appending the report of every run to one CSV file
+gives a baseline to catch regressions against as the universe grows.
+
+Usage:
+    python -m portfolio_analytics.benchmark --securities 500 --days 250 --output benchmarks.csv
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.attribution import attribution_tables
+from portfolio_analytics.esg import daily_esg_summary
+from portfolio_analytics.exposures import ExposureCube
+from portfolio_analytics.holdings import add_market_cap_bucket, filter_equities, load_holdings, prepare_holdings
+from portfolio_analytics.migrations import migration_events
+from portfolio_analytics.performance import add_contributions, daily_performance
+from portfolio_analytics.ratings import rate_pillars
+from portfolio_analytics.runner import DIMENSIONS, PERIODS
+
+# Stages in the order they run
+BENCHMARK_STAGES = ('load', 'bucketing', 'attribution', 'esg', 'migrations', 'rendering')
+
+# Stages whose output each stage uses, they run once untimed when they are not asked for themselves
+STAGE_DEPENDENCIES = {
+    'load': (),
+    'bucketing': ('load',),
+    'attribution': ('load',),
+    'esg': ('load',),
+    'migrations': ('load', 'bucketing'),
+    'rendering': ('load', 'esg'),
+}
+
+# Sectors and countries the synthetic securities are spread over
+SYNTHETIC_SECTORS = ['Communication Services', 'Consumer Discretionary', 'Consumer Staples', 'Energy', 'Financials',
+                     'Health Care', 'Industrials', 'Information Technology', 'Materials', 'Real Estate', 'Utilities']
+SYNTHETIC_COUNTRIES = ['US', 'GB', 'JP', 'FR', 'DE', 'ZA', 'CN', 'IN', 'BR', 'AU']
+
+# Rows of an Excel sheet, larger histories skip the workbook and are prepared in memory
+EXCEL_MAX_ROWS = 1048575
+
+
+def generate_holdings(n_securities=200, n_days=250, start='2022-01-03', seed=0, holding_probability=0.97):
+    """
+    Generates a holdings history with the columns of the assessment workbook.
+
+    Prices follow a random walk, ESG scores drift within 0-10, weights are redrawn every day and
+    a USD cash line (no sector) is added on every day. Every security is listed once, except that
+    one in twenty also has a second listing in another country.
+
+    :param n_securities: int, number of distinct asset names
+    :param n_days: int, number of business days
+    :param start: str, first refdate
+    :param seed: int, seed of the random generator
+    :param holding_probability: float, probability that a security is held on a given day
+    :return: pandas DataFrame, holdings with refdate as dd/mm/yyyy text, as in the workbook
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=n_days)
+
+    # Securities, the second listings reuse the name of every twentieth security
+    names = np.array([f'Asset {i}' for i in range(n_securities)], dtype=object)
+    countries = np.array(SYNTHETIC_COUNTRIES, dtype=object)[np.arange(n_securities) % len(SYNTHETIC_COUNTRIES)]
+    sectors = np.array(SYNTHETIC_SECTORS, dtype=object)[rng.integers(0, len(SYNTHETIC_SECTORS), n_securities)]
+    dual = np.arange(0, n_securities, 20)
+    names = np.concatenate([names, names[dual]])
+    countries = np.concatenate([countries, np.roll(countries, 1)[dual]])
+    sectors = np.concatenate([sectors, sectors[dual]])
+    n_listings = len(names)
+
+    # Day x security paths of the prices, scores and weights
+    shape = (n_days, n_listings)
+    prices = rng.uniform(5, 500, n_listings) * np.cumprod(1 + rng.normal(0.0003, 0.015, shape), axis=0)
+    market_caps = rng.lognormal(22, 2, n_listings) * prices / prices[0]
+    scores = np.clip(rng.uniform(0, 10, (1, n_listings, 4)) + np.cumsum(rng.normal(0, 0.1, shape + (4,)), axis=0), 0, 10)
+    held = rng.random(shape) < holding_probability
+    weights = np.where(held, rng.uniform(0.5, 1.5, shape), 0)
+    weights = weights / weights.sum(axis=1, keepdims=True) * 0.98
+    benchmark_weights = weights * rng.uniform(0.5, 1.5, shape)
+
+    day, listing = np.nonzero(held)
+    w = weights[day, listing]
+    holdings = pd.DataFrame({
+        'refdate': dates[day],
+        'Asset Name': names[listing],
+        'Country': countries[listing],
+        'GICS_sector': sectors[listing],
+        'Weight (%)': w,
+        'Active Weight (%)': w - benchmark_weights[day, listing],
+        'Price(USD)': prices[day, listing],
+        'Market Capitalization (USD)': market_caps[day, listing],
+        'Overall ESG Score': scores[day, listing, 0],
+        'Overall ESG Environmental Score': scores[day, listing, 1],
+        'Overall ESG Social Score': scores[day, listing, 2],
+        'Overall ESG Governance Score': scores[day, listing, 3],
+        '%Contribution to Total Risk': w * rng.uniform(0.5, 1.5, len(w)),
+        '%Contribution to Tracking Error': w * rng.uniform(-1, 2, len(w)),
+    })
+    cash = pd.DataFrame({'refdate': dates, 'Asset Name': 'USD Cash', 'Country': 'US', 'GICS_sector': np.nan,
+                         'Weight (%)': 0.02, 'Active Weight (%)': 0.02, 'Price(USD)': 1.0,
+                         '%Contribution to Total Risk': 0.0, '%Contribution to Tracking Error': 0.0})
+    holdings = pd.concat([holdings, cash], ignore_index=True).sort_values('refdate', kind='stable', ignore_index=True)
+    holdings['refdate'] = holdings['refdate'].dt.strftime('%d/%m/%Y')
+    return holdings
+
+
+def run_benchmark(n_securities=200, n_days=250, seed=0, stages=BENCHMARK_STAGES, repeat=3, trace_memory=True, work_dir=None):
+    """
+    Times every stage on a synthetic holdings history.
+
+    Each stage is timed repeat times and the fastest run is reported. The peak memory is measured
+    with tracemalloc in one extra run, so tracing does not slow down the timed runs. Charts are
+    rendered headless in worker processes, whose memory is not included.
+
+    :param n_securities: int, number of distinct asset names
+    :param n_days: int, number of business days
+    :param seed: int, seed of the random generator
+    :param stages: sequence of str, stages to time (see BENCHMARK_STAGES), the ones they depend on always run
+    :param repeat: int, timed runs of every stage
+    :param trace_memory: bool, set to False to skip the memory run
+    :param work_dir: str, folder for the workbook, its cache and the charts (a temporary folder by default)
+    :return: pandas DataFrame, one row per stage with Rows, Seconds, Rows per Second and Peak Memory (MB)
+    """
+    unknown = set(stages) - set(BENCHMARK_STAGES)
+    if unknown:
+        raise ValueError(f'Unknown stages {sorted(unknown)}, expected some of {BENCHMARK_STAGES}')
+
+    own_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix='portfolio_benchmark_') if own_dir else work_dir
+    try:
+        raw = generate_holdings(n_securities, n_days, seed=seed)
+        workbook = None
+        if len(raw) <= EXCEL_MAX_ROWS:
+            workbook = os.path.join(work_dir, 'synthetic_holdings.xlsx')
+            raw.to_excel(workbook, index=False)
+
+        # The stages asked for and the ones they depend on, nothing else runs
+        required = set(stages)
+        for stage in stages:
+            required.update(STAGE_DEPENDENCIES[stage])
+
+        results = []
+        state = {}
+        for stage in [stage for stage in BENCHMARK_STAGES if stage in required]:
+            function, rows = _stage(stage, state, raw, workbook, work_dir)
+            seconds = []
+            for _ in range(max(repeat, 1) if stage in stages else 1):
+                started = time.perf_counter()
+                output = function()
+                seconds.append(time.perf_counter() - started)
+
+            if stage in stages:
+                peak = np.nan
+                if trace_memory:
+                    tracemalloc.start()
+                    function()
+                    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                    tracemalloc.stop()
+                best = min(seconds)
+                results.append({'Stage': stage, 'Rows': rows, 'Seconds': best,
+                                'Rows per Second': rows / best if best > 0 else np.nan, 'Peak Memory (MB)': peak})
+            state[stage] = output
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = pd.DataFrame(results)
+    report.insert(0, 'Days', n_days)
+    report.insert(0, 'Securities', n_securities)
+    return report
+
+
+def _stage(stage, state, raw, workbook, work_dir):
+    # Returns the function running a stage on the outputs of the earlier stages and its number of input rows
+    if stage == 'load':
+        if workbook is None:
+            return lambda: prepare_holdings(raw.copy()), len(raw)
+
+        def load():
+            # Parse the workbook, without the cache of a previous run
+            return load_holdings(workbook, use_cache=False)
+        return load, len(raw)
+
+    holdings = state['load']
+    if stage == 'bucketing':
+        # Ratings of every pillar score, the classifier behind the ESG tables and the migrations
+        return lambda: rate_pillars(holdings), len(holdings)
+
+    equities = add_market_cap_bucket(filter_equities(holdings).copy())
+    if stage == 'attribution':
+        def attribution():
+            df = add_contributions(equities)
+            return daily_performance(df), attribution_tables(df, DIMENSIONS, PERIODS)
+        return attribution, len(equities)
+
+    if stage == 'esg':
+        return lambda: daily_esg_summary(holdings), len(holdings)
+
+    if stage == 'migrations':
+        def migrations():
+            df = holdings.assign(**{'Overall ESG Category': state['bucketing']['Overall ESG Category']})
+            return migration_events(df, columns=['Weight (%)'])
+        return migrations, len(holdings)
+
+    if stage == 'rendering':
+        from portfolio_analytics.charts import exposure_chart, line_chart
+        from portfolio_analytics.rendering import RenderQueue
+
+        cube = ExposureCube.build(equities)
+        scores = state['esg'][0].set_index('refdate')
+
+        def rendering():
+            render_queue = RenderQueue(output_dir=os.path.join(work_dir, 'charts'), headless=True, skip_unchanged=False)
+            render_queue.add('ESG_Scores.png', line_chart, scores, 'ESG Scores', 'Date', 'Score')
+            for dimension in DIMENSIONS:
+                render_queue.add(f'{dimension}.png', exposure_chart, cube.slice(dimension, 'Weight (%)'), 'Weight (%)',
+                                 f'Exposure by {dimension}', dimension)
+            render_queue.run()
+        return rendering, len(equities)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the analytics stages on synthetic holdings.')
+    parser.add_argument('--securities', type=int, nargs='+', default=[200], help='numbers of securities to run')
+    parser.add_argument('--days', type=int, nargs='+', default=[250], help='numbers of business days to run')
+    parser.add_argument('--stages', nargs='+', choices=BENCHMARK_STAGES, default=list(BENCHMARK_STAGES))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of every stage, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run of every stage')
+    parser.add_argument('--output', help='CSV file the report is appended to')
+    args = parser.parse_args(argv)
+
+    reports = [run_benchmark(n_securities, n_days, args.seed, args.stages, args.repeat, not args.no_memory)
+               for n_securities in args.securities for n_days in args.days]
+    report = pd.concat(reports, ignore_index=True)
+    print(report.to_string(index=False, float_format=lambda value: f'{value:,.3f}'))
+
+    if args.output:
+        report.insert(0, 'Run', pd.Timestamp.now().isoformat(timespec='seconds'))
+        report.to_csv(args.output, mode='a', header=not os.path.exists(args.output), index=False)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,94 @@
+"""
+Chart builders shared by the scripts.
+
+Every function builds one figure from data that is already aggregated and returns it, without
+showing or saving it, so the same chart can be shown interactively or rendered headless by a
+RenderQueue (see portfolio_analytics.rendering). matplotlib is only imported when a chart is
+built, so importing this module (and running the scripts without charts) does not load it.
+"""
+
+
+def line_chart(table, title, xlabel, ylabel, labels=None, marker=None, legend=True, figsize=(12, 8)):
+    """
+    Plots every column of a table as a line against its index.
+
+    :param table: pandas DataFrame, index on the x axis (e.g. refdate), one column per line
+    :param title: str, title of the plot
+    :param xlabel: str, label of the x axis
+    :param ylabel: str, label of the y axis
+    :param labels: dict, optional {column: legend label}
+    :param marker: str, optional matplotlib marker
+    :param legend: bool, whether to show a legend
+    :param figsize: tuple, size of the figure
+    :return: matplotlib Figure
+    """
+    import matplotlib.pyplot as plt
+
+    labels = labels or {}
+    fig, ax = plt.subplots(figsize=figsize)
+    for column in table.columns:
+        ax.plot(table.index, table[column], marker=marker, label=labels.get(column, column))
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if legend:
+        ax.legend()
+    ax.grid(True)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    return fig
+
+
+def pie_charts(table, label_column, value_columns, titles, figsize=(10, 12)):
+    """
+    Plots one pie chart per value column, stacked vertically.
+
+    :param table: pandas DataFrame, one row per slice
+    :param label_column: str, column with the slice labels
+    :param value_columns: list of str, columns with the slice sizes, one pie each
+    :param titles: list of str, title of each pie
+    :param figsize: tuple, size of the figure
+    :return: matplotlib Figure
+    """
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(len(value_columns), 1, figsize=figsize, squeeze=False)
+    for ax, value_column, title in zip(axes[:, 0], value_columns, titles):
+        ax.pie(table[value_column], labels=table[label_column], autopct='%1.1f%%', startangle=140)
+        ax.set_title(title)
+    fig.tight_layout()
+    return fig
+
+
+def exposure_chart(table, value_column, plot_title, legend_title):
+    """
+    Plots the sum of value_column of every group over time.
+
+    :param table: pandas DataFrame, indexed by refdate with one column per group (see ExposureCube.slice)
+    :param value_column: str, name of the summed values (e.g. 'Weight (%)')
+    :param plot_title: str, title of the plot
+    :param legend_title: str, title of the legend
+    :return: matplotlib Figure
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(12, 8))
+
+    # Loop through each group and plot the dates on which it is held
+    for group in table.columns:
+        group_data = table[group].dropna()
+        ax.plot(group_data.index, group_data.to_numpy(), label=group)
+
+    # Adding title and labels
+    ax.set_title(plot_title)
+    ax.set_xlabel('Ref Date')
+    ax.set_ylabel(f'Sum of {value_column}')
+
+    # Customize legend
+    ax.legend(title=legend_title, bbox_to_anchor=(1.05, 1), loc='upper left')
+
+    # Format the x-axis for better readability
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.grid(True)
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,164 @@
+"""
+Command-line entry point of the analytics.
+
+    python -m portfolio_analytics performance holdings.xlsx --output Portfolio_Performance_Analysis.xlsx
+    python -m portfolio_analytics esg-changes holdings.xlsx --output-dir reports
+    python -m portfolio_analytics validate holdings.xlsx --output exceptions.csv
+    python -m portfolio_analytics run|stream|benchmark|serve ...
+
+performance and esg-changes compute and export the tables of "Performance Calculations.py" and
+"ESG Scores Changed.py" without drawing anything: matplotlib is only imported when charts are
+asked for with --charts. validate runs the data quality checks of portfolio_analytics.quality
+and exits with 1 when one of them finds an error. The other commands hand over to the main
+function of their module (runner, streaming, benchmark, service). Every command imports its
+modules when it runs, so a scheduled job only pays for the imports of the command it launches.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+# Commands that run the main function of another module, and that module
+MODULE_COMMANDS = {
+    'run': 'portfolio_analytics.runner',
+    'stream': 'portfolio_analytics.streaming',
+    'benchmark': 'portfolio_analytics.benchmark',
+    'serve': 'portfolio_analytics.service',
+}
+
+# Dimensions of the performance tables and their names in the printed titles and the report's sheets
+PERFORMANCE_DIMENSIONS = {'GICS_sector': 'GICS Sector', 'Country': 'Country', 'Market Cap Bucket': 'Market Capitalization Bucket'}
+SHEET_NAMES = {'GICS_sector': 'GICS_Sector', 'Country': 'Country', 'Market Cap Bucket': 'Market_Cap'}
+
+
+def performance_command(args):
+    """
+    Prints the contribution tables of every period and dimension and exports them to a workbook.
+
+    :param args: argparse Namespace, see main
+    :return: int, exit code
+    """
+    from portfolio_analytics.attribution import attribution_tables, format_percentages
+    from portfolio_analytics.holdings import add_market_cap_bucket, filter_equities, load_holdings
+    from portfolio_analytics.performance import add_benchmark_contributions, add_contributions, compounded_performance
+    from portfolio_analytics.reports import write_report
+
+    df = add_contributions(add_market_cap_bucket(filter_equities(load_holdings(args.workbook)).copy()))
+    linking = None if args.linking == 'none' else args.linking
+    tables = attribution_tables(df, args.dimensions, args.periods, linking=linking)
+    for (period, dimension), table in tables.items():
+        print(f'\nContributions by {PERFORMANCE_DIMENSIONS.get(dimension, dimension)} {period}:')
+        print(format_percentages(table).to_string(index=False))
+    if args.output:
+        write_report(args.output, {f'{period}_{SHEET_NAMES.get(dimension, dimension)}': table
+                                   for (period, dimension), table in tables.items()})
+
+    if args.charts:
+        from portfolio_analytics.charts import line_chart
+        from portfolio_analytics.rendering import RenderQueue
+        from portfolio_analytics.risk import RISK_WINDOW, rolling_risk
+
+        render_queue = RenderQueue(output_dir=args.charts, headless=True)
+        render_queue.add('Compounded_Gross_Performance.png', line_chart,
+                         compounded_performance(df).set_index('refdate')[['compounded_return']],
+                         title='Compounded Gross Performance', xlabel='Ref Date', ylabel='Compounded Return',
+                         marker='o', legend=False)
+        risk = rolling_risk(add_benchmark_contributions(df), window=RISK_WINDOW)
+        render_queue.add('Rolling_Risk.png', line_chart, risk.set_index('refdate')[['Volatility', 'Tracking Error', 'Drawdown']],
+                         title=f'Rolling {RISK_WINDOW}-Day Risk', xlabel='Ref Date', ylabel='Annualized Volatility / Drawdown')
+        render_queue.run()
+    return 0
+
+
+def esg_changes_command(args):
+    """
+    Exports the rating upgrades and downgrades, and those of the last refdate, to two workbooks.
+
+    :param args: argparse Namespace, see main
+    :return: int, exit code
+    """
+    from portfolio_analytics.esg import add_normalized_weights
+    from portfolio_analytics.holdings import load_holdings
+    from portfolio_analytics.migrations import migration_events
+    from portfolio_analytics.ratings import categorize_esg_scores
+    from portfolio_analytics.reports import write_report
+
+    df = add_normalized_weights(load_holdings(args.workbook))
+    df['Overall ESG Category'] = categorize_esg_scores(df['Overall ESG Score'])
+    if args.store is None:
+        changes = migration_events(df, columns=['Normalized Weight'])
+    else:
+        from portfolio_analytics.migration_store import MigrationStore
+
+        with MigrationStore(args.store) as store:
+            store.update(df)
+            changes = store.events()
+    last_day_changes = changes[changes['refdate'] == df['refdate'].max()]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_report(os.path.join(args.output_dir, 'Category_Changes_With_Dates.xlsx'), {'Category Changes': changes})
+    write_report(os.path.join(args.output_dir, 'Last_Day_Changes_With_Dates.xlsx'), {'Last Day Changes': last_day_changes})
+    print(f'{len(changes)} category changes, {len(last_day_changes)} on {df["refdate"].max():%Y-%m-%d}')
+    return 0
+
+
+def validate_command(args):
+    """
+    Prints a summary of the data quality exceptions of a workbook and optionally exports all of them.
+
+    :param args: argparse Namespace, see main
+    :return: int, exit code, 1 when an exception is an error
+    """
+    from portfolio_analytics.holdings import validate_workbook
+    from portfolio_analytics.quality import summarize_exceptions
+
+    exceptions = validate_workbook(args.workbook, rules=args.rules)
+    if exceptions.empty:
+        print(f'{args.workbook}: no data quality exceptions')
+    else:
+        print(summarize_exceptions(exceptions).to_string(index=False))
+    if args.output:
+        if args.output.lower().endswith('.xlsx'):
+            from portfolio_analytics.reports import write_report
+
+            write_report(args.output, {'Exceptions': exceptions}, number_formats={})
+        else:
+            exceptions.to_csv(args.output, index=False)
+    return int((exceptions['severity'] == 'error').any())
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in MODULE_COMMANDS:
+        return importlib.import_module(MODULE_COMMANDS[argv[0]]).main(argv[1:])
+
+    parser = argparse.ArgumentParser(prog='python -m portfolio_analytics', description='Portfolio analytics.',
+                                     epilog=f'Other commands: {", ".join(MODULE_COMMANDS)} (see their --help).')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    performance = commands.add_parser('performance', help='contribution tables by dimension and period')
+    performance.add_argument('workbook', help='holdings workbook')
+    performance.add_argument('--output', help='.xlsx workbook the tables are exported to')
+    performance.add_argument('--periods', nargs='+', default=['ITD', 'YTD'], help='periods (ITD, YTD, QTD, MTD)')
+    performance.add_argument('--dimensions', nargs='+', default=list(PERFORMANCE_DIMENSIONS), help='columns to group by')
+    performance.add_argument('--linking', choices=['carino', 'menchero', 'grap', 'none'], default='carino',
+                             help='linking of the daily contributions')
+    performance.add_argument('--charts', help='folder for the performance and risk charts (no charts when omitted)')
+    performance.set_defaults(handler=performance_command)
+
+    esg_changes = commands.add_parser('esg-changes', help='ESG rating upgrades and downgrades')
+    esg_changes.add_argument('workbook', help='holdings workbook')
+    esg_changes.add_argument('--output-dir', default='.', help='folder for the two workbooks')
+    esg_changes.add_argument('--store', help='SQLite migration store updated incrementally (see migration_store)')
+    esg_changes.set_defaults(handler=esg_changes_command)
+
+    from portfolio_analytics.quality import QUALITY_RULES
+
+    validate = commands.add_parser('validate', help='data quality checks of a holdings workbook')
+    validate.add_argument('workbook', help='holdings workbook')
+    validate.add_argument('--output', help='.csv or .xlsx file for every exception')
+    validate.add_argument('--rules', nargs='+', choices=list(QUALITY_RULES), help='checks to run (all of them when omitted)')
+    validate.set_defaults(handler=validate_command)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
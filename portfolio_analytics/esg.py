@@ -0,0 +1,87 @@
+"""
+Daily portfolio ESG scores and rating-bucket weights.
+
+daily_esg_summary computes both in one fused pass: the refdates are sorted once into integer day
+codes, and every daily total (weights, weighted scores, weight per rating bucket) is a segment
+sum with np.bincount over those codes. Normalizing by the daily weight is a division of the
+small per-day results, so no per-group Python callback runs and no normalized weight or weighted
+score column is added to the holdings.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.instrumentation import instrumented
+from portfolio_analytics.ratings import MAX_SCORE, MSCI_THRESHOLDS, PILLAR_CATEGORIES, RATING_LABELS, rating_codes
+
+# Pillar score columns and the normalized weighted score columns derived from them
+WEIGHTED_SCORE_COLUMNS = {
+    'Overall ESG Score': 'Normalized Weighted Overall ESG Score',
+    'Overall ESG Environmental Score': 'Normalized Weighted ESG Environmental Score',
+    'Overall ESG Social Score': 'Normalized Weighted ESG Social Score',
+    'Overall ESG Governance Score': 'Normalized Weighted ESG Governance Score',
+}
+
+
+@instrumented()
+def add_normalized_weights(df):
+    """
+    Adds 'Normalized Weight', the weights rescaled to sum to 100% for each day.
+
+    :param df: pandas DataFrame, holdings with refdate and Weight (%)
+    :return: pandas DataFrame, the same holdings with the new column
+    """
+    dates, day_codes = np.unique(df['refdate'].to_numpy(), return_inverse=True)
+    weights = df['Weight (%)'].to_numpy(dtype=np.float64)
+    daily_weight = np.bincount(day_codes, weights=np.nan_to_num(weights), minlength=len(dates))
+    df['Normalized Weight'] = weights / daily_weight[day_codes]
+    return df
+
+
+@instrumented()
+def daily_esg_summary(df, pillars=None, ratings=None, thresholds=MSCI_THRESHOLDS, labels=RATING_LABELS,
+                      max_score=MAX_SCORE):
+    """
+    Computes the daily normalized weighted score of every pillar and the weight in every rating bucket.
+
+    The weighted score of a day is sum(weight * score) / sum(weight) over that day's holdings,
+    which equals the sum of the normalized weighted scores; the weight of a rating bucket is the
+    normalized weight of the holdings in it.
+
+    :param df: pandas DataFrame, holdings with refdate, Weight (%) and the pillar score columns
+    :param pillars: dict, {score column: weighted score column}, defaults to WEIGHTED_SCORE_COLUMNS
+    :param ratings: dict, {score column: rating column}, pillars to bucket, defaults to PILLAR_CATEGORIES
+    :param thresholds: sequence of float, rating thresholds (see portfolio_analytics.ratings)
+    :param labels: sequence of str, ratings from the lowest to the highest
+    :param max_score: float, top of the score scale
+    :return: tuple, (pandas DataFrame of refdate and one column per weighted score,
+                     dict {rating column: pandas DataFrame indexed by refdate with one column per rating held})
+    """
+    pillars = WEIGHTED_SCORE_COLUMNS if pillars is None else pillars
+    ratings = PILLAR_CATEGORIES if ratings is None else ratings
+
+    # The one sort: refdates to day codes
+    dates, day_codes = np.unique(df['refdate'].to_numpy(), return_inverse=True)
+    n_days = len(dates)
+    dates = pd.DatetimeIndex(dates, name='refdate')
+
+    # Missing weights count as 0, missing scores add nothing to the weighted score
+    weights = np.nan_to_num(df['Weight (%)'].to_numpy(dtype=np.float64))
+    daily_weight = np.bincount(day_codes, weights=weights, minlength=n_days)
+
+    scores = pd.DataFrame({'refdate': dates})
+    for score_column, weighted_column in pillars.items():
+        weighted = np.nan_to_num(weights * df[score_column].to_numpy(dtype=np.float64))
+        scores[weighted_column] = np.bincount(day_codes, weights=weighted, minlength=n_days) / daily_weight
+
+    # Rating-bucket weights: one segment sum per pillar over day code x rating code
+    n_labels = len(labels)
+    codes = rating_codes(df[list(ratings)], thresholds, max_score)
+    buckets = {}
+    for i, rating_column in enumerate(ratings.values()):
+        keys = day_codes * n_labels + codes[:, i]
+        bucket_weight = np.bincount(keys, weights=weights, minlength=n_days * n_labels).reshape(n_days, n_labels)
+        held = np.bincount(keys, minlength=n_days * n_labels).reshape(n_days, n_labels).any(axis=0)
+        columns = pd.CategoricalIndex(np.asarray(labels)[held], categories=list(labels), ordered=True, name=rating_column)
+        buckets[rating_column] = pd.DataFrame(bucket_weight[:, held] / daily_weight[:, None], index=dates, columns=columns)
+
+    return scores, buckets
@@ -0,0 +1,112 @@
+"""
+Exposure cube: refdate x group x value sums for every exposure dimension.
+
+The cube is built with one grouped reduction over the holdings (see
+portfolio_analytics.grouping). Charts and tables then read slices of it instead of pivoting and
+filtering the raw holdings again for every combination of dimension and value.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.grouping import DateGroupSums
+from portfolio_analytics.instrumentation import instrumented
+
+# Dimensions and values of the exposure charts in "NinetyOne Analysis.py"
+EXPOSURE_DIMENSIONS = ['GICS_sector', 'Country', 'Market Cap Bucket']
+EXPOSURE_VALUES = ['Weight (%)', 'Active Weight (%)', '%Contribution to Total Risk', '%Contribution to Tracking Error']
+
+
+class ExposureCube:
+    """
+    Sums of the exposure values per refdate and group of every dimension.
+    """
+
+    def __init__(self, sums):
+        """
+        :param sums: DateGroupSums, reduced holdings (use ExposureCube.build to create a cube)
+        """
+        self._sums = sums
+
+    @classmethod
+    @instrumented('build_exposure_cube')
+    def build(cls, df, dimensions=EXPOSURE_DIMENSIONS, values=EXPOSURE_VALUES):
+        """
+        Builds the cube from the holdings in a single grouped reduction.
+
+        :param df: pandas DataFrame, holdings with refdate, the dimension columns and the value columns
+        :param dimensions: list of str, columns to group by
+        :param values: list of str, columns to sum
+        :return: ExposureCube
+        """
+        return cls(DateGroupSums.build(df, list(dimensions), list(values)))
+
+    @property
+    def dates(self):
+        """
+        :return: pandas DatetimeIndex, sorted refdates of the cube
+        """
+        return self._sums.dates
+
+    @property
+    def dimensions(self):
+        """
+        :return: list of str, dimensions of the cube
+        """
+        return list(self._sums.labels)
+
+    def slice(self, dimension, value_column):
+        """
+        Returns the sum of value_column of every group over time.
+
+        :param dimension: str, one of the cube's dimensions (e.g. 'GICS_sector')
+        :param value_column: str, one of the cube's values (e.g. 'Weight (%)')
+        :return: pandas DataFrame, indexed by refdate with one column per group, NaN where the group is not held
+        """
+        rows = self._sums.rows(dimension)
+        held = self._sums.counts[rows] > 0
+        values = np.where(held, self._sums.sums[value_column][rows], np.nan)
+
+        # Only keep groups that are held on at least one date
+        present = held.any(axis=1)
+        columns = pd.Index(np.asarray(self._sums.labels[dimension], dtype=object)[present], name=dimension)
+        return pd.DataFrame(values[present].T, index=self.dates, columns=columns)
+
+    def snapshot(self, dimension, date, values=('Weight (%)', 'Active Weight (%)')):
+        """
+        Returns the sums of the values of every group held on one refdate.
+
+        :param dimension: str, one of the cube's dimensions
+        :param date: date-like, refdate of the snapshot (must be in the cube)
+        :param values: sequence of str, value columns to include
+        :return: pandas DataFrame, one row per group with the dimension column and the values
+        """
+        position = self.dates.get_loc(pd.Timestamp(date))
+        rows = self._sums.rows(dimension)
+        held = self._sums.counts[rows, position] > 0
+
+        table = pd.DataFrame({dimension: np.asarray(self._sums.labels[dimension], dtype=object)[held]})
+        for value_column in values:
+            table[value_column] = self._sums.sums[value_column][rows, position][held]
+        return table
+
+    def to_frame(self):
+        """
+        Returns the whole cube in long format, one row per refdate, dimension and group held.
+
+        :return: pandas DataFrame, refdate, Dimension, Group and one column per value
+        """
+        frames = []
+        for dimension, labels in self._sums.labels.items():
+            rows = self._sums.rows(dimension)
+            group_codes, date_codes = np.nonzero(self._sums.counts[rows] > 0)
+            order = np.lexsort((group_codes, date_codes))
+            group_codes, date_codes = group_codes[order], date_codes[order]
+            frame = pd.DataFrame({
+                'refdate': self.dates[date_codes],
+                'Dimension': dimension,
+                'Group': np.asarray(labels, dtype=object)[group_codes],
+            })
+            for value_column, sums in self._sums.sums.items():
+                frame[value_column] = sums[rows][group_codes, date_codes]
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
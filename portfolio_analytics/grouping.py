@@ -0,0 +1,80 @@
+"""
+Integer-coded grouped reductions over the holdings.
+
+Group-bys on string columns are replaced by dense integer codes and np.bincount: every dimension
+is encoded once, the codes of all dimensions are stacked into one key space together with the
+date code, and a single bincount per value column produces (all groups) x dates matrices.
+"""
+import numpy as np
+import pandas as pd
+
+
+def encode_column(values):
+    """
+    Turns a column into dense integer codes, missing values get -1.
+
+    :param values: pandas Series, column to encode
+    :return: tuple, (numpy array of int64 codes, pandas Index of the labels in code order)
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(dtype=np.int64), values.cat.categories
+    codes, labels = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), pd.Index(labels)
+
+
+class DateGroupSums:
+    """
+    Sums of value columns and row counts per date and group, for several dimensions at once.
+
+    For every dimension, labels[dimension] are its groups and rows(dimension) selects them in the
+    (all groups) x dates matrices counts and sums[value column].
+    """
+
+    def __init__(self, dates, labels, offsets, counts, sums):
+        self.dates = dates
+        self.labels = labels
+        self.offsets = offsets
+        self.counts = counts
+        self.sums = sums
+
+    @classmethod
+    def build(cls, df, dimensions, value_columns, date_column='refdate'):
+        """
+        Reduces the holdings to per date and group sums in a single grouped pass.
+
+        :param df: pandas DataFrame, holdings with date_column, the dimensions and the value columns
+        :param dimensions: list of str, columns to group by
+        :param value_columns: list of str, columns to sum (missing values count as 0)
+        :param date_column: str, column with the dates
+        :return: DateGroupSums
+        """
+        dates, date_codes = np.unique(df[date_column].to_numpy(), return_inverse=True)
+        dates = pd.DatetimeIndex(dates, name=date_column)
+        n_dates = len(dates)
+
+        # Stack the group codes of every dimension into one key space
+        encoded = [encode_column(df[dimension]) for dimension in dimensions]
+        offsets = np.cumsum([0] + [len(labels) for _, labels in encoded])
+        keys = np.concatenate([np.where(codes >= 0, (codes + offset) * n_dates + date_codes, -1)
+                               for (codes, _), offset in zip(encoded, offsets)]) if encoded else np.empty(0, np.int64)
+        valid = keys >= 0
+        keys = keys[valid]
+        size = offsets[-1] * n_dates
+
+        # One grouped reduction per value column gives (all groups) x dates matrices
+        counts = np.bincount(keys, minlength=size).reshape(-1, n_dates)
+        sums = {}
+        for column in value_columns:
+            values = np.tile(np.nan_to_num(df[column].to_numpy(dtype=np.float64)), len(dimensions))[valid]
+            sums[column] = np.bincount(keys, weights=values, minlength=size).reshape(-1, n_dates)
+
+        labels = {dimension: group_labels for dimension, (_, group_labels) in zip(dimensions, encoded)}
+        return cls(dates, labels, dict(zip(dimensions, offsets[:-1])), counts, sums)
+
+    def rows(self, dimension):
+        """
+        :param dimension: str, one of the dimensions the sums were built for
+        :return: slice, rows of that dimension's groups in the matrices
+        """
+        offset = self.offsets[dimension]
+        return slice(offset, offset + len(self.labels[dimension]))
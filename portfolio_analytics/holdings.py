@@ -0,0 +1,274 @@
+"""
+Loading of the holdings workbook.
+
+Parsing 'ASSESSMENT DATA Portfolio Analyst.xlsx' with pd.read_excel is by far the slowest part of
+every script, so the prepared holdings (parsed refdate, weekends removed, sorted by date,
+declared column types of portfolio_analytics.schema) are written once to an uncompressed Feather file next to the workbook.
+Later runs memory-map that file and only go back to the workbook when its size, modification
+time and content hash no longer match what was recorded when the cache was built. The summary of
+the data quality exceptions found while preparing the workbook (see portfolio_analytics.quality)
+is recorded with the cache, so every load warns about them, not only the one that built it.
+"""
+import hashlib
+import json
+import os
+import warnings
+
+import pandas as pd
+
+from portfolio_analytics.instrumentation import instrumented, stage
+from portfolio_analytics.quality import SUMMARY_COLUMNS, summarize_exceptions, validate_holdings
+from portfolio_analytics.schema import MARKET_CAP_BINS, MARKET_CAP_LABELS, enforce_schema, schema_problems
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - the cache is an optimisation, not a requirement
+    feather = None
+
+# Version of the prepared layout, bump it whenever prepare_holdings changes what it writes
+CACHE_VERSION = 4
+
+# Rows per record batch in the cache, the unit in which portfolio_analytics.streaming reads it
+CACHE_BATCH_ROWS = 64 * 1024
+
+
+
+@instrumented()
+def load_holdings(file_path, cache_dir=None, use_cache=True):
+    """
+    Loads the holdings workbook with refdate parsed and weekends removed.
+
+    :param file_path: str, path of the Excel workbook
+    :param cache_dir: str, folder for the columnar cache (defaults to the workbook's folder)
+    :param use_cache: bool, set to False to always parse the workbook
+    :return: pandas DataFrame, prepared holdings
+    """
+    if not use_cache or feather is None:
+        if use_cache:
+            warnings.warn('pyarrow is not installed, reading the workbook without a cache')
+        return prepare_holdings(_read_workbook(file_path))
+
+    cache_path, meta_path = cache_paths(file_path, cache_dir)
+    if not _cache_is_current(file_path, cache_path, meta_path):
+        return _build_cache(file_path, cache_path, meta_path)
+
+    _warn_exceptions(_cached_exceptions(meta_path))
+    with stage('read_cache') as record:
+        df = feather.read_table(cache_path, memory_map=True).to_pandas()
+        record.rows_out = len(df)
+    return df
+
+
+def ensure_cache(file_path, cache_dir=None):
+    """
+    Builds the cache of a workbook when it is missing or out of date, without loading a current one.
+
+    The readers that only need some rows or columns of the cache (portfolio_analytics.streaming,
+    portfolio_analytics.query) read it from the returned path, so a current cache is never
+    converted to pandas as a whole.
+
+    :param file_path: str, path of the Excel workbook
+    :param cache_dir: str, folder for the columnar cache (defaults to the workbook's folder)
+    :return: str, path of the Feather cache, sorted by refdate
+    """
+    if feather is None:
+        raise ImportError('pyarrow is required to read the holdings cache')
+    cache_path, meta_path = cache_paths(file_path, cache_dir)
+    if not _cache_is_current(file_path, cache_path, meta_path):
+        _build_cache(file_path, cache_path, meta_path)
+    else:
+        _warn_exceptions(_cached_exceptions(meta_path))
+    return cache_path
+
+
+def filter_equities(df):
+    """
+    Filters out rows where 'GICS_sector' is empty to remove currencies and other non-equities.
+
+    :param df: pandas DataFrame, holdings
+    :return: pandas DataFrame, equity holdings
+    """
+    return df[df['GICS_sector'].notna()]
+
+
+def add_market_cap_bucket(df):
+    """
+    Adds the 'Market Cap Bucket' column from 'Market Capitalization (USD)'.
+
+    :param df: pandas DataFrame, holdings
+    :return: pandas DataFrame, the same holdings with the new column
+    """
+    df['Market Cap Bucket'] = pd.cut(df['Market Capitalization (USD)'], bins=MARKET_CAP_BINS, labels=MARKET_CAP_LABELS)
+    return df
+
+
+def validate_workbook(file_path, rules=None):
+    """
+    Reads a holdings workbook and runs the data quality checks, without using or writing the cache.
+
+    :param file_path: str, path of the Excel workbook
+    :param rules: list of str, checks to run (see portfolio_analytics.quality.QUALITY_RULES), all of them when None
+    :return: pandas DataFrame, exceptions (see portfolio_analytics.quality.validate_holdings)
+    """
+    df = _read_workbook(file_path)
+    raw_refdates = df['refdate'].copy()
+    df, _ = enforce_schema(prepare_refdates(df, errors='coerce'))
+    return validate_holdings(df, rules=rules, raw_refdates=raw_refdates)
+
+
+def cache_paths(file_path, cache_dir=None):
+    """
+    Returns the paths of the cache file and its metadata for a workbook.
+
+    :param file_path: str, path of the Excel workbook
+    :param cache_dir: str, folder for the columnar cache (defaults to the workbook's folder)
+    :return: tuple of str, (cache path, metadata path)
+    """
+    folder = cache_dir if cache_dir is not None else os.path.dirname(os.path.abspath(file_path))
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    cache_path = os.path.join(folder, f'.{stem}.holdings.feather')
+    return cache_path, cache_path + '.json'
+
+
+def prepare_refdates(df, errors='raise'):
+    """
+    Parses refdate and removes weekends.
+
+    :param df: pandas DataFrame, raw holdings
+    :param errors: str, 'raise' on a refdate that does not parse, or 'coerce' to keep its row with a NaT refdate
+    :return: pandas DataFrame, holdings on business days with a datetime refdate
+    """
+    # Ensure refdate is in datetime format (read_excel already does this for real date cells)
+    if not pd.api.types.is_datetime64_any_dtype(df['refdate']):
+        df['refdate'] = pd.to_datetime(df['refdate'], format='%d/%m/%Y', errors=errors)
+
+    # Remove weekends from the dataset
+    return df[~df['refdate'].dt.weekday.isin([5, 6])]
+
+
+def _read_workbook(file_path):
+    with stage('read_excel') as record:
+        df = pd.read_excel(file_path)
+        record.rows_out = len(df)
+    return df
+
+
+def prepare_holdings(df):
+    """
+    Prepares raw holdings as load_holdings does, for holdings that are not read from a workbook.
+
+    Warns with the summary of the data quality exceptions, the rows whose refdate does not parse
+    are left out.
+
+    :param df: pandas DataFrame, raw holdings with the columns of the workbook (refdate as dd/mm/yyyy text or dates)
+    :return: pandas DataFrame, prepared holdings
+    """
+    df, summary = _prepare_holdings(df)
+    _warn_exceptions(summary)
+    return df
+
+
+@instrumented('prepare_holdings')
+def _prepare_holdings(df):
+    raw_refdates = df['refdate'].copy()
+    df = prepare_refdates(df, errors='coerce')
+
+    # Keep the rows in date order, so the cache can be streamed one day at a time
+    df = df.sort_values('refdate', kind='stable')
+
+    # Declared column types, the values that do not fit them are reported and set to missing
+    df, report = enforce_schema(df)
+    problems = schema_problems(report)
+    if problems:
+        warnings.warn('Holdings do not match the schema:\n' + '\n'.join(problems))
+
+    # Data quality checks, the rows whose refdate did not parse are reported and left out
+    with stage('validate_holdings') as record:
+        exceptions = validate_holdings(df, raw_refdates=raw_refdates)
+        record.rows_out = len(exceptions)
+    df = df[df['refdate'].notna()]
+
+    return df.reset_index(drop=True), summarize_exceptions(exceptions)
+
+
+def _build_cache(file_path, cache_path, meta_path):
+    df, summary = _prepare_holdings(_read_workbook(file_path))
+    _write_cache(df, file_path, cache_path, meta_path, summary)
+    _warn_exceptions(summary)
+    return df
+
+
+def _warn_exceptions(summary):
+    if len(summary):
+        left_out = ', the rows with an unparsed_refdate are left out' if (summary['rule'] == 'unparsed_refdate').any() else ''
+        warnings.warn(f'Holdings data quality exceptions{left_out} (python -m portfolio_analytics validate lists '
+                      f'every row):\n' + summary.to_string(index=False))
+
+
+def _cached_exceptions(meta_path):
+    # Summary of the exceptions recorded when the cache was built
+    with open(meta_path) as handle:
+        summary = pd.DataFrame(json.load(handle).get('exceptions', []), columns=SUMMARY_COLUMNS)
+    for column in ('first_refdate', 'last_refdate'):
+        summary[column] = pd.to_datetime(summary[column])
+    return summary
+
+
+def _file_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_is_current(file_path, cache_path, meta_path):
+    if not (os.path.exists(cache_path) and os.path.exists(meta_path)):
+        return False
+
+    with open(meta_path) as handle:
+        meta = json.load(handle)
+    if meta.get('version') != CACHE_VERSION:
+        return False
+
+    # Unchanged size and mtime means unchanged file, no need to read it
+    fingerprint = _file_fingerprint(file_path)
+    if all(meta.get(key) == value for key, value in fingerprint.items()):
+        return True
+
+    # The file was touched or copied, only rebuild if the content really changed
+    if meta.get('sha256') != _file_hash(file_path):
+        return False
+    meta.update(fingerprint)
+    _write_json(meta, meta_path)
+    return True
+
+
+def _write_cache(df, file_path, cache_path, meta_path, summary):
+    # Uncompressed so that later reads can memory-map the file instead of decoding it
+    tmp_path = cache_path + '.tmp'
+    feather.write_feather(df, tmp_path, compression='uncompressed', chunksize=CACHE_BATCH_ROWS)
+    os.replace(tmp_path, cache_path)
+
+    meta = {'version': CACHE_VERSION, 'source': os.path.abspath(file_path), 'sha256': _file_hash(file_path),
+            'exceptions': [{**record, 'first_refdate': _iso_date(record['first_refdate']),
+                            'last_refdate': _iso_date(record['last_refdate'])}
+                           for record in summary.astype(object).to_dict('records')]}
+    meta.update(_file_fingerprint(file_path))
+    _write_json(meta, meta_path)
+
+
+def _iso_date(value):
+    return None if pd.isna(value) else pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def _write_json(data, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(data, handle, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,252 @@
+"""
+Stage-level instrumentation of the analytics.
+
+The loading and calculation functions of the package are wrapped with instrumented(), and the
+scripts mark their own steps with stage(). When PORTFOLIO_PROFILE is set, every stage records its
+wall time, CPU time, rows in and out and memory delta, and the run log is written when the
+process exits: a JSON file (one entry per run) or a CSV file (one row per stage), chosen by the
+extension of PORTFOLIO_RUN_LOG. Adding 'cprofile' and/or 'tracemalloc' to PORTFOLIO_PROFILE
+(e.g. PORTFOLIO_PROFILE=cprofile,tracemalloc) also saves a cProfile file per outermost stage and
+measures Python allocations and their peak per stage.
+
+When PORTFOLIO_PROFILE is not set at import, instrumented() returns the functions unchanged and
+stage() returns a shared object that does nothing, so the instrumentation costs nothing. Stages
+run in worker processes (runner pools, headless rendering) are not recorded.
+"""
+import atexit
+import cProfile
+import csv
+import json
+import os
+import sys
+import time
+import tracemalloc
+from functools import wraps
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - only the memory delta without tracemalloc needs it
+    psutil = None
+
+# Environment variables switching the instrumentation on and choosing where the run log goes
+PROFILE_VARIABLE = 'PORTFOLIO_PROFILE'
+RUN_LOG_VARIABLE = 'PORTFOLIO_RUN_LOG'
+
+# Run log written when PORTFOLIO_RUN_LOG is not set
+DEFAULT_RUN_LOG = 'portfolio_run_log.json'
+
+# Optional captures that can be listed in PORTFOLIO_PROFILE
+CAPTURES = ('cprofile', 'tracemalloc')
+
+# Columns of a stage record, in the order of the CSV run log
+RECORD_FIELDS = ['Run', 'Script', 'Stage', 'Parent', 'Started', 'Wall Seconds', 'CPU Seconds', 'Rows In', 'Rows Out',
+                 'Memory Delta (MB)', 'Peak Memory (MB)', 'Profile']
+
+
+def profile_options():
+    """
+    Reads the instrumentation options from the environment.
+
+    :return: set of str, the captures requested (empty for timings only), None when instrumentation is off
+    """
+    value = os.environ.get(PROFILE_VARIABLE, '').strip().lower()
+    if value in ('', '0', 'false', 'no'):
+        return None
+    return {option.strip() for option in value.split(',') if option.strip() in CAPTURES}
+
+
+_OPTIONS = profile_options()
+_RUN = time.strftime('%Y-%m-%dT%H:%M:%S')
+_records = []
+_active = []
+
+
+class _Stage:
+    __slots__ = ('name', 'rows_in', 'rows_out', 'peak', '_record', '_wall', '_cpu', '_memory', '_profiler')
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.peak = 0
+
+    def __enter__(self):
+        self._record = {'Run': _RUN, 'Script': os.path.basename(sys.argv[0]), 'Stage': self.name,
+                        'Parent': _active[-1].name if _active else None, 'Started': time.strftime('%H:%M:%S')}
+        if 'tracemalloc' in _OPTIONS:
+            # The peak of the enclosing stage is kept before the peak is reset for this one
+            if _active:
+                _active[-1].peak = max(_active[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._memory = _memory_now()
+
+        # Only one profiler can run at a time, nested stages are part of the outermost profile
+        self._profiler = None
+        if 'cprofile' in _OPTIONS and not any(stage._profiler for stage in _active):
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+        _active.append(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _active.pop()
+        if self._profiler is not None:
+            self._profiler.disable()
+
+        record = self._record
+        record.update({'Wall Seconds': wall, 'CPU Seconds': cpu, 'Rows In': self.rows_in, 'Rows Out': self.rows_out})
+        memory = _memory_now()
+        record['Memory Delta (MB)'] = None if memory is None else (memory - self._memory) / 2 ** 20
+        record['Peak Memory (MB)'] = None
+        if 'tracemalloc' in _OPTIONS:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record['Peak Memory (MB)'] = self.peak / 2 ** 20
+            if _active:
+                _active[-1].peak = max(_active[-1].peak, self.peak)
+        record['Profile'] = _save_profile(self._profiler, self.name) if self._profiler is not None else None
+        _records.append(record)
+        return False
+
+
+class _NullStage:
+    __slots__ = ('rows_in', 'rows_out')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def enabled():
+    """
+    :return: bool, whether the instrumentation is on (decided once, at import)
+    """
+    return _OPTIONS is not None
+
+
+def stage(name, rows_in=None):
+    """
+    Context manager measuring a named stage; set rows_out on the object it returns.
+
+    :param name: str, name of the stage in the run log
+    :param rows_in: int, optional number of input rows
+    :return: context manager
+    """
+    if _OPTIONS is None:
+        return _NULL_STAGE
+    return _Stage(name, rows_in)
+
+
+def instrumented(name=None):
+    """
+    Decorator recording every call of a function as a stage.
+
+    The rows in are the rows of the first DataFrame argument and the rows out those of the result.
+
+    :param name: str, name of the stage, defaults to the function's name
+    :return: decorator, the identity when the instrumentation is off
+    """
+    def decorate(function):
+        if _OPTIONS is None:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            rows_in = next((rows for rows in map(row_count, args) if rows is not None), None)
+            with _Stage(name or function.__name__, rows_in) as record:
+                result = function(*args, **kwargs)
+                record.rows_out = row_count(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def row_count(value):
+    """
+    :param value: object, DataFrame, Series, or a tuple/dict of them
+    :return: int, number of rows (summed over the tables of a dict, first table of a tuple), None for other values
+    """
+    if hasattr(value, 'shape') and hasattr(value, 'index'):
+        return len(value)
+    if isinstance(value, tuple) and value:
+        return row_count(value[0])
+    if isinstance(value, dict) and value:
+        counts = [row_count(item) for item in value.values()]
+        return sum(counts) if all(count is not None for count in counts) else None
+    return None
+
+
+def records():
+    """
+    :return: list of dict, the stages recorded so far in this process, in the order they finished
+    """
+    return list(_records)
+
+
+def write_run_log(path=None):
+    """
+    Appends the stages recorded in this process to the run log.
+
+    :param path: str, .json or .csv file, defaults to PORTFOLIO_RUN_LOG or DEFAULT_RUN_LOG
+    """
+    if not _records:
+        return
+    path = path or _run_log_path()
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+
+    if path.lower().endswith('.csv'):
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=RECORD_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(_records)
+        return
+
+    runs = []
+    if os.path.exists(path):
+        with open(path) as handle:
+            runs = json.load(handle)
+    runs.append({'run': _RUN, 'script': os.path.basename(sys.argv[0]), 'stages': _records})
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(runs, handle, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _run_log_path():
+    return os.environ.get(RUN_LOG_VARIABLE) or DEFAULT_RUN_LOG
+
+
+def _memory_now():
+    if 'tracemalloc' in _OPTIONS:
+        return tracemalloc.get_traced_memory()[0]
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def _save_profile(profiler, name):
+    # Profiles go next to the run log, one file per stage and run
+    stem = os.path.splitext(_run_log_path())[0]
+    folder = f'{stem}_profiles'
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{_RUN.replace(':', '')}_{len(_records):03d}_{name.replace(' ', '_')}.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+if _OPTIONS is not None:
+    if 'tracemalloc' in _OPTIONS:
+        tracemalloc.start()
+    atexit.register(write_run_log)
@@ -0,0 +1,228 @@
+"""
+Persistent, append-only store of ESG rating migrations.
+
+The upgrades and downgrades found by portfolio_analytics.migrations are appended to a SQLite
+database together with a high-water mark (the last refdate processed) and the last rating of
+every security. A new run only looks at the holdings after the high-water mark: the stored last
+ratings stand in for the history, so the migrations found are the same as when the whole history
+is scanned again. The events are indexed by date, by security and by type of change, so questions
+like "downgrades of holdings above 1% in the last 30 days" are answered without the holdings.
+
+A missing country is stored as '' in last_ratings: SQLite keeps NULLs apart in a primary key, so
+every update would otherwise add a row for a security without a country instead of replacing it.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.migrations import migration_events
+from portfolio_analytics.ratings import RATING_LABELS
+
+# Tables and indexes of the store
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS migrations (
+    refdate TEXT NOT NULL,
+    asset_name TEXT NOT NULL,
+    country TEXT,
+    rating TEXT,
+    previous_rating TEXT,
+    change TEXT NOT NULL,
+    weight REAL
+);
+CREATE INDEX IF NOT EXISTS migrations_by_date ON migrations (refdate);
+CREATE INDEX IF NOT EXISTS migrations_by_security ON migrations (asset_name, country, refdate);
+CREATE INDEX IF NOT EXISTS migrations_by_change ON migrations (change, refdate);
+CREATE TABLE IF NOT EXISTS last_ratings (
+    asset_name TEXT NOT NULL,
+    country TEXT NOT NULL DEFAULT '',
+    refdate TEXT NOT NULL,
+    rating TEXT,
+    PRIMARY KEY (asset_name, country)
+);
+CREATE TABLE IF NOT EXISTS store_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Stores written before missing countries were stored as '': keep the latest row of every
+# security without a country, then give it the '' country
+NULL_COUNTRY_UPGRADE = '''
+DELETE FROM last_ratings WHERE country IS NULL AND rowid NOT IN (
+    SELECT rowid FROM last_ratings AS latest WHERE latest.country IS NULL AND latest.asset_name = last_ratings.asset_name
+    ORDER BY latest.refdate DESC, latest.rowid DESC LIMIT 1
+);
+UPDATE last_ratings SET country = '' WHERE country IS NULL;
+'''
+
+# Country stored in last_ratings for the securities without one
+MISSING_COUNTRY = ''
+
+# Columns of the events as returned by MigrationStore.events, and the store column of each
+EVENT_COLUMNS = {
+    'Asset Name': 'asset_name',
+    'Country': 'country',
+    'refdate': 'refdate',
+    'Overall ESG Category': 'rating',
+    'Previous ESG Category': 'previous_rating',
+    'Category Change': 'change',
+    'Normalized Weight': 'weight',
+}
+
+
+class MigrationStore:
+    """
+    SQLite store of the rating migrations of one portfolio.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, path of the SQLite database, created when it does not exist
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.connection.executescript(NULL_COUNTRY_UPGRADE)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @property
+    def high_water_mark(self):
+        """
+        :return: pandas Timestamp, last refdate processed, None for an empty store
+        """
+        row = self.connection.execute("SELECT value FROM store_state WHERE key = 'high_water_mark'").fetchone()
+        return pd.Timestamp(row[0]) if row else None
+
+    def update(self, df, rating_column='Overall ESG Category', weight_column='Normalized Weight'):
+        """
+        Appends the migrations of the refdates after the high-water mark.
+
+        :param df: pandas DataFrame, holdings with refdate, Asset Name, Country, rating_column and weight_column;
+                   only the rows after the high-water mark are used
+        :param rating_column: str, column with the ratings
+        :param weight_column: str, column stored as the weight of the events
+        :return: int, number of migrations appended
+        """
+        high_water_mark = self.high_water_mark
+        new_rows = df if high_water_mark is None else df[df['refdate'] > high_water_mark]
+        new_rows = new_rows[['refdate', 'Asset Name', 'Country', rating_column, weight_column]]
+        if new_rows.empty:
+            return 0
+
+        # The last stored rating of every security goes before its new rows, as if the history was there
+        last = pd.read_sql_query('SELECT asset_name, country, refdate, rating FROM last_ratings', self.connection)
+        history = pd.DataFrame({
+            'refdate': pd.to_datetime(last['refdate']),
+            'Asset Name': last['asset_name'],
+            'Country': last['country'].where(last['country'] != MISSING_COUNTRY, None),
+            rating_column: pd.Categorical(last['rating'], categories=list(RATING_LABELS), ordered=True),
+            weight_column: np.nan,
+        })
+        ratings = new_rows[rating_column]
+        if isinstance(ratings.dtype, pd.CategoricalDtype):
+            ratings = ratings.astype(object)
+        new_rows = new_rows.assign(**{'Asset Name': new_rows['Asset Name'].astype(object),
+                                      'Country': new_rows['Country'].astype(object),
+                                      rating_column: pd.Categorical(ratings, categories=list(RATING_LABELS), ordered=True)})
+        combined = pd.concat([history, new_rows], ignore_index=True)
+
+        events = migration_events(combined, rating_column=rating_column, columns=[weight_column])
+        if high_water_mark is not None:
+            events = events[events['refdate'] > high_water_mark]
+
+        # Last rating of every security in the new rows, carried into the next update
+        latest = new_rows.sort_values('refdate', kind='stable').drop_duplicates(['Asset Name', 'Country'], keep='last')
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO migrations (refdate, asset_name, country, rating, previous_rating, change, weight) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                zip(_iso_dates(events['refdate']), events['Asset Name'].astype(object), _text(events['Country']),
+                    _text(events[rating_column]), _text(events['Previous ESG Category']),
+                    events['Category Change'].astype(str), _numbers(events[weight_column])))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO last_ratings (asset_name, country, refdate, rating) VALUES (?, ?, ?, ?)',
+                zip(latest['Asset Name'], _text(latest['Country'], MISSING_COUNTRY), _iso_dates(latest['refdate']),
+                    _text(latest[rating_column])))
+            self.connection.execute("INSERT OR REPLACE INTO store_state (key, value) VALUES ('high_water_mark', ?)",
+                                    (pd.Timestamp(new_rows['refdate'].max()).strftime('%Y-%m-%d'),))
+        return len(events)
+
+    def events(self, change=None, start=None, end=None, min_weight=None, asset_name=None, country=None):
+        """
+        Reads stored migrations, filtered in SQL on the indexed columns.
+
+        :param change: str or list of str, 'Up' and/or 'Down'
+        :param start: date-like, first refdate
+        :param end: date-like, last refdate
+        :param min_weight: float, keep events whose weight is above it (0.01 for 1%)
+        :param asset_name: str, only this security
+        :param country: str, only the listing in this country
+        :return: pandas DataFrame, the events sorted by refdate and security, with the columns of EVENT_COLUMNS
+        """
+        conditions, parameters = [], []
+        if change is not None:
+            changes = [change] if isinstance(change, str) else list(change)
+            conditions.append(f"change IN ({', '.join('?' * len(changes))})")
+            parameters.extend(changes)
+        if start is not None:
+            conditions.append('refdate >= ?')
+            parameters.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            conditions.append('refdate <= ?')
+            parameters.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        if min_weight is not None:
+            conditions.append('weight > ?')
+            parameters.append(float(min_weight))
+        if asset_name is not None:
+            conditions.append('asset_name = ?')
+            parameters.append(asset_name)
+        if country is not None:
+            conditions.append('country = ?')
+            parameters.append(country)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        query = (f"SELECT {', '.join(EVENT_COLUMNS.values())} FROM migrations {where} "
+                 f"ORDER BY refdate, asset_name, country")
+        events = pd.read_sql_query(query, self.connection, params=parameters)
+        events.columns = list(EVENT_COLUMNS)
+        events['refdate'] = pd.to_datetime(events['refdate'])
+        for column in ('Overall ESG Category', 'Previous ESG Category'):
+            events[column] = pd.Categorical(events[column], categories=list(RATING_LABELS), ordered=True)
+        return events
+
+    def recent(self, days, change=None, min_weight=None):
+        """
+        Migrations of the last days calendar days up to the high-water mark.
+
+        :param days: int, number of calendar days
+        :param change: str or list of str, 'Up' and/or 'Down'
+        :param min_weight: float, keep events whose weight is above it
+        :return: pandas DataFrame, see events
+        """
+        end = self.high_water_mark
+        if end is None:
+            return self.events(change=change, min_weight=min_weight)
+        return self.events(change=change, start=end - pd.Timedelta(days=days - 1), end=end, min_weight=min_weight)
+
+
+def _iso_dates(values):
+    return pd.to_datetime(values).dt.strftime('%Y-%m-%d').tolist()
+
+
+def _text(values, missing=None):
+    return values.astype(object).where(values.notna(), missing).tolist()
+
+
+def _numbers(values):
+    return values.astype(float).astype(object).where(values.notna(), None).tolist()
@@ -0,0 +1,88 @@
+"""
+Detection of ESG rating migrations (upgrades and downgrades) between consecutive holding-days.
+
+The holdings are sorted once by security and refdate, then the previous rating of every row is
+the rating of the row before it unless a new security starts there. Comparing the integer rating
+ranks of the two arrays gives Up/Down/No Change/No Previous Data without any per-row Python call.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.instrumentation import instrumented
+from portfolio_analytics.parallel import security_transforms
+from portfolio_analytics.ratings import RATING_LABELS
+from portfolio_analytics.securities import SECURITY_KEY, SecurityMaster, security_order, security_starts
+
+# Outcomes of the comparison with the previous rating, the code of each is its position
+CHANGE_LABELS = ('No Previous Data', 'Down', 'No Change', 'Up')
+
+
+@instrumented()
+def detect_migrations(df, security_key=SECURITY_KEY, rating_column='Overall ESG Category',
+                      previous_column='Previous ESG Category'):
+    """
+    Adds the previous rating and the rating change of every holding-day.
+
+    :param df: pandas DataFrame, holdings with refdate, the security key and rating_column
+    :param security_key: sequence of str, columns identifying a security
+    :param rating_column: str, column with the ratings (ordered categorical or RATING_LABELS strings)
+    :param previous_column: str, name of the previous rating column to add
+    :return: pandas DataFrame, holdings sorted by security and refdate with previous_column and 'Category Change'
+    """
+    order, ranks, previous, changes, categories = _migration_pass(df, list(security_key), rating_column)
+
+    df = df.iloc[order].copy()
+    df[previous_column] = pd.Categorical.from_codes(previous, categories=categories, ordered=True)
+    df['Category Change'] = pd.Categorical.from_codes(changes, categories=list(CHANGE_LABELS))
+    return df
+
+
+@instrumented()
+def migration_events(df, security_key=SECURITY_KEY, rating_column='Overall ESG Category',
+                     previous_column='Previous ESG Category', columns=('Normalized Weight',)):
+    """
+    Returns only the rating upgrades and downgrades, as a compact event table.
+
+    :param df: pandas DataFrame, holdings with refdate, the security key and rating_column
+    :param security_key: sequence of str, columns identifying a security
+    :param rating_column: str, column with the ratings (ordered categorical or RATING_LABELS strings)
+    :param previous_column: str, name of the previous rating column
+    :param columns: sequence of str, extra holdings columns to carry into the events
+    :return: pandas DataFrame, one row per Up/Down change sorted by refdate and security
+    """
+    security_key = list(security_key)
+    order, ranks, previous, changes, categories = _migration_pass(df, security_key, rating_column)
+
+    # Keep the rows whose rating moved up or down
+    moved = (changes == CHANGE_LABELS.index('Up')) | (changes == CHANGE_LABELS.index('Down'))
+    rows = order[moved]
+
+    events = pd.DataFrame({column: df[column].to_numpy()[rows] for column in security_key + ['refdate']})
+    events[rating_column] = pd.Categorical.from_codes(ranks[moved], categories=categories, ordered=True)
+    events[previous_column] = pd.Categorical.from_codes(previous[moved], categories=categories, ordered=True)
+    events['Category Change'] = pd.Categorical.from_codes(changes[moved], categories=list(CHANGE_LABELS))
+    for column in columns:
+        events[column] = df[column].to_numpy()[rows]
+
+    return events.sort_values(['refdate'] + security_key, kind='stable', ignore_index=True)
+
+
+def _migration_pass(df, security_key, rating_column):
+    ratings = df[rating_column]
+    if not isinstance(ratings.dtype, pd.CategoricalDtype):
+        ratings = pd.Series(pd.Categorical(ratings, categories=list(RATING_LABELS), ordered=True))
+    categories = list(ratings.cat.categories)
+
+    # One sort by security ID then refdate
+    ids = SecurityMaster.build(df, security_key, attributes=())[1]
+    order = security_order(ids, df['refdate'].to_numpy())
+    ranks = ratings.cat.codes.to_numpy(dtype=np.int16)[order]
+    starts = security_starts(ids, order)
+
+    # Previous rank of the same security, -1 on its first row
+    previous = security_transforms({'rank': ranks}, starts, {'previous': ('previous', 'rank')})['previous']
+    previous = np.where(np.isnan(previous), -1, previous).astype(ranks.dtype)
+
+    # Down/No Change/Up are 1/2/3 from the sign of the rank difference, 0 without a previous (or current) rating
+    changes = np.where((previous < 0) | (ranks < 0), 0, np.sign(ranks - previous) + 2).astype(np.int8)
+    return order, ranks, previous, changes, categories
@@ -0,0 +1,165 @@
+"""
+Per-security time-series transforms on all cores.
+
+Once sorted by security ID, every security is a contiguous run of rows, so the rows can be cut
+into blocks on security boundaries and every block transformed on its own. The workers are
+forked after the inputs are set aside, so they read the parent's input arrays through
+copy-on-write memory without any copy, gather the rows of their blocks in security order and
+write the transforms (previous value, percentage change) straight into output arrays in shared
+memory. Only the row ranges and the names of the shared outputs are sent to the workers, no
+DataFrame or array is pickled.
+
+Workers have to be forked, with spawn every worker would also re-run the calling script. On
+Windows, where fork is not available, there is no parallelism at all: every call runs the same
+kernels in a single process, whatever max_workers is. The same happens outside the main thread
+(e.g. in the worker threads of portfolio_analytics.service, where a fork could copy a lock another
+thread holds) and for inputs below PARALLEL_MIN_ROWS, where starting the pool costs more than it
+saves. fork_context is shared with the chart rendering of portfolio_analytics.rendering.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Rows under which the transforms run in-process
+PARALLEL_MIN_ROWS = 2_000_000
+
+# Blocks per worker, so that a worker with larger securities does not hold the others up
+BLOCKS_PER_WORKER = 4
+
+
+def previous_values(values, starts, out=None):
+    """
+    Value of the row before, NaN on the first row of every security.
+
+    :param values: numpy array, rows sorted by security
+    :param starts: numpy array of bool, True on the first row of every security
+    :param out: numpy array of float, optional output
+    :return: numpy array of float
+    """
+    out = np.empty(len(values), dtype=np.float64) if out is None else out
+    out[1:] = values[:-1]
+    out[starts] = np.nan
+    return out
+
+
+def pct_change(values, starts, out=None):
+    """
+    Change from the value of the row before, NaN on the first row of every security.
+
+    :param values: numpy array, rows sorted by security
+    :param starts: numpy array of bool, True on the first row of every security
+    :param out: numpy array of float, optional output
+    :return: numpy array of float
+    """
+    out = previous_values(values, starts, out)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(values, out, out=out)
+    out -= 1
+    return out
+
+
+# Transforms that security_transforms can run, by name
+SECURITY_TRANSFORMS = {'previous': previous_values, 'pct_change': pct_change}
+
+
+def security_transforms(columns, starts, transforms, order=None, max_workers=None, min_rows=PARALLEL_MIN_ROWS):
+    """
+    Runs per-security transforms, in parallel for large inputs.
+
+    :param columns: dict, {name: numpy array} of the input columns
+    :param starts: numpy array of bool, True on the first row of every security, in security order
+    :param transforms: dict, {output name: (transform name in SECURITY_TRANSFORMS, input column name)}
+    :param order: numpy array of int, positions of the rows in security order (see securities.security_order),
+                  None when the columns are already sorted by security
+    :param max_workers: int, number of processes (defaults to the number of CPUs, 1 runs in-process)
+    :param min_rows: int, rows under which the transforms run in-process
+    :return: dict, {output name: numpy array of float in security order}
+    """
+    starts = np.asarray(starts, dtype=bool)
+    n_rows = len(starts)
+    workers = max_workers or os.cpu_count() or 1
+    context = fork_context()
+    if context is None or workers < 2 or n_rows < min_rows:
+        gathered = {name: values if order is None else values[order] for name, values in columns.items()}
+        return {output: SECURITY_TRANSFORMS[transform](gathered[column], starts)
+                for output, (transform, column) in transforms.items()}
+
+    global _inputs
+    blocks = _blocks(starts, workers * BLOCKS_PER_WORKER)
+    shared, arrays = [], {}
+    try:
+        # The forked workers inherit the inputs, only the outputs live in shared memory
+        _inputs = (columns, starts, order)
+        outputs = {}
+        for output in transforms:
+            block = shared_memory.SharedMemory(create=True, size=max(n_rows * 8, 1))
+            shared.append(block)
+            arrays[output] = np.ndarray(n_rows, dtype=np.float64, buffer=block.buf)
+            outputs[output] = block.name
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            list(pool.map(_run_block, [(outputs, transforms, start, end) for start, end in blocks]))
+
+        return {output: arrays[output].copy() for output in transforms}
+    finally:
+        _inputs = None
+
+        # The views have to go before the shared blocks can be closed
+        arrays.clear()
+        for block in shared:
+            block.close()
+            block.unlink()
+
+
+# Inputs of the running security_transforms call, inherited by its forked workers
+_inputs = None
+
+
+def _blocks(starts, n_blocks):
+    # Row ranges of about equal size, cut only where a security starts
+    n_rows = len(starts)
+    security_starts = np.flatnonzero(starts)
+    targets = np.linspace(0, n_rows, n_blocks + 1)[1:-1]
+    cuts = security_starts[np.minimum(np.searchsorted(security_starts, targets), len(security_starts) - 1)]
+    bounds = np.unique(np.concatenate([[0], cuts, [n_rows]]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _run_block(task):
+    outputs, transforms, start, end = task
+    columns, starts, order = _inputs
+    rows = slice(start, end) if order is None else order[start:end]
+    block_starts = starts[start:end].copy()
+    block_starts[:1] = True
+
+    blocks, arrays = [], {}
+    try:
+        for output, name in outputs.items():
+            blocks.append(shared_memory.SharedMemory(name=name))
+            arrays[output] = np.ndarray(len(starts), dtype=np.float64, buffer=blocks[-1].buf)
+        for output, (transform, column) in transforms.items():
+            SECURITY_TRANSFORMS[transform](columns[column][rows], block_starts, out=arrays[output][start:end])
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+def fork_context():
+    """
+    Multiprocessing context of the process pools, None when they have to be replaced by in-process work.
+
+    Only fork is used, and only from the main thread: forking while other threads run can copy
+    a lock that one of them holds into the child, which then waits on it forever.
+
+    :return: multiprocessing context, or None without fork or outside the main thread
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    return multiprocessing.get_context('fork')
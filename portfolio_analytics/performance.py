@@ -0,0 +1,206 @@
+"""
+Daily contribution and compounded gross performance.
+
+Besides the full calculation from inception, the compounded return can be carried forward
+incrementally: the last price and weight of every security and the running growth factor are
+saved in a small state file, so appending a new refdate only touches the holdings of that day.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.instrumentation import instrumented
+from portfolio_analytics.parallel import security_transforms
+from portfolio_analytics.securities import SECURITY_KEY, SecurityMaster, security_order, security_starts
+
+
+@instrumented()
+def add_contributions(df, max_workers=None):
+    """
+    Adds daily_perf, Open Exposure and Contribution columns to the holdings.
+
+    :param df: pandas DataFrame, holdings with refdate, Price(USD) and Weight (%)
+    :param max_workers: int, processes for the per-security transforms of large holdings (see portfolio_analytics.parallel)
+    :return: pandas DataFrame, holdings sorted by security and refdate with the new columns
+    """
+    # Sort by security ID and refdate instead of by the name and country strings
+    ids = SecurityMaster.build(df, attributes=())[1]
+    order = security_order(ids, df['refdate'].to_numpy())
+    starts = security_starts(ids, order)
+
+    # Calculate the daily price change for each security, and shift the Weight (%) by one date in order to get
+    # the Open Exposure for contribution calculation
+    transformed = security_transforms(
+        {'Price(USD)': df['Price(USD)'].to_numpy(dtype=np.float64), 'Weight (%)': df['Weight (%)'].to_numpy(dtype=np.float64)},
+        starts, {'daily_perf': ('pct_change', 'Price(USD)'), 'Open Exposure': ('previous', 'Weight (%)')},
+        order=order, max_workers=max_workers)
+    df = df.iloc[order].copy()
+    df['daily_perf'] = transformed['daily_perf']
+    df['Open Exposure'] = transformed['Open Exposure']
+
+    # Multiply the daily performance by the Open Exposure
+    df['Contribution'] = df['daily_perf'] * df['Open Exposure']
+    return df
+
+
+@instrumented()
+def add_benchmark_contributions(df):
+    """
+    Adds the benchmark's Open Benchmark Exposure and Benchmark Contribution columns.
+
+    The benchmark weight of a holding is Weight (%) - Active Weight (%); like the portfolio, its
+    open weight is the previous day's and its contribution is daily_perf times that.
+
+    :param df: pandas DataFrame, output of add_contributions (sorted by security and refdate) with Active Weight (%)
+    :return: pandas DataFrame, the same holdings with the new columns
+    """
+    ids = SecurityMaster.build(df, attributes=())[1]
+    starts = security_starts(ids, np.arange(len(df)))
+    benchmark_weight = (df['Weight (%)'] - df['Active Weight (%)']).to_numpy(dtype=np.float64)
+    df['Open Benchmark Exposure'] = security_transforms({'Benchmark Weight': benchmark_weight}, starts,
+                                                        {'previous': ('previous', 'Benchmark Weight')})['previous']
+    df['Benchmark Contribution'] = df['daily_perf'] * df['Open Benchmark Exposure']
+    return df
+
+
+@instrumented()
+def daily_performance(df):
+    """
+    Sums the contribution by date and compounds it.
+
+    :param df: pandas DataFrame, holdings with a Contribution column (see add_contributions)
+    :return: pandas DataFrame, refdate, Contribution and compounded_return per date
+    """
+    weighted_performance_sum = df.groupby('refdate')['Contribution'].sum().reset_index()
+    weighted_performance_sum['compounded_return'] = (weighted_performance_sum['Contribution'] + 1).cumprod() - 1
+    return weighted_performance_sum
+
+
+def build_performance_state(df):
+    """
+    Computes the compounded performance from inception and the state needed to extend it.
+
+    :param df: pandas DataFrame, holdings with refdate, Price(USD) and Weight (%), or the output of add_contributions
+    :return: dict, performance state (see update_performance_state)
+    """
+    if 'Contribution' not in df.columns:
+        df = add_contributions(df)
+    daily = daily_performance(df)
+
+    # Last observed price and weight of every security (df is sorted by security and refdate)
+    last = df.drop_duplicates(subset=SECURITY_KEY, keep='last')
+    last = pd.DataFrame({'Price(USD)': last['Price(USD)'].to_numpy(), 'Weight (%)': last['Weight (%)'].to_numpy()},
+                        index=_security_index(last))
+
+    return {
+        'last_refdate': daily['refdate'].max(),
+        'growth': float(daily['compounded_return'].iloc[-1] + 1) if len(daily) else 1.0,
+        'last': last,
+        'daily': daily,
+    }
+
+
+def update_performance_state(state, df):
+    """
+    Extends a performance state with the holdings of the refdates after its last refdate.
+
+    The cost of a new refdate does not depend on the length of the history: its contribution
+    only needs the previous price and weight of the securities held that day, which the state
+    keeps per security. Rows on or before the last refdate of the state are ignored, the
+    history is assumed to be append-only. A security held on several rows of a day (see the
+    duplicate_row check of portfolio_analytics.quality) is chained as in add_contributions: its
+    first row is compared with the state, every later row with the row before it, and its last
+    row gives the previous price and weight of the next day.
+
+    :param state: dict, state from build_performance_state or load_performance_state
+    :param df: pandas DataFrame, holdings containing the new refdates
+    :return: dict, the updated state
+    """
+    new_rows = df[df['refdate'] > state['last_refdate']]
+    if new_rows.empty:
+        return state
+
+    last = state['last']
+    growth = state['growth']
+    daily_rows = []
+    for refdate, day in new_rows.groupby('refdate', sort=True):
+        day_values = pd.DataFrame({'Price(USD)': day['Price(USD)'].to_numpy(), 'Weight (%)': day['Weight (%)'].to_numpy()},
+                                  index=_security_index(day))
+        previous = last.reindex(day_values.index).to_numpy(copy=True)
+
+        # A repeated security is compared with its row before on the same day, as in add_contributions
+        repeated = day_values.index.duplicated(keep='first')
+        if repeated.any():
+            same_day = day_values.groupby(level=SECURITY_KEY, sort=False, dropna=False).shift(1).to_numpy()
+            previous[repeated] = same_day[repeated]
+
+        # Same definition as add_contributions: price change times the previous weight
+        contribution = np.nansum((day_values['Price(USD)'].to_numpy() / previous[:, 0] - 1) * previous[:, 1])
+        growth *= 1 + contribution
+        daily_rows.append((refdate, contribution, growth - 1))
+
+        # Today's prices and weights become the previous ones for the next day, once per security
+        day_values = day_values[~day_values.index.duplicated(keep='last')]
+        last = pd.concat([last[~last.index.isin(day_values.index)], day_values])
+
+    daily = pd.DataFrame(daily_rows, columns=['refdate', 'Contribution', 'compounded_return'])
+    return {
+        'last_refdate': daily['refdate'].iloc[-1],
+        'growth': growth,
+        'last': last,
+        'daily': pd.concat([state['daily'], daily], ignore_index=True),
+    }
+
+
+@instrumented()
+def compounded_performance(df, state_path=None):
+    """
+    Returns the daily contribution and compounded return, incrementally when a state file is given.
+
+    Without state_path everything is computed from inception. With a state_path the saved state
+    is extended with the refdates of df after its last refdate (or built from df when the file
+    does not exist yet) and written back. The incremental mode works on the holdings as loaded,
+    there is no need to run add_contributions over the whole history first.
+
+    :param df: pandas DataFrame, holdings with refdate, Asset Name, Country, Price(USD) and Weight (%),
+               or the output of add_contributions
+    :param state_path: str, optional path of the saved performance state
+    :return: pandas DataFrame, refdate, Contribution and compounded_return per date
+    """
+    if state_path is None:
+        return build_performance_state(df)['daily']
+
+    if os.path.exists(state_path):
+        state = update_performance_state(load_performance_state(state_path), df)
+    else:
+        state = build_performance_state(df)
+    save_performance_state(state, state_path)
+    return state['daily']
+
+
+def load_performance_state(state_path):
+    """
+    Loads a performance state saved with save_performance_state.
+
+    :param state_path: str, path of the state file
+    :return: dict, performance state
+    """
+    return pd.read_pickle(state_path)
+
+
+def save_performance_state(state, state_path):
+    """
+    Saves a performance state, replacing the previous file only once the new one is complete.
+
+    :param state: dict, performance state
+    :param state_path: str, path of the state file
+    """
+    tmp_path = state_path + '.tmp'
+    pd.to_pickle(state, tmp_path)
+    os.replace(tmp_path, state_path)
+
+
+def _security_index(df):
+    # Plain (object) levels so that indexes built from different days line up
+    return pd.MultiIndex.from_arrays([df[column].astype(object).to_numpy() for column in SECURITY_KEY], names=SECURITY_KEY)
@@ -0,0 +1,151 @@
+"""
+Data quality checks of the holdings.
+
+The analytics assume clean data: a missing price silently gives NaN contributions, a missing ESG
+score falls into the lowest rating, a duplicated row is counted twice and a date that does not
+parse stops the run. validate_holdings runs every check as a few array operations over whole
+columns (the security checks on the rows sorted once by security ID, see
+portfolio_analytics.securities) and returns one exception row per problem found, so a bad file is
+reported within seconds of being read instead of failing, or quietly skewing the results, at the
+end of a long run. load_holdings runs the checks while it prepares a workbook, records
+summarize_exceptions with its cache and warns with it on every load; "python -m
+portfolio_analytics validate" writes the full report.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.parallel import pct_change
+from portfolio_analytics.ratings import MAX_SCORE, PILLAR_CATEGORIES
+from portfolio_analytics.securities import SECURITY_KEY, SecurityMaster, security_order, security_starts
+
+# Largest distance of the sum of the weights of a day from 100%
+WEIGHT_SUM_TOLERANCE = 0.05
+
+# Largest daily price change of a security before it is reported as a spike (0.5 for 50%)
+PRICE_SPIKE = 0.5
+
+# Business days between two holdings of a security above which its price history has a gap
+PRICE_GAP_DAYS = 5
+
+# Checks run by validate_holdings and the severity of their exceptions
+QUALITY_RULES = {
+    'unparsed_refdate': 'error',
+    'duplicate_row': 'error',
+    'missing_price': 'error',
+    'weight_sum': 'warning',
+    'price_spike': 'warning',
+    'price_gap': 'warning',
+    'score_range': 'error',
+    'missing_score': 'warning',
+}
+
+# Columns of the exceptions report, and of its summary
+EXCEPTION_COLUMNS = ['rule', 'severity', 'refdate', 'Asset Name', 'Country', 'column', 'value']
+SUMMARY_COLUMNS = ['rule', 'severity', 'count', 'first_refdate', 'last_refdate']
+
+
+def validate_holdings(df, rules=None, raw_refdates=None, weight_tolerance=WEIGHT_SUM_TOLERANCE, price_spike=PRICE_SPIKE,
+                      price_gap_days=PRICE_GAP_DAYS, max_score=MAX_SCORE):
+    """
+    Runs the data quality checks over the holdings.
+
+    The price and score checks only look at equities (rows with a GICS_sector), cash and other
+    non-equities have neither a meaningful price history nor ESG scores.
+
+    :param df: pandas DataFrame, holdings with refdate parsed (unparsed dates as NaT, see holdings.prepare_refdates)
+    :param rules: list of str, checks to run (keys of QUALITY_RULES), all of them when None
+    :param raw_refdates: pandas Series, refdate as read, indexed like df, reported for the dates that did not parse
+    :param weight_tolerance: float, largest distance of the daily sum of Weight (%) from 1
+    :param price_spike: float, largest absolute daily price change
+    :param price_gap_days: int, largest number of business days between two holdings of a security
+    :param max_score: float, top of the ESG score scale (scores are expected in [0, max_score])
+    :return: pandas DataFrame, one row per exception with EXCEPTION_COLUMNS, ordered by rule then refdate
+    """
+    rules = list(QUALITY_RULES) if rules is None else list(rules)
+    unknown = set(rules) - set(QUALITY_RULES)
+    if unknown:
+        raise ValueError(f'Unknown rules {sorted(unknown)}, expected some of {list(QUALITY_RULES)}')
+
+    exceptions = []
+    dated = df['refdate'].notna().to_numpy()
+    if 'unparsed_refdate' in rules:
+        raw = df['refdate'] if raw_refdates is None else raw_refdates.reindex(df.index)
+        exceptions.append(_exceptions(df, ~dated, 'unparsed_refdate', 'refdate', raw.astype(object)))
+    df = df[dated]
+
+    equity = df['GICS_sector'].notna().to_numpy() if 'GICS_sector' in df.columns else np.ones(len(df), dtype=bool)
+    if 'duplicate_row' in rules:
+        duplicated = df.duplicated(SECURITY_KEY + ['refdate'], keep='first').to_numpy()
+        exceptions.append(_exceptions(df, duplicated, 'duplicate_row', 'refdate', df['refdate']))
+
+    if 'weight_sum' in rules:
+        dates, date_codes = np.unique(df['refdate'].to_numpy(), return_inverse=True)
+        sums = np.bincount(date_codes, weights=np.nan_to_num(df['Weight (%)'].to_numpy(dtype=np.float64)),
+                           minlength=len(dates))
+        off = np.abs(sums - 1) > weight_tolerance
+        exceptions.append(pd.DataFrame({'rule': 'weight_sum', 'severity': QUALITY_RULES['weight_sum'],
+                                        'refdate': dates[off], 'Asset Name': None, 'Country': None,
+                                        'column': 'Weight (%)', 'value': sums[off]}))
+
+    prices = df['Price(USD)'].to_numpy(dtype=np.float64)
+    if 'missing_price' in rules:
+        exceptions.append(_exceptions(df, equity & ~(prices > 0), 'missing_price', 'Price(USD)', prices))
+
+    if 'price_spike' in rules or 'price_gap' in rules:
+        # Rows of every equity in date order, compared with the row before of the same security
+        equities = df[equity]
+        ids = SecurityMaster.build(equities, attributes=())[1]
+        dates = equities['refdate'].to_numpy()
+        order = security_order(ids, dates)
+        starts = security_starts(ids, order)
+        rows = equities.iloc[order]
+        if 'price_spike' in rules:
+            with np.errstate(invalid='ignore'):
+                changes = pct_change(prices[equity][order], starts)
+                spikes = np.abs(changes) > price_spike
+            exceptions.append(_exceptions(rows, spikes, 'price_spike', 'Price(USD)', changes))
+        if 'price_gap' in rules:
+            days = dates[order].astype('datetime64[D]')
+            gaps = np.zeros(len(days), dtype=np.int64)
+            gaps[1:] = np.busday_count(days[:-1], days[1:])
+            gaps[starts] = 0
+            exceptions.append(_exceptions(rows, gaps > price_gap_days, 'price_gap', 'refdate', gaps))
+
+    for column in [column for column in PILLAR_CATEGORIES if column in df.columns]:
+        scores = df[column].to_numpy(dtype=np.float64)
+        if 'score_range' in rules:
+            exceptions.append(_exceptions(df, equity & ((scores < 0) | (scores > max_score)), 'score_range', column, scores))
+        if 'missing_score' in rules:
+            exceptions.append(_exceptions(df, equity & np.isnan(scores), 'missing_score', column, scores))
+
+    exceptions = pd.concat([frame for frame in exceptions if len(frame)] or [pd.DataFrame(columns=EXCEPTION_COLUMNS)],
+                           ignore_index=True)
+    rule_order = exceptions['rule'].map({rule: i for i, rule in enumerate(QUALITY_RULES)})
+    return exceptions.iloc[np.lexsort((exceptions['refdate'].to_numpy(), rule_order.to_numpy()))].reset_index(drop=True)
+
+
+def summarize_exceptions(exceptions):
+    """
+    One line per rule with exceptions, for a warning or the console.
+
+    :param exceptions: pandas DataFrame, exceptions from validate_holdings
+    :return: pandas DataFrame, rule, severity, count and the first and last refdate concerned
+    """
+    return exceptions.groupby('rule', sort=False).agg(
+        severity=('severity', 'first'), count=('severity', 'size'),
+        first_refdate=('refdate', 'min'), last_refdate=('refdate', 'max')).reset_index()[SUMMARY_COLUMNS]
+
+
+def _exceptions(df, mask, rule, column, values):
+    # Exception rows of the rows selected by mask
+    mask = np.asarray(mask, dtype=bool)
+    values = np.asarray(values)[mask]
+    return pd.DataFrame({
+        'rule': rule,
+        'severity': QUALITY_RULES[rule],
+        'refdate': df['refdate'].to_numpy()[mask],
+        'Asset Name': df['Asset Name'].astype(object).to_numpy()[mask],
+        'Country': df['Country'].astype(object).to_numpy()[mask],
+        'column': column,
+        'value': values.astype(object) if values.dtype.kind == 'M' else values,
+    })
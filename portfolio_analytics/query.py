@@ -0,0 +1,414 @@
+"""
+Lazy query plans over the holdings.
+
+The scripts used to materialize a filtered copy of the whole, wide frame for every view
+(equities only, year to date, last day). Here a view is a Query: a chain of filters, derived
+columns and a final group-by or collect, which does nothing until execute() runs it. Before
+running, every plan is optimized:
+
+- predicate pushdown: a filter moves before the derived columns it does not use (unless the
+  derivation needs other rows, like the contribution that needs the previous day), and the
+  leading filters shared by all plans are applied while the columnar cache is read;
+- projection pushdown: only the columns used by a filter, a derivation or the result are read,
+  and derived columns that nothing uses are not computed;
+- common subexpressions: the plans run over one scan, and the state after every shared prefix of
+  steps (e.g. equities with their market cap bucket) is computed once for all views using it.
+
+Filters only narrow a boolean row mask and derived columns are kept aside as arrays, so nothing
+is copied until a result is built from the few columns it needs.
+
+Example:
+    equities = Query.scan(path).filter(col('GICS_sector').notna()).derive('Market Cap Bucket')
+    last_day = equities.filter(last_date()).group_sum(['GICS_sector'], ['Weight (%)'])
+    ytd = equities.derive('Contribution').filter(col('refdate') >= '2023-01-01').group_sum(['GICS_sector'], ['Contribution'])
+    results = execute({'last_day': last_day, 'ytd': ytd})
+
+The contribution is derived before the period filter: the contribution of the first day of the
+period needs the prices and weights of the day before it.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.holdings import MARKET_CAP_BINS, MARKET_CAP_LABELS, ensure_cache, load_holdings
+from portfolio_analytics.instrumentation import instrumented
+from portfolio_analytics.performance import add_contributions
+from portfolio_analytics.securities import SECURITY_KEY
+
+# Comparison operators of a predicate and their pandas implementation
+OPERATORS = {
+    '==': lambda values, other: values == other,
+    '!=': lambda values, other: values != other,
+    '<': lambda values, other: values < other,
+    '<=': lambda values, other: values <= other,
+    '>': lambda values, other: values > other,
+    '>=': lambda values, other: values >= other,
+    'isin': lambda values, other: values.isin(other),
+    'notna': lambda values, other: values.notna(),
+    'isna': lambda values, other: values.isna(),
+}
+
+
+class Predicate:
+    """
+    Row filter on one column, build them with col().
+    """
+
+    def __init__(self, column, operator, value=None):
+        self.column = column
+        self.operator = operator
+        self.value = value
+
+    @property
+    def key(self):
+        value = tuple(self.value) if isinstance(self.value, (list, set, tuple)) else self.value
+        return ('predicate', self.column, self.operator, value)
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    # Row-wise predicates can move past each other and into the scan
+    row_local = True
+
+    def mask(self, values):
+        """
+        :param values: pandas Series, the column on the rows still selected
+        :return: numpy array of bool
+        """
+        other = self.value
+        if pd.api.types.is_datetime64_any_dtype(values) and other is not None and self.operator != 'isin':
+            other = pd.Timestamp(other)
+        return np.asarray(OPERATORS[self.operator](values, other), dtype=bool)
+
+    def to_arrow(self):
+        """
+        Only used for the row-wise predicates, which are the only ones pushed into the scan.
+
+        :return: pyarrow.compute.Expression, the same filter for a pyarrow scan
+        """
+        import pyarrow.compute as pc
+
+        field = pc.field(self.column)
+        if self.operator == 'notna':
+            return field.is_valid()
+        if self.operator == 'isna':
+            return ~field.is_valid()
+        if self.operator == 'isin':
+            return field.isin(list(self.value))
+        value = self.value
+        if isinstance(value, (str, pd.Timestamp)) and self.column == 'refdate':
+            value = pd.Timestamp(value).to_pydatetime()
+        return {'==': field == value, '!=': field != value, '<': field < value, '<=': field <= value,
+                '>': field > value, '>=': field >= value}[self.operator]
+
+
+class LastDate(Predicate):
+    """
+    Keeps the rows of the last date among the rows selected so far.
+
+    It depends on which rows the earlier filters kept, so no filter moves across it and it is
+    never evaluated while the cache is read.
+    """
+
+    row_local = False
+
+    def __init__(self, column='refdate'):
+        super().__init__(column, 'last')
+
+    def mask(self, values):
+        return np.asarray(values == values.max(), dtype=bool)
+
+
+class Column:
+    """
+    Reference to a holdings column, comparing it gives a Predicate.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return Predicate(self.name, '==', other)
+
+    def __ne__(self, other):
+        return Predicate(self.name, '!=', other)
+
+    def __lt__(self, other):
+        return Predicate(self.name, '<', other)
+
+    def __le__(self, other):
+        return Predicate(self.name, '<=', other)
+
+    def __gt__(self, other):
+        return Predicate(self.name, '>', other)
+
+    def __ge__(self, other):
+        return Predicate(self.name, '>=', other)
+
+    def isin(self, values):
+        return Predicate(self.name, 'isin', tuple(values))
+
+    def notna(self):
+        return Predicate(self.name, 'notna')
+
+    def isna(self):
+        return Predicate(self.name, 'isna')
+
+    __hash__ = None
+
+
+def col(name):
+    """
+    :param name: str, holdings column
+    :return: Column, to compare into a filter (e.g. col('refdate') >= '2023-01-01')
+    """
+    return Column(name)
+
+
+def last_date(column='refdate'):
+    """
+    :param column: str, date column
+    :return: LastDate, filter keeping the last date of the rows selected so far
+    """
+    return LastDate(column)
+
+
+class Derivation:
+    """
+    A derived column: the columns it reads and how it is computed from them.
+
+    :param inputs: list of str, columns the derivation reads
+    :param function: callable, (pandas DataFrame of the inputs on the selected rows) -> array-like of the new column
+    :param row_local: bool, False when a row's value depends on other rows, filters then stay after it
+    """
+
+    def __init__(self, inputs, function, row_local=True):
+        self.inputs = list(inputs)
+        self.function = function
+        self.row_local = row_local
+
+
+def _market_cap_bucket(frame):
+    return pd.cut(frame['Market Capitalization (USD)'], bins=MARKET_CAP_BINS, labels=MARKET_CAP_LABELS)
+
+
+def _contribution(frame):
+    return add_contributions(frame)['Contribution'].reindex(frame.index)
+
+
+# Derived columns that Query.derive knows by name
+DERIVATIONS = {
+    'Market Cap Bucket': Derivation(['Market Capitalization (USD)'], _market_cap_bucket),
+    'Contribution': Derivation(SECURITY_KEY + ['refdate', 'Price(USD)', 'Weight (%)'], _contribution, row_local=False),
+}
+
+
+class Query:
+    """
+    Immutable plan over a holdings source, every method returns a new Query.
+    """
+
+    def __init__(self, source, steps=(), result=None):
+        self.source = source
+        self.steps = tuple(steps)
+        self.result = result
+
+    @classmethod
+    def scan(cls, source):
+        """
+        :param source: str (holdings workbook, read through its holdings cache, see holdings.ensure_cache) or pandas DataFrame (prepared holdings)
+        :return: Query, all rows of the source
+        """
+        return cls(source)
+
+    def filter(self, *predicates):
+        """
+        :param predicates: Predicate, filters that all have to match
+        :return: Query, with only the rows matching every predicate
+        """
+        return Query(self.source, self.steps + tuple(('filter', predicate) for predicate in predicates))
+
+    def derive(self, name, derivation=None):
+        """
+        :param name: str, new column, one of DERIVATIONS unless derivation is given
+        :param derivation: Derivation, optional custom derived column
+        :return: Query, with the derived column
+        """
+        derivation = derivation or DERIVATIONS[name]
+        return Query(self.source, self.steps + (('derive', (name, derivation)),))
+
+    def group_sum(self, keys, values):
+        """
+        :param keys: list of str, columns to group by
+        :param values: list of str, columns to sum
+        :return: Query, whose result is one row per group held, sorted by the keys
+        """
+        return Query(self.source, self.steps, ('group_sum', (tuple(keys), tuple(values))))
+
+    def collect(self, columns):
+        """
+        :param columns: list of str, columns of the result
+        :return: Query, whose result is the selected rows with these columns
+        """
+        return Query(self.source, self.steps, ('collect', tuple(columns)))
+
+    def execute(self):
+        """
+        :return: pandas DataFrame, the result of the query
+        """
+        return execute({None: self})[None]
+
+
+def optimize(query):
+    """
+    Reorders the filters of a plan and drops the derivations that nothing uses.
+
+    :param query: Query, plan with a result (group_sum or collect)
+    :return: tuple, (list of plan steps, set of source columns the plan reads)
+    """
+    if query.result is None:
+        raise ValueError('The query has no result, end it with group_sum() or collect()')
+
+    # Predicate pushdown: move every filter as early as the steps before it allow
+    steps = []
+    for step in query.steps:
+        position = len(steps)
+        if step[0] == 'filter' and step[1].row_local:
+            while position > 0 and _commutes(step[1], steps[position - 1]):
+                position -= 1
+        steps.insert(position, step)
+
+    # Projection pushdown: walk back from the result, keeping the columns and derivations needed
+    kind, payload = query.result
+    needed = set(payload[0]) | set(payload[1]) if kind == 'group_sum' else set(payload)
+    kept = []
+    for step in reversed(steps):
+        if step[0] == 'filter':
+            needed |= step[1].columns
+            kept.append(step)
+        elif step[1][0] in needed:
+            name, derivation = step[1]
+            needed.discard(name)
+            needed |= set(derivation.inputs)
+            kept.append(step)
+    return kept[::-1], needed
+
+
+@instrumented('execute_queries')
+def execute(queries):
+    """
+    Optimizes and runs several queries over the same source, sharing their common steps.
+
+    :param queries: dict, {name: Query}, all with the same source
+    :return: dict, {name: pandas DataFrame}
+    """
+    if not queries:
+        return {}
+    # Workbooks are the same source when their paths point to the same file, frames when they are the same object
+    sources = {os.path.realpath(query.source) if isinstance(query.source, str) else id(query.source)
+               for query in queries.values()}
+    if len(sources) > 1:
+        raise ValueError('execute() runs queries over one source, execute the other sources separately')
+    source = next(iter(queries.values())).source
+
+    plans = {name: optimize(query) for name, query in queries.items()}
+    columns = set().union(*(needed for _, needed in plans.values()))
+
+    # Filters at the start of every plan are applied while reading
+    pushed = _shared_leading_filters([steps for steps, _ in plans.values()])
+    frame = _scan(source, columns, [step[1] for step in pushed])
+
+    # States after every prefix of steps, shared by the plans starting with the same steps
+    memo = {(): (np.ones(len(frame), dtype=bool), {})}
+    results = {}
+    for name, (steps, _) in plans.items():
+        steps = steps[len(pushed):]
+        prefix = ()
+        state = memo[prefix]
+        for step in steps:
+            prefix = prefix + (_step_key(step),)
+            if prefix not in memo:
+                memo[prefix] = _apply(step, frame, *state)
+            state = memo[prefix]
+        results[name] = _result(queries[name].result, frame, *state)
+    return results
+
+
+def _commutes(predicate, step):
+    if step[0] == 'filter':
+        return step[1].row_local
+    name, derivation = step[1]
+    return derivation.row_local and name not in predicate.columns
+
+
+def _step_key(step):
+    if step[0] == 'filter':
+        return step[1].key
+    name, derivation = step[1]
+    return ('derive', name, id(derivation))
+
+
+def _shared_leading_filters(plans):
+    shared = []
+    for steps in zip(*plans):
+        first = steps[0]
+        if first[0] != 'filter' or not first[1].row_local or any(_step_key(step) != _step_key(first) for step in steps):
+            break
+        shared.append(first)
+    return shared
+
+
+def _scan(source, columns, predicates):
+    columns = sorted(columns)
+    if isinstance(source, pd.DataFrame):
+        frame = source[[column for column in columns if column in source.columns]]
+        mask = np.ones(len(frame), dtype=bool)
+        for predicate in predicates:
+            mask &= predicate.mask(frame[predicate.column])
+        return frame if mask.all() else frame[mask]
+
+    # A workbook is read through its columnar cache, with the filters evaluated by pyarrow
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:  # pragma: no cover - the plans still run, on the whole frame
+        return _scan(load_holdings(source), columns, predicates)
+    dataset = ds.dataset(ensure_cache(source), format='ipc')
+    columns = [column for column in columns if column in dataset.schema.names]
+    expression = None
+    for predicate in predicates:
+        expression = predicate.to_arrow() if expression is None else expression & predicate.to_arrow()
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def _apply(step, frame, mask, derived):
+    if step[0] == 'filter':
+        predicate = step[1]
+        values = _column(frame, mask, derived, predicate.column)
+        mask = mask.copy()
+        mask[mask] = predicate.mask(values)
+        return mask, derived
+
+    name, derivation = step[1]
+    inputs = pd.DataFrame({column: _column(frame, mask, derived, column) for column in derivation.inputs})
+    values = pd.Series(derivation.function(inputs), index=inputs.index)
+    return mask, {**derived, name: (mask, values)}
+
+
+def _column(frame, mask, derived, column):
+    # A column on the selected rows; a derived column was computed on a superset of them
+    if column in derived:
+        derived_mask, values = derived[column]
+        return values[mask[derived_mask]]
+    return frame[column][mask]
+
+
+def _result(result, frame, mask, derived):
+    kind, payload = result
+    if kind == 'collect':
+        return pd.DataFrame({column: _column(frame, mask, derived, column) for column in payload}).reset_index(drop=True)
+
+    keys, values = payload
+    table = pd.DataFrame({column: _column(frame, mask, derived, column) for column in keys + values})
+    return table.groupby(list(keys), observed=True)[list(values)].sum().reset_index()
@@ -0,0 +1,101 @@
+"""
+MSCI-style ESG rating buckets.
+
+Scores are bucketed with one searchsorted over the sorted thresholds instead of an if/elif chain
+per value, and the ratings are returned as ordered categoricals, so their codes rank them from
+the lowest (CCC = 0) to the highest rating (AAA = 6). Scores stored as float32 (see
+portfolio_analytics.schema) are compared with float32 thresholds: widened to float64, a score of
+4.286 becomes 4.28599977... and would fall below the float64 threshold of BBB.
+"""
+import numpy as np
+import pandas as pd
+
+# Lower bound of every rating above the lowest one, in increasing order
+MSCI_THRESHOLDS = (1.429, 2.857, 4.286, 5.714, 7.143, 8.571)
+
+# Ratings from the lowest to the highest, one more than there are thresholds
+RATING_LABELS = ('CCC', 'B', 'BB', 'BBB', 'A', 'AA', 'AAA')
+
+# Top of the score scale, scores above it (and missing scores) get the lowest rating
+MAX_SCORE = 10.0
+
+# ESG pillar score columns and the rating columns derived from them
+PILLAR_CATEGORIES = {
+    'Overall ESG Score': 'Overall ESG Category',
+    'Overall ESG Environmental Score': 'Environmental ESG Category',
+    'Overall ESG Social Score': 'Social ESG Category',
+    'Overall ESG Governance Score': 'Governance ESG Category',
+}
+
+
+def rating_codes(scores, thresholds=MSCI_THRESHOLDS, max_score=MAX_SCORE):
+    """
+    Returns the rank of the rating of every score (0 for the lowest rating).
+
+    :param scores: array-like or pandas DataFrame of float, scores of any shape
+    :param thresholds: sequence of float, increasing lower bounds of the ratings above the lowest
+    :param max_score: float, top of the score scale
+    :return: numpy array of int8, rating ranks with the shape of scores
+    """
+    # The thresholds take the precision of the scores, float32 when all of them are float32
+    if isinstance(scores, pd.DataFrame):
+        single = bool((scores.dtypes == np.float32).all())
+    else:
+        single = getattr(scores, 'dtype', None) == np.float32
+    dtype = np.float32 if single else np.float64
+    values = np.asarray(scores, dtype=dtype)
+    codes = np.searchsorted(np.asarray(thresholds, dtype=dtype), values, side='right').astype(np.int8)
+
+    # Missing scores and scores off the top of the scale fall in the lowest rating
+    codes[~(values <= max_score)] = 0
+    return codes
+
+
+def categorize_esg_scores(scores, thresholds=MSCI_THRESHOLDS, labels=RATING_LABELS, max_score=MAX_SCORE):
+    """
+    Buckets scores into ratings.
+
+    :param scores: pandas Series or array-like of float, scores
+    :param thresholds: sequence of float, increasing lower bounds of the ratings above the lowest
+    :param labels: sequence of str, ratings from the lowest to the highest (len(thresholds) + 1)
+    :param max_score: float, top of the score scale
+    :return: ordered pandas Categorical, or a Series with the index of scores when a Series is given
+    """
+    if len(labels) != len(thresholds) + 1:
+        raise ValueError(f'Expected {len(thresholds) + 1} labels for {len(thresholds)} thresholds, got {len(labels)}')
+
+    ratings = pd.Categorical.from_codes(rating_codes(scores, thresholds, max_score),
+                                        categories=list(labels), ordered=True)
+    if isinstance(scores, pd.Series):
+        return pd.Series(ratings, index=scores.index, name=scores.name)
+    return ratings
+
+
+def categorize_esg_score(score, thresholds=MSCI_THRESHOLDS, labels=RATING_LABELS, max_score=MAX_SCORE):
+    """
+    Buckets a single score into a rating.
+
+    :param score: float, score
+    :return: str, rating
+    """
+    return labels[rating_codes([score], thresholds, max_score)[0]]
+
+
+def rate_pillars(df, pillars=None, thresholds=MSCI_THRESHOLDS, labels=RATING_LABELS, max_score=MAX_SCORE):
+    """
+    Buckets the scores of several pillars into ratings with one call.
+
+    :param df: pandas DataFrame, holdings with the pillar score columns
+    :param pillars: dict, {score column: rating column}, defaults to PILLAR_CATEGORIES
+    :return: pandas DataFrame, one ordered categorical rating column per pillar, indexed like df
+    """
+    pillars = PILLAR_CATEGORIES if pillars is None else pillars
+    if len(labels) != len(thresholds) + 1:
+        raise ValueError(f'Expected {len(thresholds) + 1} labels for {len(thresholds)} thresholds, got {len(labels)}')
+
+    # All pillars are bucketed in a single pass over a 2-D array of scores
+    codes = rating_codes(df[list(pillars)], thresholds, max_score)
+    return pd.DataFrame({
+        rating_column: pd.Categorical.from_codes(codes[:, i], categories=list(labels), ordered=True)
+        for i, rating_column in enumerate(pillars.values())
+    }, index=df.index)
@@ -0,0 +1,203 @@
+"""
+Rendering of the charts, either interactively or headless in a pool of processes.
+
+Interactive mode (the default) keeps the behaviour of the scripts: every chart is shown as soon
+as it is added and saved when an output folder is set. Headless mode (PORTFOLIO_HEADLESS=1, or
+headless=True) uses the Agg backend and queues the charts. run() then builds them in a process
+pool and writes them to the output folder, skipping charts whose input data has the same hash as
+on the previous run (recorded in a manifest in the output folder).
+
+Table-only mode (PORTFOLIO_TABLES_ONLY=1, or tables_only=True) drops the charts altogether, the
+scripts then only print and export their tables and matplotlib is never imported.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from portfolio_analytics.instrumentation import instrumented, stage
+from portfolio_analytics.parallel import fork_context
+
+# Environment variables switching the scripts to headless mode and choosing where charts go
+HEADLESS_VARIABLE = 'PORTFOLIO_HEADLESS'
+OUTPUT_DIR_VARIABLE = 'PORTFOLIO_OUTPUT_DIR'
+TABLES_ONLY_VARIABLE = 'PORTFOLIO_TABLES_ONLY'
+
+# Folder used in headless mode when neither the script nor the environment sets one
+DEFAULT_OUTPUT_DIR = 'charts'
+
+# Name of the file recording the input hash of every chart written to an output folder
+MANIFEST_NAME = '.render_manifest.json'
+
+
+def headless_requested():
+    """
+    Tells whether headless rendering was requested through the environment.
+
+    :return: bool
+    """
+    return os.environ.get(HEADLESS_VARIABLE, '').strip().lower() in ('1', 'true', 'yes')
+
+
+def tables_only_requested():
+    """
+    Tells whether table-only mode (no charts at all) was requested through the environment.
+
+    :return: bool
+    """
+    return os.environ.get(TABLES_ONLY_VARIABLE, '').strip().lower() in ('1', 'true', 'yes')
+
+
+class RenderQueue:
+    """
+    Collects chart jobs and renders them.
+
+    A job is a chart function from portfolio_analytics.charts (or any picklable function
+    returning a matplotlib Figure), its arguments and the file name to write it to.
+    """
+
+    def __init__(self, output_dir=None, headless=None, max_workers=None, skip_unchanged=True, tables_only=None):
+        """
+        :param output_dir: str, folder for the chart files, defaults to PORTFOLIO_OUTPUT_DIR
+        :param headless: bool, defaults to headless_requested()
+        :param max_workers: int, size of the process pool in headless mode (defaults to the number of CPUs, 1 renders in-process)
+        :param skip_unchanged: bool, in headless mode skip charts whose inputs did not change
+        :param tables_only: bool, drop every chart without importing matplotlib, defaults to tables_only_requested()
+        """
+        self.tables_only = tables_only_requested() if tables_only is None else tables_only
+        self.headless = headless_requested() if headless is None else headless
+        self.output_dir = output_dir if output_dir is not None else os.environ.get(OUTPUT_DIR_VARIABLE) or None
+        if self.headless and self.output_dir is None:
+            self.output_dir = DEFAULT_OUTPUT_DIR
+        self.max_workers = max_workers
+        self.skip_unchanged = skip_unchanged
+        self.jobs = []
+
+        if self.headless and not self.tables_only:
+            import matplotlib
+            matplotlib.use('Agg')
+
+    def add(self, filename, function, *args, **kwargs):
+        """
+        Adds a chart. In interactive mode it is drawn and shown straight away, in table-only mode it is dropped.
+
+        :param filename: str, name of the chart file in the output folder
+        :param function: callable, builds and returns the matplotlib Figure
+        :param args: positional arguments of function
+        :param kwargs: keyword arguments of function
+        """
+        if self.tables_only:
+            return
+        if not self.headless:
+            _show_chart(self._output_path(filename), function, args, kwargs)
+            return
+        self.jobs.append((filename, function, args, kwargs))
+
+    @instrumented('render_charts')
+    def run(self):
+        """
+        Renders the queued charts (headless mode only) and empties the queue.
+
+        :return: list of str, paths of the charts written (unchanged charts are not included)
+        """
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return []
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest_path = os.path.join(self.output_dir, MANIFEST_NAME)
+        manifest = _read_manifest(manifest_path) if self.skip_unchanged else {}
+
+        # Only render the charts whose inputs changed since they were last written
+        pending = []
+        for filename, function, args, kwargs in jobs:
+            output_path = self._output_path(filename)
+            digest = job_hash(function, args, kwargs)
+            if self.skip_unchanged and manifest.get(filename) == digest and os.path.exists(output_path):
+                continue
+            pending.append((output_path, function, args, kwargs))
+            manifest[filename] = digest
+
+        written = []
+        context = fork_context()
+        if context is None or len(pending) < 2 or self.max_workers == 1:
+            # Without fork (or outside the main thread) the charts are rendered in this process
+            written = [_render_chart(*job) for job in pending]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context) as pool:
+                written = list(pool.map(_render_chart, *zip(*pending)))
+
+        _write_manifest(manifest, manifest_path)
+        return written
+
+    def _output_path(self, filename):
+        if self.output_dir is None:
+            return None
+        return os.path.join(self.output_dir, filename)
+
+
+def job_hash(function, args, kwargs):
+    """
+    Hashes a chart job: the function's name and the content of its arguments.
+
+    :param function: callable, chart function
+    :param args: tuple, positional arguments
+    :param kwargs: dict, keyword arguments
+    :return: str, hex digest
+    """
+    digest = hashlib.sha256(f'{function.__module__}.{function.__qualname__}'.encode())
+    for value in args:
+        _update_hash(digest, value)
+    for key, value in sorted(kwargs.items()):
+        digest.update(key.encode())
+        _update_hash(digest, value)
+    return digest.hexdigest()
+
+
+def _update_hash(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(value.columns if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    else:
+        digest.update(repr(value).encode())
+
+
+def _show_chart(output_path, function, args, kwargs):
+    import matplotlib.pyplot as plt
+
+    with stage(f'chart {function.__name__}'):
+        fig = function(*args, **kwargs)
+    if output_path is not None:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with stage('savefig'):
+            fig.savefig(output_path)
+    plt.show()
+
+
+def _render_chart(output_path, function, args, kwargs):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    with stage(f'chart {function.__name__}'):
+        fig = function(*args, **kwargs)
+    with stage('savefig'):
+        fig.savefig(output_path)
+    plt.close(fig)
+    return output_path
+
+
+def _read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as handle:
+        return json.load(handle)
+
+
+def _write_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
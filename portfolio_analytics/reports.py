@@ -0,0 +1,99 @@
+"""
+Export of result tables to Excel workbooks.
+
+Values are written as numbers and shown as percentages (or dates) through number formats on
+their columns, so the cells stay summable instead of holding '1.23%' text. The workbook is
+written with xlsxwriter in constant-memory mode: every row is flushed to disk as soon as it is
+written, and all the sheets of a run go into the workbook in one pass. The tables are turned into
+Python values a chunk of rows at a time, so the memory of an export does not grow with the size
+of its tables. Infinite values (e.g. a return from a zero price) are written as #NUM! errors, as
+pandas' to_excel does.
+"""
+import os
+import warnings
+
+import pandas as pd
+
+from portfolio_analytics.instrumentation import instrumented
+
+try:
+    import xlsxwriter
+except ImportError:  # pragma: no cover - pandas' default Excel engine is used instead, without formats
+    xlsxwriter = None
+
+# Number formats of the percentage and date cells
+PERCENT_FORMAT = '0.00%'
+DATE_FORMAT = 'yyyy-mm-dd'
+
+# Columns holding fractions (0.0123 for 1.23%) that are shown as percentages
+PERCENT_COLUMNS = {
+    'Weight (%)', 'Active Weight (%)', 'Exposure', 'Active Exposure', 'Contribution', 'compounded_return',
+    'Normalized Weight', 'Portfolio Return', 'Benchmark Return', 'Active Return', 'Volatility',
+    'Benchmark Volatility', 'Tracking Error', 'Drawdown', 'Rolling Drawdown',
+}
+
+# Width of the columns, in characters
+COLUMN_WIDTH = 18
+
+# Rows converted to Python values at once
+ROWS_PER_CHUNK = 10_000
+
+
+def percent_formats(table):
+    """
+    :param table: pandas DataFrame, table to export
+    :return: dict, {column: PERCENT_FORMAT} for the columns of the table in PERCENT_COLUMNS
+    """
+    return {column: PERCENT_FORMAT for column in table.columns if column in PERCENT_COLUMNS}
+
+
+@instrumented()
+def write_report(path, sheets, number_formats=None):
+    """
+    Writes tables to the sheets of one workbook, in one pass.
+
+    :param path: str, path of the .xlsx workbook, replaced once it is complete
+    :param sheets: dict, {sheet name: pandas DataFrame}, written in order without the index
+    :param number_formats: dict, {sheet name: {column: Excel number format}}, defaults to percent_formats of every table
+    """
+    if xlsxwriter is None:
+        warnings.warn('xlsxwriter is not installed, writing the report without number formats')
+        with pd.ExcelWriter(path) as writer:
+            for name, table in sheets.items():
+                table.to_excel(writer, sheet_name=name[:31], index=False)
+        return
+
+    tmp_path = path + '.tmp'
+    workbook = xlsxwriter.Workbook(tmp_path, {'constant_memory': True, 'default_date_format': DATE_FORMAT,
+                                              'nan_inf_to_errors': True})
+    header_format = workbook.add_format({'bold': True})
+    cell_formats = {}
+    for name, table in sheets.items():
+        worksheet = workbook.add_worksheet(name[:31])
+        formats = number_formats.get(name, {}) if number_formats is not None else percent_formats(table)
+
+        # Formats are set once per column, cells written without a format of their own take it
+        for position, column in enumerate(table.columns):
+            number_format = formats.get(column)
+            if number_format is not None and number_format not in cell_formats:
+                cell_formats[number_format] = workbook.add_format({'num_format': number_format})
+            worksheet.set_column(position, position, COLUMN_WIDTH, cell_formats.get(number_format))
+
+        worksheet.write_row(0, 0, [str(column) for column in table.columns], header_format)
+        for row, values in enumerate(_rows(table), start=1):
+            worksheet.write_row(row, 0, values)
+    workbook.close()
+    os.replace(tmp_path, path)
+
+
+def _rows(table, chunk_size=ROWS_PER_CHUNK):
+    # Python values column by column (missing values as None, written as empty cells), then zipped into rows,
+    # one chunk of rows at a time
+    for start in range(0, len(table), chunk_size):
+        chunk = table.iloc[start:start + chunk_size]
+        columns = []
+        for _, values in chunk.items():
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            columns.append(values.astype(object).where(values.notna(), None).tolist())
+        yield from zip(*columns)
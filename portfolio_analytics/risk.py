@@ -0,0 +1,132 @@
+"""
+Rolling-window risk and return analytics.
+
+The daily portfolio and benchmark returns are the sums of the security contributions of
+add_contributions and add_benchmark_contributions (the benchmark weights are recovered as
+Weight (%) - Active Weight (%)). Every rolling statistic is built from cumulative sums: the sum
+over a window ending at t is S[t] - S[t - window], so each step costs the same whatever the
+window length. Volatility and tracking error come from the rolling sums of the returns and of
+their squares (of the deviations from the overall mean, which keeps the difference of the two
+sums accurate), the rolling drawdown from the running maximum over the window.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.attribution import carino_ratio
+from portfolio_analytics.grouping import DateGroupSums
+
+# Default window, in business days (about three months)
+RISK_WINDOW = 63
+
+# Business days per year, to annualize the volatilities
+ANNUALIZATION = 252
+
+
+def rolling_sum(values, window, min_periods=None):
+    """
+    Sums of the last window values along the first axis, from one cumulative sum.
+
+    :param values: numpy array of float, (dates) or (dates x series), missing values count as 0
+    :param window: int, number of dates in the window
+    :param min_periods: int, dates needed for a result (defaults to window), NaN before
+    :return: numpy array of float, same shape as values
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    cumulative = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    sums = cumulative[ends] - cumulative[starts]
+
+    # Not enough dates yet
+    counts = ends - starts
+    sums[counts < (window if min_periods is None else min_periods)] = np.nan
+    return sums
+
+
+def rolling_volatility(returns, window=RISK_WINDOW, annualization=ANNUALIZATION):
+    """
+    Rolling standard deviation of daily returns, annualized.
+
+    :param returns: numpy array of float, daily returns
+    :param window: int, number of dates in the window
+    :param annualization: int, periods per year
+    :return: numpy array of float, NaN until the first full window
+    """
+    returns = np.nan_to_num(np.asarray(returns, dtype=np.float64))
+    deviations = returns - returns.mean() if len(returns) else returns
+    sums = rolling_sum(deviations, window)
+    squares = rolling_sum(deviations ** 2, window)
+    variance = np.maximum(squares - sums ** 2 / window, 0) / (window - 1)
+    return np.sqrt(variance * annualization)
+
+
+def daily_returns(df):
+    """
+    Daily portfolio, benchmark and active returns.
+
+    :param df: pandas DataFrame, holdings with Contribution and Benchmark Contribution (see portfolio_analytics.performance)
+    :return: pandas DataFrame, refdate, Portfolio Return, Benchmark Return and Active Return per date
+    """
+    dates, date_codes = np.unique(df['refdate'].to_numpy(), return_inverse=True)
+    returns = pd.DataFrame({'refdate': pd.DatetimeIndex(dates, name='refdate')})
+    for column, name in (('Contribution', 'Portfolio Return'), ('Benchmark Contribution', 'Benchmark Return')):
+        contributions = np.nan_to_num(df[column].to_numpy(dtype=np.float64))
+        returns[name] = np.bincount(date_codes, weights=contributions, minlength=len(dates))
+    returns['Active Return'] = returns['Portfolio Return'] - returns['Benchmark Return']
+    return returns
+
+
+def rolling_risk(df, window=RISK_WINDOW, annualization=ANNUALIZATION):
+    """
+    Rolling volatility, tracking error and drawdown of the portfolio.
+
+    :param df: pandas DataFrame, holdings with Contribution and Benchmark Contribution
+    :param window: int, number of dates in the window
+    :param annualization: int, periods per year
+    :return: pandas DataFrame, the daily returns (see daily_returns) with Volatility, Benchmark Volatility,
+             Tracking Error, Drawdown (from the highest value to date) and Rolling Drawdown (from the highest
+             value within the window)
+    """
+    risk = daily_returns(df)
+    risk['Volatility'] = rolling_volatility(risk['Portfolio Return'].to_numpy(), window, annualization)
+    risk['Benchmark Volatility'] = rolling_volatility(risk['Benchmark Return'].to_numpy(), window, annualization)
+    risk['Tracking Error'] = rolling_volatility(risk['Active Return'].to_numpy(), window, annualization)
+
+    # The rolling maximum keeps a monotonic queue of candidates, so it is also O(1) per date on average
+    wealth = (1 + risk['Portfolio Return']).cumprod()
+    risk['Drawdown'] = wealth / wealth.cummax() - 1
+    risk['Rolling Drawdown'] = wealth / wealth.rolling(window, min_periods=1).max() - 1
+    return risk
+
+
+def rolling_contributions(df, dimension, window=RISK_WINDOW, linking=None, contribution_column='Contribution'):
+    """
+    Contribution of every group over the last window dates, at every date.
+
+    With linking='carino' the contributions of every window are Carino-linked, so that the groups
+    add up to the compounded return of the window: the sums of contribution * ln(1 + r) / r are
+    rolling sums as well, divided by ln(1 + R) / R of the window.
+
+    :param df: pandas DataFrame, holdings with refdate, the dimension column and contribution_column
+    :param dimension: str, column to group by (e.g. 'GICS_sector')
+    :param window: int, number of dates in the window
+    :param linking: str, None for plain sums or 'carino'
+    :param contribution_column: str, column holding the daily contribution
+    :return: pandas DataFrame, indexed by refdate with one column per group
+    """
+    if linking not in (None, 'carino'):
+        raise ValueError(f"Unknown linking method {linking!r}, rolling contributions support None and 'carino'")
+    reduced = DateGroupSums.build(df, [dimension], [contribution_column])
+    contributions = reduced.sums[contribution_column][reduced.rows(dimension)].T
+
+    if linking == 'carino':
+        date_codes = reduced.dates.searchsorted(df['refdate'].to_numpy())
+        returns = np.bincount(date_codes, weights=np.nan_to_num(df[contribution_column].to_numpy(dtype=np.float64)),
+                              minlength=len(reduced.dates))
+        window_return = np.expm1(rolling_sum(np.log1p(returns), window))
+        contributions = rolling_sum(contributions * carino_ratio(returns)[:, None], window) / carino_ratio(window_return)[:, None]
+    else:
+        contributions = rolling_sum(contributions, window)
+
+    columns = pd.Index(np.asarray(reduced.labels[dimension], dtype=object), name=dimension)
+    return pd.DataFrame(contributions, index=reduced.dates, columns=columns)
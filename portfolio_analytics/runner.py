@@ -0,0 +1,316 @@
+"""
+Runs the analytics of many portfolios in parallel.
+
+Every portfolio (a holdings workbook, or an ID resolved to a workbook in a data folder) is loaded
+with the shared loader and goes through the ESG, exposure, attribution and pie-chart stages in a
+worker process. The tables of all portfolios are then combined, with a leading Portfolio column,
+into one output: a folder of CSV files or an Excel workbook. A stage that fails, the pie charts
+included, is reported in an Errors table and the tables of the other stages are kept.
+
+Usage:
+    python -m portfolio_analytics.runner --data-dir D:\\Holdings --output results FUND_A FUND_B other.xlsx
+"""
+import argparse
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from portfolio_analytics.attribution import attribution_tables
+from portfolio_analytics.esg import daily_esg_summary
+from portfolio_analytics.exposures import ExposureCube
+from portfolio_analytics.holdings import add_market_cap_bucket, filter_equities, load_holdings
+from portfolio_analytics.performance import add_benchmark_contributions, add_contributions, daily_performance
+from portfolio_analytics.reports import write_report
+from portfolio_analytics.risk import rolling_risk
+from portfolio_analytics.snapshots import SnapshotIndex
+from portfolio_analytics.summaries import TOTAL_LABEL, grouping_sets
+
+# Stages in the order they run for each portfolio
+STAGES = ('esg', 'exposure', 'attribution', 'pie')
+
+# Dimensions and periods of the attribution tables and the pie charts
+DIMENSIONS = ['GICS_sector', 'Country', 'Market Cap Bucket']
+PERIODS = ['ITD', 'YTD']
+
+# Linking of the daily contributions, so that the attribution reconciles to the compounded return
+LINKING = 'carino'
+
+# File name of a portfolio ID inside the data folder
+PORTFOLIO_FILE_PATTERN = '{portfolio}.xlsx'
+
+
+def esg_stage(df):
+    """
+    Daily ESG scores and rating-bucket weights of a portfolio.
+
+    :param df: pandas DataFrame, holdings from load_holdings
+    :return: dict, {table name: pandas DataFrame}
+    """
+    scores, buckets_by_pillar = daily_esg_summary(df)
+
+    # Weight in every rating bucket over time, one block of rows per pillar
+    buckets = []
+    for rating_column, weights in buckets_by_pillar.items():
+        weights = weights.stack().rename('Normalized Weight').reset_index()
+        buckets.append(weights.rename(columns={rating_column: 'Category'}).assign(Pillar=rating_column))
+    buckets = pd.concat(buckets, ignore_index=True)[['refdate', 'Pillar', 'Category', 'Normalized Weight']]
+
+    return {'ESG Scores': scores, 'ESG Categories': buckets}
+
+
+def exposure_stage(df):
+    """
+    Sector, country and market cap exposures of a portfolio over time.
+
+    :param df: pandas DataFrame, equity holdings with Market Cap Bucket
+    :return: dict, {table name: pandas DataFrame}
+    """
+    return {'Exposures': ExposureCube.build(df).to_frame()}
+
+
+def attribution_stage(df, periods=PERIODS, dimensions=DIMENSIONS, linking=LINKING):
+    """
+    Compounded performance, rolling risk and contribution tables of a portfolio.
+
+    :param df: pandas DataFrame, equity holdings with Market Cap Bucket
+    :param periods: list of periods, see portfolio_analytics.attribution.resolve_period
+    :param dimensions: list of str, attribution dimensions
+    :param linking: str, linking method (see portfolio_analytics.attribution.LINKING_METHODS), None for plain sums
+    :return: dict, {table name: pandas DataFrame}
+    """
+    df = add_benchmark_contributions(add_contributions(df))
+    tables = []
+    for (period, dimension), table in attribution_tables(df, dimensions, periods, linking=linking).items():
+        table = table.rename(columns={dimension: 'Group'})
+        table.insert(0, 'Dimension', dimension)
+        table.insert(0, 'Period', period)
+        tables.append(table)
+    return {'Performance': daily_performance(df), 'Risk': rolling_risk(df), 'Attribution': pd.concat(tables, ignore_index=True)}
+
+
+def pie_stage(df, dimensions=DIMENSIONS, chart_dir=None, portfolio=None, as_of_dates=None):
+    """
+    Exposure and active exposure of a portfolio as of one or more dates, with their totals, optionally drawn as pie charts.
+
+    :param df: pandas DataFrame, equity holdings with Market Cap Bucket
+    :param dimensions: list of str, dimensions of the pie charts
+    :param chart_dir: str, optional folder to write the pie charts to
+    :param portfolio: str, portfolio name used in the chart file names
+    :param as_of_dates: list of date-like, or str frequency ('M', 'Q', 'Y') for the last refdate of every period;
+                        defaults to the last refdate. A date that is not a refdate takes the latest refdate before it
+                        (see portfolio_analytics.snapshots)
+    :return: dict, {table name: pandas DataFrame}
+    """
+    snapshots = SnapshotIndex.build(df)
+    if isinstance(as_of_dates, str):
+        refdates = snapshots.period_ends(as_of_dates)
+    else:
+        refdates = snapshots.resolve([snapshots.last_date] if as_of_dates is None else list(as_of_dates)).unique()
+
+    # Every dimension and the totals of all the as-of refdates in one reduction
+    summaries = grouping_sets(snapshots.frame(refdates), dimensions, ['Weight (%)', 'Active Weight (%)']).rename(
+        columns={'Weight (%)': 'Exposure', 'Active Weight (%)': 'Active Exposure'})
+
+    if chart_dir is not None:
+        pie_chart_stage(summaries, chart_dir, portfolio=portfolio, dated=as_of_dates is not None)
+    return {'Last Day Exposures': summaries}
+
+
+def pie_chart_stage(summaries, chart_dir, portfolio=None, dated=False):
+    """
+    Draws the exposure and active exposure pie charts of the tables of pie_stage.
+
+    :param summaries: pandas DataFrame, 'Last Day Exposures' table of pie_stage
+    :param chart_dir: str, folder to write the pie charts to
+    :param portfolio: str, portfolio name used in the chart file names
+    :param dated: bool, add the as-of date to the file names
+    :return: dict, no tables
+    """
+    from portfolio_analytics.charts import pie_charts
+    from portfolio_analytics.rendering import RenderQueue
+
+    # Already inside a worker process, so the charts are rendered in-process
+    render_queue = RenderQueue(output_dir=chart_dir, headless=True, max_workers=1)
+    slices = summaries[summaries['Dimension'] != TOTAL_LABEL]
+    for (refdate, dimension), summary in slices.groupby(['refdate', 'Dimension'], sort=False):
+        name = dimension.replace(' ', '_')
+        as_of = refdate.strftime('%Y-%m-%d')
+        suffix = f'_{as_of}' if dated else ''
+        render_queue.add(f'{portfolio}_{name}_Pie_Charts{suffix}.png', pie_charts, summary, label_column='Group',
+                         value_columns=['Exposure', 'Active Exposure'],
+                         titles=[f'Exposure by {dimension} as of {as_of}', f'Active Exposure by {dimension} as of {as_of}'])
+    render_queue.run()
+    return {}
+
+
+def run_portfolio(file_path, stages=STAGES, portfolio=None, cache_dir=None, chart_dir=None, as_of_dates=None):
+    """
+    Runs the analytics stages of one portfolio.
+
+    A stage that raises does not stop the others: its error is reported in an 'Errors' table
+    (Stage, Error, Traceback) and the tables of the stages that succeeded are returned. The pie
+    charts are a stage of their own, so failing to draw them keeps the pie stage's tables.
+
+    :param file_path: str, path of the portfolio's holdings workbook
+    :param stages: sequence of str, stages to run (see STAGES)
+    :param portfolio: str, portfolio name, defaults to the workbook's file name
+    :param cache_dir: str, folder for the holdings cache (see load_holdings)
+    :param chart_dir: str, optional folder for the pie charts
+    :param as_of_dates: list of date-like or str frequency, as-of dates of the pie stage (see pie_stage)
+    :return: dict, {table name: pandas DataFrame}
+    """
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f'Unknown stages {sorted(unknown)}, expected some of {STAGES}')
+    portfolio = portfolio or os.path.splitext(os.path.basename(file_path))[0]
+
+    df = load_holdings(file_path, cache_dir=cache_dir)
+    results, errors = {}, []
+    if 'esg' in stages:
+        _run_stage(results, errors, 'esg', esg_stage, df)
+
+    # The other stages only look at equities
+    equities = add_market_cap_bucket(filter_equities(df).copy())
+    if 'exposure' in stages:
+        _run_stage(results, errors, 'exposure', exposure_stage, equities)
+    if 'attribution' in stages:
+        _run_stage(results, errors, 'attribution', attribution_stage, equities)
+    if 'pie' in stages:
+        _run_stage(results, errors, 'pie', pie_stage, equities, as_of_dates=as_of_dates)
+        if chart_dir is not None and 'Last Day Exposures' in results:
+            _run_stage(results, errors, 'pie charts', pie_chart_stage, results['Last Day Exposures'], chart_dir,
+                       portfolio=portfolio, dated=as_of_dates is not None)
+
+    if errors:
+        results['Errors'] = pd.DataFrame(errors)
+    return results
+
+
+def run_portfolios(portfolios, stages=STAGES, max_workers=None, cache_dir=None, chart_dir=None, as_of_dates=None):
+    """
+    Runs the analytics of several portfolios in a process pool and combines their tables.
+
+    A portfolio that fails does not stop the others, its error is reported in an 'Errors' table,
+    next to the errors of the stages that failed within a portfolio (see run_portfolio).
+
+    :param portfolios: dict, {portfolio name: workbook path}
+    :param stages: sequence of str, stages to run (see STAGES)
+    :param max_workers: int, size of the process pool (defaults to the number of CPUs)
+    :param cache_dir: str, folder for the holdings caches (see load_holdings)
+    :param chart_dir: str, optional folder for the pie charts
+    :param as_of_dates: list of date-like or str frequency, as-of dates of the pie stage (see pie_stage)
+    :return: dict, {table name: pandas DataFrame with a leading Portfolio column}
+    """
+    results = {}
+    errors = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run_portfolio, path, stages, portfolio, cache_dir, chart_dir, as_of_dates): portfolio
+                   for portfolio, path in portfolios.items()}
+        for future in as_completed(futures):
+            portfolio = futures[future]
+            try:
+                results[portfolio] = future.result()
+            except Exception as error:
+                errors.append(dict(Portfolio=portfolio, **_error_row('load', error)))
+
+    combined = combine_results({portfolio: results[portfolio] for portfolio in portfolios if portfolio in results})
+    if errors:
+        combined['Errors'] = pd.concat([pd.DataFrame(errors)] + ([combined['Errors']] if 'Errors' in combined else []),
+                                       ignore_index=True)
+    return combined
+
+
+def combine_results(results):
+    """
+    Stacks the tables of several portfolios.
+
+    :param results: dict, {portfolio name: {table name: pandas DataFrame}}
+    :return: dict, {table name: pandas DataFrame with a leading Portfolio column}
+    """
+    combined = {}
+    for portfolio, tables in results.items():
+        for name, table in tables.items():
+            combined.setdefault(name, []).append(table.assign(Portfolio=portfolio))
+    return {name: pd.concat(tables, ignore_index=True)[['Portfolio'] + [c for c in tables[0].columns if c != 'Portfolio']]
+            for name, tables in combined.items()}
+
+
+def write_results(tables, output_path):
+    """
+    Writes combined tables to an Excel workbook (.xlsx path) or to a folder of CSV files.
+
+    :param tables: dict, {table name: pandas DataFrame}
+    :param output_path: str, workbook path or folder
+    """
+    if output_path.lower().endswith('.xlsx'):
+        write_report(output_path, tables)
+        return
+
+    os.makedirs(output_path, exist_ok=True)
+    for name, table in tables.items():
+        table.to_csv(os.path.join(output_path, name.replace(' ', '_') + '.csv'), index=False)
+
+
+def resolve_portfolios(entries, data_dir=None, pattern=PORTFOLIO_FILE_PATTERN):
+    """
+    Maps portfolio IDs and workbook paths to {portfolio name: workbook path}.
+
+    :param entries: list of str, workbook paths or portfolio IDs
+    :param data_dir: str, folder where the workbooks of portfolio IDs are found
+    :param pattern: str, file name of a portfolio ID inside data_dir
+    :return: dict, {portfolio name: workbook path}
+    """
+    portfolios = {}
+    for entry in entries:
+        if os.path.isfile(entry):
+            portfolios[os.path.splitext(os.path.basename(entry))[0]] = entry
+        else:
+            portfolios[entry] = os.path.join(data_dir or '.', pattern.format(portfolio=entry))
+    return portfolios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the portfolio analytics for many portfolios in parallel.')
+    parser.add_argument('portfolios', nargs='+', help='holdings workbooks or portfolio IDs')
+    parser.add_argument('--data-dir', help='folder with the workbooks of portfolio IDs')
+    parser.add_argument('--output', default='portfolio_results', help='output .xlsx workbook or CSV folder')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--workers', type=int, help='number of worker processes (defaults to the number of CPUs)')
+    parser.add_argument('--cache-dir', help='folder for the holdings caches')
+    parser.add_argument('--chart-dir', help='folder for the pie charts (no charts when omitted)')
+    parser.add_argument('--as-of', nargs='+', help='as-of dates of the pie stage, or M, Q or Y for the last refdate '
+                                                   'of every month, quarter or year (defaults to the last refdate)')
+    args = parser.parse_args(argv)
+
+    tables = run_portfolios(resolve_portfolios(args.portfolios, args.data_dir), stages=args.stages,
+                            max_workers=args.workers, cache_dir=args.cache_dir, chart_dir=args.chart_dir,
+                            as_of_dates=_as_of_dates(args.as_of))
+    write_results(tables, args.output)
+    if 'Errors' in tables:
+        print(tables['Errors'][['Portfolio', 'Stage', 'Error']].to_string(index=False))
+        return 1
+    return 0
+
+
+def _run_stage(results, errors, name, stage_function, *args, **kwargs):
+    # Adds the tables of a stage to results, or its error to errors
+    try:
+        results.update(stage_function(*args, **kwargs))
+    except Exception as error:
+        errors.append(_error_row(name, error))
+
+
+def _error_row(stage_name, error):
+    return {'Stage': stage_name, 'Error': repr(error), 'Traceback': ''.join(traceback.format_exception(error))}
+
+
+def _as_of_dates(values):
+    if values is not None and len(values) == 1 and values[0] in ('M', 'Q', 'Y'):
+        return values[0]
+    return values
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
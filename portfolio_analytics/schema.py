@@ -0,0 +1,118 @@
+"""
+Declared column types of the holdings.
+
+pd.read_excel gives every text column as Python strings and every number as float64. The schema
+below is enforced once when the workbook is prepared (and therefore stored in the holdings
+cache): names, countries and sectors are categoricals, the ESG scores (0-10) and the risk
+contributions are float32, and the derived ratings and market cap buckets are ordered
+categoricals whose codes rank them. Weights, prices and market capitalizations stay float64: the
+performance compounds the weights and price changes over the whole history, and the market
+capitalizations are cut at exact bucket bounds.
+
+enforce_schema returns a validation report next to the converted holdings, one row per column,
+with the values that could not be converted (they become missing), the columns that are missing
+or not declared, and the memory of every column before and after.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.ratings import PILLAR_CATEGORIES, RATING_LABELS
+
+# Market capitalization buckets (USD)
+MARKET_CAP_BINS = [-float('inf'), 250e6, 2e9, 10e9, 200e9, float('inf')]
+MARKET_CAP_LABELS = ['Micro-cap', 'Small-cap', 'Mid-cap', 'Large-cap', 'Mega-cap']
+
+# Ordered types of the derived columns, from the lowest to the highest
+RATING_DTYPE = pd.CategoricalDtype(list(RATING_LABELS), ordered=True)
+MARKET_CAP_DTYPE = pd.CategoricalDtype(MARKET_CAP_LABELS, ordered=True)
+
+# Columns of the holdings workbook and their type once prepared ('category' and 'datetime64' take any
+# categories and any time unit)
+HOLDINGS_SCHEMA = {
+    'refdate': 'datetime64',
+    'Asset Name': 'category',
+    'Country': 'category',
+    'GICS_sector': 'category',
+    'Weight (%)': np.dtype(np.float64),
+    'Active Weight (%)': np.dtype(np.float64),
+    'Price(USD)': np.dtype(np.float64),
+    'Market Capitalization (USD)': np.dtype(np.float64),
+    'Overall ESG Score': np.dtype(np.float32),
+    'Overall ESG Environmental Score': np.dtype(np.float32),
+    'Overall ESG Social Score': np.dtype(np.float32),
+    'Overall ESG Governance Score': np.dtype(np.float32),
+    '%Contribution to Total Risk': np.dtype(np.float32),
+    '%Contribution to Tracking Error': np.dtype(np.float32),
+}
+
+# Columns added by the analytics, checked by enforce_schema when they are present
+DERIVED_SCHEMA = dict({'Market Cap Bucket': MARKET_CAP_DTYPE},
+                      **{rating_column: RATING_DTYPE for rating_column in PILLAR_CATEGORIES.values()})
+
+# Columns of the validation report
+REPORT_COLUMNS = ['column', 'expected', 'found', 'status', 'invalid', 'bytes_before', 'bytes_after']
+
+
+def enforce_schema(df, schema=None, required=True):
+    """
+    Converts the holdings to the declared column types.
+
+    :param df: pandas DataFrame, holdings (refdate already parsed, see holdings.prepare_refdates)
+    :param schema: dict, {column: dtype}, defaults to HOLDINGS_SCHEMA with DERIVED_SCHEMA
+    :param required: bool, report the columns of the schema missing from df (the derived columns never are)
+    :return: tuple, (pandas DataFrame with the declared types, pandas DataFrame validation report with REPORT_COLUMNS)
+    """
+    schema = dict(HOLDINGS_SCHEMA, **DERIVED_SCHEMA) if schema is None else schema
+    converted, rows = {}, []
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            if required and column not in DERIVED_SCHEMA:
+                rows.append([column, str(dtype), None, 'missing', 0, 0, 0])
+            continue
+
+        values = df[column]
+        new_values = _convert(values, dtype)
+
+        # Values present before the conversion and missing after it could not be converted
+        invalid = int((values.notna() & new_values.isna()).sum())
+        status = 'invalid values' if invalid else 'ok' if values.dtype == new_values.dtype else 'converted'
+        rows.append([column, str(dtype), str(values.dtype), status, invalid,
+                     int(values.memory_usage(index=False, deep=True)),
+                     int(new_values.memory_usage(index=False, deep=True))])
+        converted[column] = new_values
+
+    for column in df.columns:
+        if column not in schema:
+            size = int(df[column].memory_usage(index=False, deep=True))
+            rows.append([column, None, str(df[column].dtype), 'not declared', 0, size, size])
+
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+    return df.assign(**converted) if converted else df, report
+
+
+def schema_problems(report):
+    """
+    :param report: pandas DataFrame, validation report from enforce_schema
+    :return: list of str, one line per missing column or column with invalid values
+    """
+    problems = report[report['status'].isin(['missing', 'invalid values'])]
+    return [f"{row.column}: missing" if row.status == 'missing'
+            else f"{row.column}: {row.invalid} values are not {row.expected}, set to missing"
+            for row in problems.itertuples(index=False)]
+
+
+def _convert(values, dtype):
+    if isinstance(dtype, pd.CategoricalDtype):
+        if values.dtype == dtype:
+            return values
+        # Values outside the declared categories become missing
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        return values.astype(dtype)
+    if dtype == 'category':
+        return values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+    if dtype == 'datetime64':
+        return values if pd.api.types.is_datetime64_any_dtype(values) else pd.to_datetime(values, errors='coerce')
+    if values.dtype == dtype:
+        return values
+    return pd.to_numeric(values, errors='coerce').astype(dtype)
@@ -0,0 +1,163 @@
+"""
+Security master: one dense integer ID per security.
+
+A security is identified by the pair (Asset Name, Country), which keeps the listings of the same
+company in different countries apart. The master encodes both strings once, gives every pair an
+ID in (name, country) order and keeps the static attributes of each security in one array per
+attribute. The per-row work (sorting by security, finding where a security starts, lagging
+prices and weights) is then done on an int32 array instead of grouping on two string columns.
+A missing key value (e.g. a holding without a Country) is a value of its own, so such a
+security keeps one ID across its rows like any other.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.grouping import encode_column
+
+# Columns identifying a security (country splits the different listings of the same security)
+SECURITY_KEY = ['Asset Name', 'Country']
+
+# Attributes stored once per security, as of the last refdate the security is held
+SECURITY_ATTRIBUTES = ['GICS_sector', 'Market Cap Bucket']
+
+
+class SecurityMaster:
+    """
+    Array-backed table of securities, the position of a security is its ID.
+    """
+
+    __slots__ = ('key', 'keys', 'attributes', '_index')
+
+    def __init__(self, key, keys, attributes):
+        """
+        :param key: list of str, columns identifying a security
+        :param keys: dict, {key column: numpy object array with the value of every security}
+        :param attributes: dict, {attribute column: pandas Categorical with the value of every security}
+        """
+        self.key = list(key)
+        self.keys = keys
+        self.attributes = attributes
+        self._index = None
+
+    @classmethod
+    def build(cls, df, key=SECURITY_KEY, attributes=SECURITY_ATTRIBUTES):
+        """
+        Builds the master of the securities held in the holdings.
+
+        :param df: pandas DataFrame, holdings with refdate, the key columns and optionally the attributes
+        :param key: list of str, columns identifying a security
+        :param attributes: list of str, static columns to keep (the ones missing from df are skipped)
+        :return: tuple, (SecurityMaster, numpy array of int32 security IDs of the rows)
+        """
+        key = list(key)
+
+        # Combine the codes of the key columns into one integer per row, in key order; a missing value
+        # gets the code after the last label, so it sorts last and has a label (None) of its own
+        encoded = []
+        for column in key:
+            codes, labels = encode_column(df[column])
+            codes = np.where(codes < 0, len(labels), codes)
+            encoded.append((codes, np.append(np.asarray(labels, dtype=object), None)))
+        combined = np.zeros(len(df), dtype=np.int64)
+        for codes, labels in encoded:
+            combined = combined * len(labels) + codes
+
+        # Dense IDs: the rank of every combined code among the securities held
+        unique, ids = np.unique(combined, return_inverse=True)
+        row_ids = ids.astype(np.int32)
+        keys = {}
+        remainder = unique
+        for column, (codes, labels) in zip(key[::-1], encoded[::-1]):
+            remainder, codes = np.divmod(remainder, len(labels))
+            keys[column] = labels[codes]
+        keys = {column: keys[column] for column in key}
+
+        # Attributes as of the last row of every security
+        last_rows = np.full(len(unique), -1, dtype=np.int64)
+        if len(unique):
+            order = np.lexsort((df['refdate'].to_numpy(), row_ids))
+            ends = np.r_[row_ids[order][1:] != row_ids[order][:-1], True]
+            last_rows[row_ids[order][ends]] = order[ends]
+        stored = {}
+        for column in attributes:
+            if column in df.columns:
+                values = df[column].iloc[last_rows].to_numpy() if len(unique) else df[column].iloc[:0].to_numpy()
+                stored[column] = pd.Categorical(values)
+
+        return cls(key, keys, stored), row_ids
+
+    def __len__(self):
+        return len(next(iter(self.keys.values()))) if self.keys else 0
+
+    def ids(self, df):
+        """
+        Looks up the IDs of the securities of holdings rows.
+
+        :param df: pandas DataFrame, holdings with the key columns
+        :return: numpy array of int32, security IDs, -1 for securities that are not in the master
+        """
+        if self._index is None:
+            self._index = pd.MultiIndex.from_arrays([self.keys[column] for column in self.key], names=self.key)
+        rows = pd.MultiIndex.from_arrays([df[column].astype(object).to_numpy() for column in self.key])
+        return self._index.get_indexer(rows).astype(np.int32)
+
+    def to_frame(self):
+        """
+        :return: pandas DataFrame, one row per security ID with the key columns and the attributes
+        """
+        frame = pd.DataFrame(self.keys)
+        for column, values in self.attributes.items():
+            frame[column] = values
+        frame.index.name = 'Security ID'
+        return frame
+
+
+def compact_holdings(df, value_columns=None, master=None):
+    """
+    Reduces the holdings to a security ID, a date code and the numeric columns.
+
+    :param df: pandas DataFrame, holdings with refdate and the key columns
+    :param value_columns: list of str, numeric columns to keep, defaults to every numeric column
+    :param master: SecurityMaster, existing master to look the securities up in, built from df when omitted
+    :return: tuple, (SecurityMaster, pandas DatetimeIndex of the refdates,
+                     pandas DataFrame with 'Security ID', 'Date Code' and the value columns)
+    """
+    if master is None:
+        master, ids = SecurityMaster.build(df)
+    else:
+        ids = master.ids(df)
+    dates, date_codes = np.unique(df['refdate'].to_numpy(), return_inverse=True)
+    if value_columns is None:
+        value_columns = [column for column in df.columns
+                         if pd.api.types.is_numeric_dtype(df[column]) and not isinstance(df[column].dtype, pd.CategoricalDtype)]
+
+    compact = pd.DataFrame({'Security ID': ids, 'Date Code': date_codes.astype(np.int32)})
+    for column in value_columns:
+        compact[column] = df[column].to_numpy()
+    return master, pd.DatetimeIndex(dates, name='refdate'), compact
+
+
+def security_starts(ids, order):
+    """
+    Marks the rows where a new security starts once the rows are put in order.
+
+    :param ids: numpy array of int, security IDs of the rows
+    :param order: numpy array of int, row order sorted by security
+    :return: numpy array of bool, True on the first row of every security (and on rows without an ID)
+    """
+    sorted_ids = ids[order]
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = sorted_ids[1:] != sorted_ids[:-1]
+    return starts | (sorted_ids < 0)
+
+
+def security_order(ids, dates):
+    """
+    Returns the row order sorted by security then date, rows without an ID last.
+
+    :param ids: numpy array of int, security IDs of the rows
+    :param dates: numpy array, dates of the rows
+    :return: numpy array of int, row order
+    """
+    sort_ids = np.where(ids < 0, np.iinfo(np.int32).max, ids)
+    return np.lexsort((dates, sort_ids))
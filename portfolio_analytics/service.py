@@ -0,0 +1,449 @@
+"""
+Local analytics service with the holdings and results kept warm in memory.
+
+Every script starts Python, loads the holdings and recomputes everything to answer one question.
+The service is a small asyncio HTTP server on localhost that keeps the prepared holdings, the
+exposure cubes, the attribution tables and the ESG trends of its portfolios in a least recently
+used cache bounded by the memory of its entries (ResultCache). Results are keyed by portfolio,
+period and dimension, so a repeated question is answered from memory in milliseconds.
+
+A miss is computed on one background thread while the event loop keeps answering from the
+cache, and requests arriving for a result that is already being computed wait for that
+computation instead of starting another one. The attribution tables of all the standard periods
+and dimensions of a portfolio come out of one reduction (see attribution_tables), so the first
+attribution request of a portfolio computes and caches all of them. When a workbook changes on
+disk, the results of its portfolio are dropped and computed again from the new holdings.
+
+Every endpoint answers GET requests with JSON, tables in pandas' 'split' orientation:
+    /portfolios
+    /stats
+    /attribution?portfolio=FUND_A&period=YTD&dimension=GICS_sector
+    /exposures?portfolio=FUND_A&dimension=Country[&date=2023-06-30]
+    /esg?portfolio=FUND_A[&rating=Overall ESG Category]
+    /performance?portfolio=FUND_A
+    /risk?portfolio=FUND_A
+
+Usage:
+    python -m portfolio_analytics.service --data-dir D:\\Holdings --port 8765 FUND_A FUND_B
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.attribution import STANDARD_PERIODS, attribution_tables
+from portfolio_analytics.esg import daily_esg_summary
+from portfolio_analytics.exposures import ExposureCube
+from portfolio_analytics.holdings import add_market_cap_bucket, filter_equities, load_holdings
+from portfolio_analytics.performance import add_benchmark_contributions, add_contributions, daily_performance
+from portfolio_analytics.risk import rolling_risk
+from portfolio_analytics.runner import DIMENSIONS, LINKING, resolve_portfolios
+
+# Default address of the service, only reachable from this machine
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Default memory budget of the result cache
+CACHE_MAX_BYTES = 512 * 1024 ** 2
+
+# Reasons of the HTTP status codes sent by the service
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+# Returned by ResultCache.get for keys that are not cached
+_MISSING = object()
+
+
+class ResultCache:
+    """
+    Least recently used cache bounded by the memory of its entries.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        """
+        :param max_bytes: int, memory budget, the least recently used entries are evicted above it
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=_MISSING):
+        """
+        :param key: tuple, key of the entry
+        :param default: value returned when the key is not cached
+        :return: the cached value (now the most recently used), or default
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """
+        Caches a value and evicts the least recently used entries until the cache fits its budget.
+        A value larger than the whole budget is not cached.
+
+        :param key: tuple, key of the entry
+        :param value: object, value to cache (its size is measured with nbytes)
+        """
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def discard(self, predicate):
+        """
+        Removes the entries whose key matches a predicate.
+
+        :param predicate: callable, key -> bool
+        :return: int, number of entries removed
+        """
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            self.bytes -= self._entries.pop(key)[1]
+        return len(keys)
+
+    def stats(self):
+        """
+        :return: dict, number of entries, memory used and budget, hits, misses and evictions
+        """
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def nbytes(value):
+    """
+    Approximate memory of a cached value.
+
+    :param value: pandas object, numpy array, container of them, or object whose attributes hold them
+    :return: int, size in bytes
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(index=True, deep=True)
+        return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values()) + sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value) + sys.getsizeof(value)
+    if hasattr(value, '__dict__'):
+        return nbytes(vars(value))
+    if hasattr(value, '__slots__'):
+        return sum(nbytes(getattr(value, name)) for name in value.__slots__ if hasattr(value, name))
+    return sys.getsizeof(value)
+
+
+class AnalyticsService:
+    """
+    Holdings and analytics results of a set of portfolios, computed on demand and cached.
+
+    Cache keys are (kind, portfolio, period, dimension), with None where a result does not depend
+    on the period or on the dimension.
+    """
+
+    def __init__(self, portfolios, max_bytes=CACHE_MAX_BYTES, cache_dir=None, linking=LINKING):
+        """
+        :param portfolios: dict, {portfolio name: workbook path} (see runner.resolve_portfolios)
+        :param max_bytes: int, memory budget of the result cache
+        :param cache_dir: str, folder for the holdings caches (see load_holdings)
+        :param linking: str, linking method of the attribution tables, None for plain sums
+        """
+        self.portfolios = dict(portfolios)
+        self.cache = ResultCache(max_bytes)
+        self.cache_dir = cache_dir
+        self.linking = linking
+        self._fingerprints = {}
+        self._pending = {}
+
+        # One thread, so that the computations do not compete for the GIL and the event loop stays free
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analytics')
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def holdings(self, portfolio):
+        """
+        :param portfolio: str, portfolio name
+        :return: pandas DataFrame, prepared holdings of the portfolio
+        """
+        self._check_current(portfolio)
+        key = ('holdings', portfolio, None, None)
+        return await self._fetch(key, key, self._load, portfolio)
+
+    async def equities(self, portfolio):
+        """
+        :param portfolio: str, portfolio name
+        :return: pandas DataFrame, equity holdings with Market Cap Bucket and the portfolio and benchmark contributions
+        """
+        holdings = await self.holdings(portfolio)
+        key = ('equities', portfolio, None, None)
+        return await self._fetch(key, key, _equities, key, holdings)
+
+    async def attribution(self, portfolio, period, dimension):
+        """
+        :param portfolio: str, portfolio name
+        :param period: str, one of attribution.STANDARD_PERIODS
+        :param dimension: str, column of the equity holdings (e.g. 'GICS_sector')
+        :return: pandas DataFrame, attribution table with a 'Total' row
+        """
+        if period not in STANDARD_PERIODS:
+            raise ValueError(f'Unknown period {period!r}, expected one of {STANDARD_PERIODS}')
+        equities = await self.equities(portfolio)
+        _check_column(equities, dimension)
+
+        # All the standard periods and dimensions come out of the same reduction
+        dimensions = list(dict.fromkeys(DIMENSIONS + [dimension]))
+        return await self._fetch(('attribution', portfolio, period, dimension),
+                                 ('attribution', portfolio, None, tuple(dimensions)),
+                                 _attribution, portfolio, equities, dimensions, self.linking)
+
+    async def exposures(self, portfolio, dimension, date=None):
+        """
+        :param portfolio: str, portfolio name
+        :param dimension: str, one of exposures.EXPOSURE_DIMENSIONS
+        :param date: date-like, refdate of the snapshot, the last refdate when None
+        :return: pandas DataFrame, exposures of every group held on the refdate
+        """
+        equities = await self.equities(portfolio)
+        key = ('exposure cube', portfolio, None, None)
+        cube = await self._fetch(key, key, _exposure_cube, key, equities)
+        if dimension not in cube.dimensions:
+            raise ValueError(f'Unknown dimension {dimension!r}, expected one of {cube.dimensions}')
+        date = cube.dates[-1] if date is None else pd.Timestamp(date)
+        if date not in cube.dates:
+            raise ValueError(f'{date:%Y-%m-%d} is not a refdate of {portfolio}')
+        return cube.snapshot(dimension, date).assign(refdate=date)
+
+    async def esg(self, portfolio, rating=None):
+        """
+        :param portfolio: str, portfolio name
+        :param rating: str, rating column (e.g. 'Overall ESG Category') for its bucket weights, None for the scores
+        :return: pandas DataFrame, daily weighted ESG scores, or daily weight in every rating bucket
+        """
+        holdings = await self.holdings(portfolio)
+        return await self._fetch(('esg', portfolio, None, rating), ('esg', portfolio, None, None),
+                                 _esg, portfolio, holdings)
+
+    async def performance(self, portfolio):
+        """
+        :param portfolio: str, portfolio name
+        :return: pandas DataFrame, daily and compounded portfolio return
+        """
+        equities = await self.equities(portfolio)
+        key = ('performance', portfolio, None, None)
+        return await self._fetch(key, key, lambda: {key: daily_performance(equities)})
+
+    async def risk(self, portfolio):
+        """
+        :param portfolio: str, portfolio name
+        :return: pandas DataFrame, rolling volatility, tracking error and drawdown (see risk.rolling_risk)
+        """
+        equities = await self.equities(portfolio)
+        key = ('risk', portfolio, None, None)
+        return await self._fetch(key, key, lambda: {key: rolling_risk(equities)})
+
+    async def _fetch(self, key, batch, compute, *args):
+        # compute(*args) returns {cache key: value} for all the results it produced, including key
+        value = self.cache.get(key)
+        if value is not _MISSING:
+            return value
+
+        task = self._pending.get(batch)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(batch, compute, args))
+            self._pending[batch] = task
+        values = await asyncio.shield(task)
+        if key not in values:
+            raise ValueError(f'No {key[0]} result for {key[1:]}')
+        return values[key]
+
+    async def _compute(self, batch, compute, args):
+        try:
+            values = await asyncio.get_running_loop().run_in_executor(self._executor, compute, *args)
+        finally:
+            del self._pending[batch]
+        for key, value in values.items():
+            self.cache.put(key, value)
+        return values
+
+    def _load(self, portfolio):
+        path = self.portfolios[portfolio]
+        self._fingerprints[portfolio] = _fingerprint(path)
+        return {('holdings', portfolio, None, None): load_holdings(path, cache_dir=self.cache_dir)}
+
+    def _check_current(self, portfolio):
+        # Drop the results of a portfolio whose workbook changed since its holdings were loaded
+        if portfolio not in self.portfolios:
+            raise KeyError(portfolio)
+        recorded = self._fingerprints.get(portfolio)
+        if recorded is not None and recorded != _fingerprint(self.portfolios[portfolio]):
+            self.cache.discard(lambda key: key[1] == portfolio)
+            del self._fingerprints[portfolio]
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _check_column(df, column):
+    if column not in df.columns:
+        raise ValueError(f'Unknown dimension {column!r}')
+
+
+def _equities(key, holdings):
+    equities = add_market_cap_bucket(filter_equities(holdings).copy())
+    return {key: add_benchmark_contributions(add_contributions(equities))}
+
+
+def _exposure_cube(key, equities):
+    return {key: ExposureCube.build(equities)}
+
+
+def _attribution(portfolio, equities, dimensions, linking):
+    tables = attribution_tables(equities, dimensions, list(STANDARD_PERIODS), linking=linking)
+    return {('attribution', portfolio, period, dimension): table for (period, dimension), table in tables.items()}
+
+
+def _esg(portfolio, holdings):
+    scores, buckets = daily_esg_summary(holdings)
+    results = {('esg', portfolio, None, None): scores}
+    for rating_column, weights in buckets.items():
+        results[('esg', portfolio, None, rating_column)] = weights.reset_index()
+    return results
+
+
+async def handle_request(service, method, target):
+    """
+    Answers one request.
+
+    :param service: AnalyticsService
+    :param method: str, HTTP method
+    :param target: str, request path with its query string
+    :return: tuple, (HTTP status code, JSON-serializable body or JSON text)
+    """
+    if method != 'GET':
+        return 405, {'error': f'{method} is not supported, use GET'}
+    url = urlsplit(target)
+    params = dict(parse_qsl(url.query))
+    endpoint = url.path.rstrip('/') or '/'
+
+    if endpoint == '/portfolios':
+        return 200, {'portfolios': list(service.portfolios)}
+    if endpoint == '/stats':
+        return 200, service.cache.stats()
+
+    handlers = {
+        '/attribution': lambda portfolio: service.attribution(portfolio, params.get('period', 'ITD'),
+                                                              params.get('dimension', 'GICS_sector')),
+        '/exposures': lambda portfolio: service.exposures(portfolio, params.get('dimension', 'GICS_sector'),
+                                                          params.get('date')),
+        '/esg': lambda portfolio: service.esg(portfolio, params.get('rating')),
+        '/performance': service.performance,
+        '/risk': service.risk,
+    }
+    if endpoint not in handlers:
+        return 404, {'error': f'Unknown endpoint {endpoint}, expected one of {["/portfolios", "/stats"] + list(handlers)}'}
+    portfolio = params.get('portfolio')
+    if portfolio not in service.portfolios:
+        return 404, {'error': f'Unknown portfolio {portfolio!r}, expected one of {list(service.portfolios)}'}
+
+    try:
+        table = await handlers[endpoint](portfolio)
+    except (ValueError, TypeError) as error:
+        return 400, {'error': str(error)}
+    except FileNotFoundError as error:
+        return 404, {'error': str(error)}
+    return 200, table.to_json(orient='split', index=False, date_format='iso')
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Runs the HTTP server until it is cancelled.
+
+    :param service: AnalyticsService
+    :param host: str, address to listen on
+    :param port: int, port to listen on
+    """
+    async def on_connection(reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(request_line) < 2:
+                return
+            try:
+                status, body = await handle_request(service, request_line[0], request_line[1])
+            except Exception as error:
+                status, body = 500, {'error': repr(error)}
+            payload = (body if isinstance(body, str) else json.dumps(body, default=str)).encode()
+            writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the portfolio analytics over HTTP on localhost.')
+    parser.add_argument('portfolios', nargs='+', help='holdings workbooks or portfolio IDs')
+    parser.add_argument('--data-dir', help='folder with the workbooks of portfolio IDs')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--cache-mb', type=int, default=CACHE_MAX_BYTES // 1024 ** 2, help='memory budget of the result cache')
+    parser.add_argument('--cache-dir', help='folder for the holdings caches')
+    parser.add_argument('--warm', action='store_true', help='load the holdings of every portfolio before serving')
+    args = parser.parse_args(argv)
+
+    service = AnalyticsService(resolve_portfolios(args.portfolios, args.data_dir), max_bytes=args.cache_mb * 1024 ** 2,
+                               cache_dir=args.cache_dir)
+
+    async def run():
+        if args.warm:
+            await asyncio.gather(*(service.equities(portfolio) for portfolio in service.portfolios))
+        print(f'Serving {len(service.portfolios)} portfolios on http://{args.host}:{args.port}')
+        await serve(service, args.host, args.port)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
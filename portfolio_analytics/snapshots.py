@@ -0,0 +1,126 @@
+"""
+Point-in-time snapshots of the holdings.
+
+Finding the holdings of one day used to mean comparing the refdate of every row with that day
+(df[df['refdate'] == day]). The SnapshotIndex records, once, where the rows of every refdate
+start and end in the holdings sorted by refdate, plus a calendar of every day between the first
+and the last refdate pointing to the latest refdate on or before it. The holdings as of any date,
+a weekend or holiday included, are then a lookup in that calendar and a slice of rows, whatever
+the size of the history, and the snapshots of many as-of dates (e.g. the month-ends of a
+quarterly pack) can be taken together.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.instrumentation import instrumented
+
+
+class SnapshotIndex:
+    """
+    Rows of every refdate of a holdings frame, and the refdate in force on every calendar day.
+    """
+
+    def __init__(self, df, dates, offsets, order, prior):
+        """
+        :param df: pandas DataFrame, holdings (use SnapshotIndex.build to create an index)
+        :param dates: pandas DatetimeIndex, sorted unique refdates
+        :param offsets: numpy array of int, rows of refdate i are order[offsets[i]:offsets[i + 1]]
+        :param order: numpy array of int, rows in refdate order, None when df is already sorted by refdate
+        :param prior: numpy array of int, position in dates of the latest refdate on or before every day
+                      from the first to the last refdate
+        """
+        self.df = df
+        self.dates = dates
+        self._offsets = offsets
+        self._order = order
+        self._prior = prior
+        self._first_day = dates[0].to_datetime64().astype('datetime64[D]').astype(np.int64)
+
+    @classmethod
+    @instrumented('build_snapshot_index')
+    def build(cls, df, date_column='refdate'):
+        """
+        Indexes the rows of every refdate.
+
+        :param df: pandas DataFrame, holdings with a datetime date column, ideally sorted by it (as
+                   load_holdings returns them) so that the snapshots are slices
+        :param date_column: str, date column
+        :return: SnapshotIndex
+        """
+        if df.empty:
+            raise ValueError('Cannot index the snapshots of empty holdings')
+        values = df[date_column].to_numpy()
+        order = None if df[date_column].is_monotonic_increasing else np.argsort(values, kind='stable')
+        sorted_values = values if order is None else values[order]
+
+        # First row of every refdate, and the refdate in force on every calendar day in between
+        unique_dates, starts = np.unique(sorted_values, return_index=True)
+        offsets = np.append(starts, len(sorted_values)).astype(np.int64)
+        days = unique_dates.astype('datetime64[D]').astype(np.int64)
+        prior = (np.searchsorted(days, np.arange(days[0], days[-1] + 1), side='right') - 1).astype(np.int32)
+        return cls(df, pd.DatetimeIndex(unique_dates, name=date_column), offsets, order, prior)
+
+    @property
+    def last_date(self):
+        """
+        :return: pandas Timestamp, last refdate
+        """
+        return self.dates[-1]
+
+    def resolve(self, as_of):
+        """
+        Refdate in force on a date: the date itself when it is a refdate, else the latest refdate before it.
+
+        :param as_of: date-like, or list of them
+        :return: pandas Timestamp, or pandas DatetimeIndex for a list
+        """
+        positions = self._positions(as_of)
+        return self.dates[positions]
+
+    def snapshot(self, as_of):
+        """
+        Holdings as of a date (see resolve).
+
+        :param as_of: date-like
+        :return: pandas DataFrame, rows of the refdate in force on as_of
+        """
+        return self.df.iloc[self._rows(self._positions(as_of))]
+
+    def frame(self, as_of_dates):
+        """
+        Holdings as of several dates, in one frame.
+
+        Every refdate in force on one of the dates is included once, so a single grouped reduction
+        (e.g. ExposureCube.build) gives the exposures as of all of them.
+
+        :param as_of_dates: list of date-like
+        :return: pandas DataFrame, rows of the refdates in force, sorted by refdate
+        """
+        positions = np.unique(self._positions(list(as_of_dates)))
+        rows = np.concatenate([np.arange(self._offsets[p], self._offsets[p + 1]) for p in positions])
+        return self.df.iloc[rows if self._order is None else self._order[rows]]
+
+    def period_ends(self, freq='M'):
+        """
+        Last refdate of every period, e.g. the month-ends of a quarterly pack.
+
+        :param freq: str, pandas period frequency ('M', 'Q' or 'Y')
+        :return: pandas DatetimeIndex
+        """
+        periods = self.dates.to_period(freq).asi8
+        return self.dates[np.append(periods[1:] != periods[:-1], True)]
+
+    def _positions(self, as_of):
+        scalar = np.ndim(as_of) == 0
+        as_of = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(as_of)))
+        days = as_of.to_numpy().astype('datetime64[D]').astype(np.int64) - self._first_day
+        if (days < 0).any():
+            raise KeyError(f'No refdate on or before {as_of[days < 0][0]:%Y-%m-%d}, the first refdate is {self.dates[0]:%Y-%m-%d}')
+
+        # Dates after the last refdate take the last refdate
+        positions = self._prior[np.minimum(days, len(self._prior) - 1)]
+        return int(positions[0]) if scalar else positions
+
+    def _rows(self, position):
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return slice(start, end) if self._order is None else self._order[start:end]
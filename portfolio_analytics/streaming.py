@@ -0,0 +1,133 @@
+"""
+Out-of-core analytics for holdings histories larger than memory.
+
+The history is read in record batches from a columnar file sorted by refdate (the Feather cache
+written by load_holdings, or any Parquet/Feather/CSV file in date order) and regrouped into
+chunks of whole days. Every per-day aggregation (weight normalization, weighted ESG scores,
+rating-bucket weights, exposures) only needs the rows of its own day, so it is computed chunk by
+chunk and the small daily results are concatenated. The compounded performance is carried from
+one chunk to the next in a performance state. Peak memory is bounded by the size of a chunk,
+which is the largest single day with the default of one day per chunk.
+
+Usage:
+    python -m portfolio_analytics.streaming history.parquet --output results
+"""
+import argparse
+import os
+
+import pandas as pd
+
+from portfolio_analytics.holdings import add_market_cap_bucket, ensure_cache, filter_equities, prepare_refdates
+from portfolio_analytics.performance import build_performance_state, update_performance_state
+from portfolio_analytics.runner import esg_stage, exposure_stage, write_results
+
+# Stages that can run out-of-core
+STREAMING_STAGES = ('esg', 'exposure', 'performance')
+
+# pyarrow dataset format of every supported file extension
+DATASET_FORMATS = {'.feather': 'ipc', '.arrow': 'ipc', '.ipc': 'ipc', '.parquet': 'parquet', '.csv': 'csv'}
+
+
+def iter_date_chunks(source, dates_per_chunk=1, columns=None, batch_size=64 * 1024):
+    """
+    Reads a holdings file sorted by refdate as DataFrames holding whole days.
+
+    :param source: str, Feather/Parquet/CSV file (or folder of Parquet files) sorted by refdate;
+                   an Excel workbook is read through its holdings cache (see holdings.ensure_cache)
+    :param dates_per_chunk: int, number of refdates in each chunk
+    :param columns: list of str, optional columns to read (refdate is always read)
+    :param batch_size: int, maximum number of rows read at once
+    :return: generator of pandas DataFrame, prepared holdings of consecutive refdates
+    """
+    import pyarrow.dataset as ds
+
+    if source.lower().endswith(('.xlsx', '.xls')):
+        source = ensure_cache(source)
+    extension = os.path.splitext(source)[1].lower()
+    dataset = ds.dataset(source, format=DATASET_FORMATS.get(extension, 'parquet'))
+    if columns is not None and 'refdate' not in columns:
+        columns = ['refdate'] + list(columns)
+
+    buffer, buffer_dates, last_date = [], set(), None
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        frame = prepare_refdates(batch.to_pandas())
+        if frame.empty:
+            continue
+
+        # Chunks are cut on date boundaries, which needs the file in date order
+        dates = frame['refdate']
+        if not dates.is_monotonic_increasing or (last_date is not None and dates.iloc[0] < last_date):
+            raise ValueError(f'{source} is not sorted by refdate, sort it before streaming it')
+        last_date = dates.iloc[-1]
+
+        buffer.append(frame)
+        buffer_dates.update(dates.unique())
+
+        # As soon as a later date has started, the first dates_per_chunk dates are complete
+        while len(buffer_dates) > dates_per_chunk:
+            data = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0].reset_index(drop=True)
+            cutoff = sorted(buffer_dates)[dates_per_chunk]
+            split = int(data['refdate'].searchsorted(cutoff))
+            yield data.iloc[:split].copy()
+            buffer = [data.iloc[split:]]
+            buffer_dates = set(buffer[0]['refdate'].unique())
+
+    if buffer:
+        yield pd.concat(buffer, ignore_index=True)
+
+
+def run_streaming(source, stages=STREAMING_STAGES, dates_per_chunk=1, batch_size=64 * 1024):
+    """
+    Runs the per-day analytics over a holdings history one chunk of days at a time.
+
+    :param source: str, holdings file sorted by refdate (see iter_date_chunks)
+    :param stages: sequence of str, stages to run (see STREAMING_STAGES)
+    :param dates_per_chunk: int, number of refdates processed together
+    :param batch_size: int, maximum number of rows read at once
+    :return: dict, {table name: pandas DataFrame}
+    """
+    unknown = set(stages) - set(STREAMING_STAGES)
+    if unknown:
+        raise ValueError(f'Unknown stages {sorted(unknown)}, expected some of {STREAMING_STAGES}')
+
+    partial_results = {}
+    performance_state = None
+    for chunk in iter_date_chunks(source, dates_per_chunk, batch_size=batch_size):
+        tables = {}
+        if 'esg' in stages:
+            tables.update(esg_stage(chunk))
+
+        equities = add_market_cap_bucket(filter_equities(chunk).copy())
+        if 'exposure' in stages:
+            tables.update(exposure_stage(equities))
+        if 'performance' in stages and not equities.empty:
+            # The state carries the last price and weight of every security into the next chunk
+            if performance_state is None:
+                performance_state = build_performance_state(equities)
+            else:
+                performance_state = update_performance_state(performance_state, equities)
+
+        for name, table in tables.items():
+            partial_results.setdefault(name, []).append(table)
+        del chunk, equities
+
+    results = {name: pd.concat(tables, ignore_index=True) for name, tables in partial_results.items()}
+    if performance_state is not None:
+        results['Performance'] = performance_state['daily']
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the per-day portfolio analytics out-of-core.')
+    parser.add_argument('source', help='holdings file sorted by refdate (Feather, Parquet, CSV or Excel)')
+    parser.add_argument('--output', default='streaming_results', help='output .xlsx workbook or CSV folder')
+    parser.add_argument('--stages', nargs='+', choices=STREAMING_STAGES, default=list(STREAMING_STAGES))
+    parser.add_argument('--dates-per-chunk', type=int, default=1, help='refdates processed together')
+    args = parser.parse_args(argv)
+
+    write_results(run_streaming(args.source, args.stages, args.dates_per_chunk), args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,111 @@
+"""
+Grouping-sets summaries of holdings snapshots.
+
+The pie charts and last-day tables sum the same values by several dimensions, one groupby per
+dimension. grouping_sets computes the equivalent of SQL's GROUP BY GROUPING SETS ((by, d1),
+(by, d2), ..., (by)) in one pass: the by keys (e.g. Portfolio and refdate) are combined into one
+code, every dimension's groups are stacked into one key space with an extra block holding the
+grand total, and one bincount per value column gives all the sums. The result is one tidy table
+(by keys, Dimension, Group, values, Count) that feeds the pie charts and the tables directly, for
+any number of dates and portfolios at once.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.grouping import encode_column
+from portfolio_analytics.instrumentation import instrumented
+
+# Dimension and Group of the grand total rows
+TOTAL_LABEL = 'Total'
+
+
+@instrumented()
+def grouping_sets(df, dimensions, values, by=('refdate',), totals=True):
+    """
+    Sums of the values for every group of every dimension, and their grand totals, within every combination of by.
+
+    :param df: pandas DataFrame, holdings (e.g. a snapshot, see portfolio_analytics.snapshots)
+    :param dimensions: list of str, columns to group by, one grouping set each
+    :param values: list of str, columns to sum (missing values count as 0)
+    :param by: sequence of str, columns every grouping set is also grouped by (e.g. ['Portfolio', 'refdate'])
+    :param totals: bool, add a grand total row (Dimension and Group TOTAL_LABEL) for every combination of by;
+                   it includes the rows whose dimension values are missing
+    :return: pandas DataFrame, the by columns, Dimension, Group, one column per value and Count (rows summed),
+             one row per group held, sorted by the by keys, then in the order of the dimensions and their groups
+    """
+    by = list(by)
+
+    # One code per combination of the by keys that occurs
+    by_codes = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    by_labels = []
+    for column in by:
+        codes, labels = encode_column(df[column])
+        valid &= codes >= 0
+        by_codes = by_codes * max(len(labels), 1) + codes
+        by_labels.append(labels)
+    combinations, by_codes = np.unique(np.where(valid, by_codes, -1), return_inverse=True)
+    if len(combinations) and combinations[0] < 0:
+        combinations, by_codes = combinations[1:], by_codes - 1
+    n_combinations = len(combinations)
+
+    # Stack the groups of every dimension, then the grand total, into one key space
+    encoded = [encode_column(df[dimension]) for dimension in dimensions]
+    if totals:
+        encoded.append((np.zeros(len(df), dtype=np.int64), pd.Index([TOTAL_LABEL])))
+    offsets = np.cumsum([0] + [len(labels) for _, labels in encoded])
+    keys = np.concatenate([np.where((codes >= 0) & (by_codes >= 0), (codes + offset) * n_combinations + by_codes, -1)
+                           for (codes, _), offset in zip(encoded, offsets)])
+    kept = keys >= 0
+    keys = keys[kept]
+    size = offsets[-1] * n_combinations
+
+    # One grouped reduction per value column
+    counts = np.bincount(keys, minlength=size)
+    sums = {column: np.bincount(keys, weights=np.tile(np.nan_to_num(df[column].to_numpy(dtype=np.float64)),
+                                                      len(encoded))[kept], minlength=size)
+            for column in values}
+
+    # Only the groups held, ordered by the by keys, then by dimension and group
+    held = np.flatnonzero(counts > 0)
+    groups, combination_codes = np.divmod(held, n_combinations)
+    order = np.lexsort((groups, combination_codes))
+    held, groups, combination_codes = held[order], groups[order], combination_codes[order]
+    blocks = np.searchsorted(offsets, groups, side='right') - 1
+
+    names = list(dimensions) + ([TOTAL_LABEL] if totals else [])
+    group_labels = np.concatenate([np.asarray(labels, dtype=object) for _, labels in encoded])
+
+    # Decode the combination of every row back to the labels of the by keys, the last key varies fastest
+    decoded = {}
+    remainders = combinations[combination_codes]
+    for column, labels in reversed(list(zip(by, by_labels))):
+        remainders, codes = np.divmod(remainders, max(len(labels), 1))
+        decoded[column] = labels[codes]
+    summary = {column: decoded[column] for column in by}
+    summary['Dimension'] = np.asarray(names, dtype=object)[blocks]
+    summary['Group'] = group_labels[groups]
+    for column in values:
+        summary[column] = sums[column][held]
+    summary['Count'] = counts[held]
+    return pd.DataFrame(summary)
+
+
+def portfolio_grouping_sets(portfolios, dimensions, values, by=('refdate',), totals=True):
+    """
+    grouping_sets of several portfolios in the same pass.
+
+    :param portfolios: dict, {portfolio name: pandas DataFrame of holdings}
+    :param dimensions: list of str, columns to group by, one grouping set each
+    :param values: list of str, columns to sum
+    :param by: sequence of str, columns every grouping set is also grouped by, after Portfolio
+    :param totals: bool, add a grand total row for every portfolio and combination of by
+    :return: pandas DataFrame, see grouping_sets, with a leading Portfolio column
+    """
+    names = list(portfolios)
+    columns = list(dict.fromkeys(list(by) + list(dimensions) + list(values)))
+    frames = [portfolios[name][columns] for name in names]
+    combined = pd.concat(frames, ignore_index=True)
+    combined['Portfolio'] = pd.Categorical.from_codes(np.repeat(np.arange(len(names)), [len(frame) for frame in frames]),
+                                                      categories=names)
+    return grouping_sets(combined, dimensions, values, by=['Portfolio'] + list(by), totals=totals)
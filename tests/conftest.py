@@ -0,0 +1,15 @@
+import pytest
+
+from portfolio_analytics.benchmark import generate_holdings
+from portfolio_analytics.holdings import add_market_cap_bucket, filter_equities, prepare_holdings
+
+
+@pytest.fixture(scope='session')
+def holdings():
+    # Synthetic history across a year end, so that ITD and YTD differ
+    return prepare_holdings(generate_holdings(n_securities=40, n_days=60, start='2022-11-01', seed=1))
+
+
+@pytest.fixture(scope='session')
+def equities(holdings):
+    return add_market_cap_bucket(filter_equities(holdings).copy())
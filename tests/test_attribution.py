@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_analytics.attribution import LINKING_METHODS, attribution_tables, linking_factors, resolve_period
+from portfolio_analytics.performance import add_contributions, daily_performance
+
+PERIODS = ['ITD', 'YTD', ('December', '2022-12-01', '2022-12-31')]
+
+
+@pytest.fixture(scope='module')
+def contributions(equities):
+    return add_contributions(equities)
+
+
+def _compounded_return(daily, start, end):
+    returns = daily['Contribution'].to_numpy()[start:end + 1]
+    return np.prod(1 + returns) - 1
+
+
+@pytest.mark.parametrize('method', LINKING_METHODS)
+def test_linking_factors_add_up_to_the_compounded_return(method):
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.0005, 0.01, 120)
+    starts, ends = np.array([0, 30, 100]), np.array([119, 89, 119])
+
+    factors = linking_factors(returns, starts, ends, method)
+
+    expected = [np.prod(1 + returns[start:end + 1]) - 1 for start, end in zip(starts, ends)]
+    np.testing.assert_allclose(factors @ returns, expected, rtol=1e-12, atol=1e-15)
+    assert (factors[1, :30] == 0).all() and (factors[1, 90:] == 0).all()
+
+
+@pytest.mark.parametrize('method', LINKING_METHODS)
+def test_linked_contributions_reconcile_to_the_compounded_return(contributions, method):
+    dimensions = ['GICS_sector', 'Country', 'Market Cap Bucket']
+    daily = daily_performance(contributions)
+    tables = attribution_tables(contributions, dimensions, PERIODS, linking=method)
+
+    for period in PERIODS:
+        label, start, end = resolve_period(period, pd.DatetimeIndex(daily['refdate']))
+        for dimension in dimensions:
+            table = tables[(label, dimension)]
+            total = table['Contribution'].iloc[-1]
+            assert table[dimension].iloc[-1] == 'Total'
+            assert total == pytest.approx(table['Contribution'].iloc[:-1].sum(), abs=1e-12)
+            assert total == pytest.approx(_compounded_return(daily, start, end), abs=1e-12)
+
+
+def test_unlinked_contributions_are_plain_sums(contributions):
+    tables = attribution_tables(contributions, ['GICS_sector'], ['YTD'])
+
+    ytd = contributions[contributions['refdate'] >= '2023-01-01']
+    expected = ytd.groupby('GICS_sector', observed=True)['Contribution'].sum()
+    table = tables[('YTD', 'GICS_sector')].iloc[:-1].set_index('GICS_sector')['Contribution']
+    np.testing.assert_allclose(table.to_numpy(), expected.reindex(table.index).to_numpy(), atol=1e-15)
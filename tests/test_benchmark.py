@@ -0,0 +1,24 @@
+import pytest
+
+from portfolio_analytics import benchmark
+
+
+@pytest.mark.parametrize('stages, expected', [
+    (['load'], ['load']),
+    (['migrations'], ['load', 'bucketing', 'migrations']),
+    (['attribution', 'esg'], ['load', 'attribution', 'esg']),
+])
+def test_only_requested_stages_and_their_dependencies_run(monkeypatch, tmp_path, stages, expected):
+    ran = []
+    stage_function = benchmark._stage
+
+    def recording_stage(stage, *args):
+        ran.append(stage)
+        return stage_function(stage, *args)
+
+    monkeypatch.setattr(benchmark, '_stage', recording_stage)
+    monkeypatch.setattr(benchmark, 'EXCEL_MAX_ROWS', 0)
+    report = benchmark.run_benchmark(10, 5, stages=stages, repeat=1, trace_memory=False, work_dir=str(tmp_path))
+
+    assert ran == expected
+    assert report['Stage'].tolist() == [stage for stage in benchmark.BENCHMARK_STAGES if stage in stages]
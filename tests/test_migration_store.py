@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_analytics.esg import add_normalized_weights
+from portfolio_analytics.migration_store import MigrationStore
+from portfolio_analytics.migrations import migration_events
+from portfolio_analytics.ratings import categorize_esg_scores
+
+# Security left without a country, one whose rating changes the most in the fixture holdings
+NO_COUNTRY_ASSET = 'Asset 14'
+
+
+@pytest.fixture(scope='module')
+def rated(holdings):
+    df = add_normalized_weights(holdings.copy())
+    df['Overall ESG Category'] = categorize_esg_scores(df['Overall ESG Score'])
+
+    # One security without a country, which the store keeps as ''
+    country = df['Country'].astype(object)
+    df['Country'] = country.where(df['Asset Name'] != NO_COUNTRY_ASSET, None)
+    return df
+
+
+def _sorted(events):
+    events = events[['refdate', 'Asset Name', 'Country', 'Overall ESG Category', 'Previous ESG Category',
+                     'Category Change', 'Normalized Weight']]
+    events = events.assign(**{column: events[column].astype(object) for column in
+                              ['Country', 'Overall ESG Category', 'Previous ESG Category', 'Category Change']})
+    return events.sort_values(['refdate', 'Asset Name', 'Country'], na_position='first').reset_index(drop=True)
+
+
+def test_store_fed_in_slices_matches_a_full_run(tmp_path, rated):
+    dates = np.sort(rated['refdate'].unique())
+    with MigrationStore(str(tmp_path / 'migrations.sqlite')) as store:
+        for end in [dates[9], dates[10], dates[33], dates[-1]]:
+            store.update(rated[rated['refdate'] <= end])
+        stored = store.events()
+        assert store.high_water_mark == pd.Timestamp(dates[-1])
+
+    full = migration_events(rated, columns=['Normalized Weight'])
+    assert len(stored) == len(full) > 0
+    no_country = (stored['Asset Name'] == NO_COUNTRY_ASSET).sum()
+    assert no_country == (full['Asset Name'] == NO_COUNTRY_ASSET).sum() > 1
+    pd.testing.assert_frame_equal(_sorted(stored), _sorted(full), check_dtype=False)
+
+
+def test_security_without_country_keeps_one_last_rating(tmp_path, rated):
+    path = str(tmp_path / 'migrations.sqlite')
+    dates = np.sort(rated['refdate'].unique())
+    with MigrationStore(path) as store:
+        for end in dates[:5]:
+            store.update(rated[rated['refdate'] <= end])
+        rows = store.connection.execute(
+            "SELECT COUNT(*), MIN(country) FROM last_ratings WHERE asset_name = ?", (NO_COUNTRY_ASSET,)).fetchone()
+    assert rows == (1, '')
+
+
+def test_events_filters(tmp_path, rated):
+    with MigrationStore(str(tmp_path / 'migrations.sqlite')) as store:
+        store.update(rated)
+        downgrades = store.events(change='Down', min_weight=0.01)
+        recent = store.recent(10)
+
+    assert (downgrades['Category Change'] == 'Down').all() and (downgrades['Normalized Weight'] > 0.01).all()
+    assert recent['refdate'].min() >= rated['refdate'].max() - pd.Timedelta(days=9)
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.migrations import migration_events
+from portfolio_analytics.ratings import categorize_esg_scores
+from portfolio_analytics.securities import SecurityMaster, security_order, security_starts
+
+
+def _holdings(countries):
+    dates = pd.to_datetime(['2023-01-02', '2023-01-03', '2023-01-04'])
+    return pd.DataFrame({
+        'refdate': np.repeat(dates, 2),
+        'Asset Name': ['Asset 0', 'Asset 1'] * 3,
+        'Country': countries * 3,
+        'Overall ESG Score': [5.0, 3.0, 7.5, 3.0, 4.0, 3.0],
+        'Weight (%)': 0.5,
+    })
+
+
+def test_security_without_country_has_one_id():
+    df = _holdings([None, 'US'])
+
+    master, ids = SecurityMaster.build(df, attributes=())
+    order = security_order(ids, df['refdate'].to_numpy())
+
+    assert len(master) == 2 and (ids >= 0).all()
+    assert security_starts(ids, order).tolist() == [True, False, False, True, False, False]
+
+
+def test_security_without_country_reports_its_migrations():
+    df = _holdings([None, 'US'])
+    df['Overall ESG Category'] = categorize_esg_scores(df['Overall ESG Score'])
+
+    events = migration_events(df, columns=['Weight (%)'])
+
+    assert events['Asset Name'].tolist() == ['Asset 0', 'Asset 0']
+    assert events['Category Change'].astype(str).tolist() == ['Up', 'Down']
+    assert events['Country'].isna().all()
+    assert events['Previous ESG Category'].astype(str).tolist() == ['BBB', 'AA']
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from portfolio_analytics.parallel import _blocks, fork_context, security_transforms
+
+# Transforms of the tests, one of each kind
+TRANSFORMS = {'Previous Price': ('previous', 'price'), 'Return': ('pct_change', 'price')}
+
+
+@pytest.fixture
+def shuffled():
+    # Securities of uneven lengths, their rows shuffled as they come in the holdings
+    rng = np.random.default_rng(7)
+    lengths = rng.integers(1, 40, size=60)
+    security = np.repeat(np.arange(len(lengths)), lengths)
+    price = rng.uniform(10, 100, size=len(security))
+    shuffle = rng.permutation(len(security))
+    order = np.argsort(security[shuffle], kind='stable')
+    starts = np.r_[True, np.diff(security) != 0]
+    return {'price': price[shuffle]}, starts, order
+
+
+def test_blocks_are_cut_where_a_security_starts(shuffled):
+    _, starts, _ = shuffled
+    blocks = _blocks(starts, 8)
+
+    assert len(blocks) > 1
+    assert blocks[0][0] == 0 and blocks[-1][1] == len(starts)
+    assert all(end == start for (_, end), (start, _) in zip(blocks[:-1], blocks[1:]))
+    assert starts[[start for start, _ in blocks]].all()
+
+
+def test_forked_workers_match_in_process(shuffled):
+    if fork_context() is None:
+        pytest.skip('fork is not available, the transforms always run in-process')
+    columns, starts, order = shuffled
+
+    expected = security_transforms(columns, starts, TRANSFORMS, order=order, max_workers=1)
+    forked = security_transforms(columns, starts, TRANSFORMS, order=order, max_workers=2, min_rows=0)
+
+    assert forked.keys() == expected.keys()
+    for output in TRANSFORMS:
+        np.testing.assert_array_equal(forked[output], expected[output])
+    assert np.isnan(forked['Previous Price'][starts]).all()
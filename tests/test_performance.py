@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_analytics.performance import (add_contributions, build_performance_state, compounded_performance,
+                                             daily_performance, update_performance_state)
+
+
+def _with_duplicates(equities):
+    # Second rows, with another price and weight, of securities already held on the same day
+    dates = np.sort(equities['refdate'].unique())
+    extra = []
+    for day, position in [(5, 3), (6, 10), (20, 3), (20, 3)]:
+        row = equities[equities['refdate'] == dates[day]].iloc[[position]].copy()
+        row['Price(USD)'] *= 1.1
+        row['Weight (%)'] *= 0.5
+        extra.append(row)
+    return pd.concat([equities] + extra).sort_values('refdate', kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('duplicates', [False, True])
+def test_incremental_performance_matches_add_contributions(equities, duplicates):
+    df = _with_duplicates(equities) if duplicates else equities
+    dates = np.sort(df['refdate'].unique())
+    expected = daily_performance(add_contributions(df))
+
+    state = build_performance_state(df[df['refdate'] <= dates[3]])
+    for end in [dates[4], dates[20], dates[-1]]:
+        state = update_performance_state(state, df[df['refdate'] <= end])
+
+    np.testing.assert_allclose(state['daily']['Contribution'].to_numpy(), expected['Contribution'].to_numpy(), atol=1e-15)
+    np.testing.assert_allclose(state['daily']['compounded_return'].to_numpy(),
+                               expected['compounded_return'].to_numpy(), atol=1e-12)
+
+
+def test_state_file_extends_the_saved_performance(tmp_path, equities):
+    state_path = str(tmp_path / 'performance.pkl')
+    dates = np.sort(equities['refdate'].unique())
+
+    compounded_performance(equities[equities['refdate'] <= dates[30]], state_path=state_path)
+    daily = compounded_performance(equities, state_path=state_path)
+
+    pd.testing.assert_frame_equal(daily, compounded_performance(equities), check_dtype=False)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_analytics.benchmark import generate_holdings
+from portfolio_analytics.holdings import load_holdings
+from portfolio_analytics.quality import validate_holdings
+
+
+@pytest.fixture
+def bad_workbook(tmp_path):
+    raw = generate_holdings(n_securities=20, n_days=20, seed=2)
+    raw.loc[3, 'refdate'] = '31/02/2022'
+    raw.loc[5, 'Price(USD)'] = np.nan
+    raw.loc[7, 'Overall ESG Score'] = 12.5
+    raw = pd.concat([raw, raw.iloc[[10]]], ignore_index=True)
+    path = tmp_path / 'holdings.xlsx'
+    raw.to_excel(path, index=False)
+    return str(path)
+
+
+def test_rules_find_the_problems(holdings):
+    df = holdings.copy()
+    df.loc[df.index[0], 'Overall ESG Score'] = -1
+    df = pd.concat([df, df.iloc[[1]]], ignore_index=True)
+
+    exceptions = validate_holdings(df, rules=['duplicate_row', 'score_range', 'missing_price'])
+
+    assert exceptions['rule'].tolist() == ['duplicate_row', 'score_range']
+    assert validate_holdings(holdings, rules=['duplicate_row', 'score_range', 'missing_price']).empty
+    with pytest.raises(ValueError):
+        validate_holdings(holdings, rules=['nope'])
+
+
+def test_every_load_warns_about_the_exceptions(bad_workbook):
+    rules = ['unparsed_refdate', 'duplicate_row', 'missing_price', 'score_range']
+    for _ in range(2):
+        # The first load builds the cache, the second reads it
+        with pytest.warns(UserWarning, match='unparsed_refdate are left out') as record:
+            df = load_holdings(bad_workbook)
+        message = str(record[-1].message)
+        assert all(rule in message for rule in rules)
+        assert df['refdate'].notna().all()
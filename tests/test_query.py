@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_analytics.benchmark import generate_holdings
+from portfolio_analytics.performance import add_contributions
+from portfolio_analytics.query import Derivation, Query, col, execute, last_date, optimize
+
+
+def _equities(source):
+    return Query.scan(source).filter(col('GICS_sector').notna()).derive('Market Cap Bucket')
+
+
+def test_filters_move_before_row_local_derivations_only(holdings):
+    query = (Query.scan(holdings).derive('Market Cap Bucket').derive('Contribution')
+             .filter(col('Country') == 'US').group_sum(['Market Cap Bucket'], ['Contribution']))
+
+    steps, columns = optimize(query)
+
+    kinds = [step[1].key[1] if step[0] == 'filter' else step[1][0] for step in steps]
+    assert kinds == ['Market Cap Bucket', 'Contribution', 'Country']
+    assert 'Active Weight (%)' not in columns
+
+
+def test_unused_derivations_are_dropped(holdings):
+    calls = []
+    derivation = Derivation(['Price(USD)'], lambda frame: calls.append(len(frame)) or frame['Price(USD)'] * 2)
+
+    query = Query.scan(holdings).derive('Double Price', derivation).collect(['Asset Name'])
+    steps, columns = optimize(query)
+    names = query.execute()
+
+    assert steps == [] and columns == {'Asset Name'}
+    assert list(names.columns) == ['Asset Name'] and len(names) == len(holdings)
+    assert calls == []
+
+
+def test_shared_plans_match_eager_pandas(holdings, equities):
+    equity_query = _equities(holdings)
+    results = execute({
+        'last_day': equity_query.filter(last_date()).group_sum(['GICS_sector'], ['Weight (%)']),
+        'ytd': equity_query.derive('Contribution').filter(col('refdate') >= '2023-01-01')
+                           .group_sum(['Market Cap Bucket'], ['Contribution']),
+        'us': equity_query.filter(col('Country').isin(['US'])).collect(['refdate', 'Asset Name', 'Weight (%)']),
+    })
+
+    last_day = equities[equities['refdate'] == equities['refdate'].max()]
+    expected = last_day.groupby('GICS_sector', observed=True)['Weight (%)'].sum().reset_index()
+    pd.testing.assert_frame_equal(results['last_day'], expected, check_dtype=False, check_categorical=False)
+
+    contributions = add_contributions(equities)
+    ytd = contributions[contributions['refdate'] >= '2023-01-01']
+    expected = ytd.groupby('Market Cap Bucket', observed=True)['Contribution'].sum()
+    np.testing.assert_allclose(results['ytd']['Contribution'].to_numpy(), expected.to_numpy(), atol=1e-15)
+
+    us = equities[equities['Country'] == 'US']
+    assert len(results['us']) == len(us)
+    np.testing.assert_allclose(results['us']['Weight (%)'].to_numpy(), us['Weight (%)'].to_numpy())
+
+
+def test_workbook_scan_matches_frame_scan(tmp_path, holdings):
+    pytest.importorskip('pyarrow')
+    workbook = tmp_path / 'holdings.xlsx'
+    generate_holdings(n_securities=40, n_days=60, start='2022-11-01', seed=1).to_excel(workbook, index=False)
+
+    query = (_equities(str(workbook)).filter(col('refdate') >= '2023-01-01')
+             .group_sum(['GICS_sector', 'Market Cap Bucket'], ['Weight (%)']))
+    expected = Query(holdings, query.steps, query.result).execute()
+
+    pd.testing.assert_frame_equal(query.execute(), expected, check_dtype=False, check_categorical=False)
+
+
+def test_scans_of_the_same_workbook_share_a_source(tmp_path, monkeypatch, holdings):
+    pytest.importorskip('pyarrow')
+    generate_holdings(n_securities=40, n_days=60, start='2022-11-01', seed=1).to_excel(tmp_path / 'holdings.xlsx', index=False)
+    monkeypatch.chdir(tmp_path)
+
+    results = execute({
+        'absolute': _equities(str(tmp_path / 'holdings.xlsx')).group_sum(['GICS_sector'], ['Weight (%)']),
+        'relative': _equities('holdings.xlsx').group_sum(['GICS_sector'], ['Weight (%)']),
+    })
+
+    pd.testing.assert_frame_equal(results['absolute'], results['relative'])
+    with pytest.raises(ValueError):
+        execute({'frame': _equities(holdings).collect(['Asset Name']),
+                 'copy': _equities(holdings.copy()).collect(['Asset Name'])})
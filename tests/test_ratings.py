@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_analytics.esg import daily_esg_summary
+from portfolio_analytics.ratings import MSCI_THRESHOLDS, PILLAR_CATEGORIES, RATING_LABELS, categorize_esg_scores, rate_pillars
+from portfolio_analytics.schema import enforce_schema
+
+# Scores exactly on every threshold and just under it, and the ratings they get
+SCORES = [score for threshold in MSCI_THRESHOLDS for score in (threshold - 0.001, threshold)]
+EXPECTED = [label for lower, upper in zip(RATING_LABELS[:-1], RATING_LABELS[1:]) for label in (lower, upper)]
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_scores_on_the_thresholds_get_the_rating_above(dtype):
+    ratings = categorize_esg_scores(pd.Series(SCORES, dtype=dtype))
+
+    assert ratings.astype(str).tolist() == EXPECTED
+
+
+def test_pillars_stored_by_the_schema_get_the_rating_above():
+    df, _ = enforce_schema(pd.DataFrame({column: SCORES for column in PILLAR_CATEGORIES}), required=False)
+    assert (df.dtypes[list(PILLAR_CATEGORIES)] == np.float32).all()
+
+    ratings = rate_pillars(df)
+
+    for rating_column in PILLAR_CATEGORIES.values():
+        assert ratings[rating_column].astype(str).tolist() == EXPECTED
+
+
+def test_esg_summary_buckets_the_thresholds_like_the_ratings():
+    scores = pd.DataFrame({column: SCORES for column in PILLAR_CATEGORIES})
+    df, _ = enforce_schema(scores.assign(refdate=pd.Timestamp('2023-01-02'), **{'Weight (%)': 1.0}), required=False)
+
+    _, buckets = daily_esg_summary(df)
+
+    held = buckets['Overall ESG Category'].iloc[0]
+    expected = {label: EXPECTED.count(label) / len(EXPECTED) for label in RATING_LABELS}
+    assert held.to_dict() == pytest.approx(expected)
@@ -0,0 +1,15 @@
+from portfolio_analytics.rendering import DEFAULT_OUTPUT_DIR, OUTPUT_DIR_VARIABLE, RenderQueue
+
+
+def test_explicit_output_dir_wins_over_the_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv(OUTPUT_DIR_VARIABLE, str(tmp_path / 'environment'))
+
+    assert RenderQueue(output_dir=str(tmp_path / 'explicit'), headless=True).output_dir == str(tmp_path / 'explicit')
+    assert RenderQueue(headless=True).output_dir == str(tmp_path / 'environment')
+
+
+def test_headless_default_output_dir(monkeypatch):
+    monkeypatch.delenv(OUTPUT_DIR_VARIABLE, raising=False)
+
+    assert RenderQueue(headless=True).output_dir == DEFAULT_OUTPUT_DIR
+    assert RenderQueue(headless=False).output_dir is None
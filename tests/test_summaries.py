@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_analytics.summaries import TOTAL_LABEL, grouping_sets, portfolio_grouping_sets
+
+DIMENSIONS = ['GICS_sector', 'Country', 'Market Cap Bucket']
+VALUES = ['Weight (%)', 'Active Weight (%)']
+
+
+def test_grouping_sets_match_one_groupby_per_dimension(equities):
+    summary = grouping_sets(equities, DIMENSIONS, VALUES)
+
+    for dimension in DIMENSIONS:
+        expected = equities.groupby(['refdate', dimension], observed=True)[VALUES].agg(['sum', 'size'])
+        rows = summary[summary['Dimension'] == dimension].set_index(['refdate', 'Group'])
+        assert len(rows) == len(expected)
+        for value in VALUES:
+            np.testing.assert_allclose(rows[value].to_numpy(), expected[(value, 'sum')].to_numpy(), atol=1e-15)
+        np.testing.assert_array_equal(rows['Count'].to_numpy(), expected[(VALUES[0], 'size')].to_numpy())
+
+
+def test_totals_include_rows_with_missing_groups(equities):
+    df = equities.copy()
+    df['Country'] = df['Country'].astype(object).where(df['Asset Name'] != 'Asset 0', None)
+
+    summary = grouping_sets(df, ['Country'], VALUES)
+
+    totals = summary[summary['Dimension'] == TOTAL_LABEL].set_index('refdate')
+    expected = df.groupby('refdate')[VALUES].sum()
+    np.testing.assert_allclose(totals[VALUES].to_numpy(), expected.to_numpy(), atol=1e-15)
+    countries = summary[summary['Dimension'] == 'Country'].groupby('refdate')['Count'].sum()
+    assert (countries < totals['Count']).any()
+
+
+def test_portfolio_grouping_sets_match_each_portfolio(equities):
+    dates = np.sort(equities['refdate'].unique())
+    portfolios = {'A': equities, 'B': equities[equities['refdate'] >= dates[30]]}
+
+    combined = portfolio_grouping_sets(portfolios, DIMENSIONS, VALUES)
+
+    for name, frame in portfolios.items():
+        expected = grouping_sets(frame, DIMENSIONS, VALUES)
+        actual = combined[combined['Portfolio'] == name].drop(columns='Portfolio').reset_index(drop=True)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)